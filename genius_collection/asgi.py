@@ -11,6 +11,8 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'genius_collection.settings')
+is_prod = 'WEBSITE_HOSTNAME' in os.environ
+settings_module = 'genius_collection.production' if is_prod else 'genius_collection.settings'
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
 
 application = get_asgi_application()
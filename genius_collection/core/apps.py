@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'genius_collection.core'
+
+    def ready(self):
+        from .instrumentation import install_query_recorder
+        connection_created.connect(install_query_recorder, dispatch_uid='install_query_recorder')
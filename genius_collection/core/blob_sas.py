@@ -1,66 +1,65 @@
 import datetime
-import time
-from django.core.cache import cache
-from azure.identity import DefaultAzureCredential
+import logging
+from typing import Callable, Optional
 from azure.storage.blob import (
-    BlobServiceClient,
     BlobSasPermissions,
     UserDelegationKey,
     generate_container_sas
 )
 
-STORAGE_ACCOUNT = "gcollection"
-HOST = f"https://{STORAGE_ACCOUNT}.blob.core.windows.net"
+from .instrumentation import record_cache
+from .metrics import time_cache_fill
+from .storage import HOST, STORAGE_ACCOUNT, get_blob_service_client
+from .tiered_cache import TieredCache
+
 USER_DELEGATION_KEY_CACHE = "user_delegation_key"
 CACHE_BUFFER_TIME = datetime.timedelta(minutes=1)
+VALIDITY = datetime.timedelta(days=1)
+
+logger = logging.getLogger(__name__)
+
+# Shared by all worker processes, so that only one of them asks Azure for a new key or signs a new token.
+# The entries expire shortly before the key or token, so every cached one can be used.
+user_delegation_keys = TieredCache("user-delegation-key", maxsize=1)
+container_sas_tokens = TieredCache("container-sas", maxsize=64)
 
 
 # Microsoft recommends the use of Azure AD credentials as a security best practice,
 # rather than using the account key, which can be more easily compromised.
 def request_user_delegation_key() -> UserDelegationKey:
+    user_delegation_key = user_delegation_keys.get(USER_DELEGATION_KEY_CACHE)
+    record_cache("delegation-key", user_delegation_key is not None)
+    if user_delegation_key is not None:
+        return user_delegation_key
+
     start_time = datetime.datetime.now(datetime.timezone.utc)
-    cached_key = cache.get(USER_DELEGATION_KEY_CACHE)
-    if cached_key and cached_key["expiry"] > start_time + CACHE_BUFFER_TIME:
-        return cached_key["value"]
-
-    # If the key isn't in cache, fetch a new one.
-    print("Requesting user delegation key")
-    expiry_time = start_time + datetime.timedelta(days=1)
-    blob_service_client = BlobServiceClient(HOST, credential=DefaultAzureCredential())
-    user_delegation_key = blob_service_client.get_user_delegation_key(
-        key_start_time=start_time,
-        key_expiry_time=expiry_time
-    )
+    expiry_time = start_time + VALIDITY
+
+    def fetch_user_delegation_key():
+        logger.info("Requesting user delegation key")
+        return get_blob_service_client().get_user_delegation_key(
+            key_start_time=start_time,
+            key_expiry_time=expiry_time
+        )
+
+    with time_cache_fill("delegation-key"):
+        return user_delegation_keys.get_or_set(USER_DELEGATION_KEY_CACHE, fetch_user_delegation_key,
+                                               (expiry_time - CACHE_BUFFER_TIME).timestamp())
 
-    # Cache the key for its validity period.
-    cache_duration = int((expiry_time - start_time).total_seconds())
-    print(f"Caching user delegation key for {cache_duration} seconds")
-    cache.set(USER_DELEGATION_KEY_CACHE, {"value": user_delegation_key, "expiry": expiry_time}, cache_duration)
 
-    return user_delegation_key
+def get_expiry(user_delegation_key: UserDelegationKey) -> datetime.datetime:
+    return datetime.datetime.strptime(user_delegation_key.signed_expiry, "%Y-%m-%dT%H:%M:%SZ").replace(
+        tzinfo=datetime.timezone.utc)
 
 
 def create_container_sas(
         user_delegation_key: UserDelegationKey,
-        container_name: str
+        container_name: str,
+        start_time: datetime.datetime,
+        expiry_time: datetime.datetime
 ) -> str:
-    start_time = datetime.datetime.now(datetime.timezone.utc)
-    cached_sas = cache.get(container_name)
-
-    # Debugging
-    print(f"Entered function 'create_container_sas' for container_name '{container_name}' with start_time '{start_time}' (UTC)")
-    if cached_sas:
-        print(f"Cached key exists that expires on: {cached_sas['expiry']}")
-    else:
-        print("No key cached")
-
-    if cached_sas and cached_sas["expiry"] > start_time + CACHE_BUFFER_TIME:
-        return cached_sas["value"]
-
-    # If the SAS token isn't in cache, create a new one.
-    print(f"Creating {container_name} container SAS token")
-    expiry_time = start_time + datetime.timedelta(days=1)
-    container_sas = generate_container_sas(
+    logger.info("Creating %s container SAS token valid until %s", container_name, expiry_time)
+    return generate_container_sas(
         account_name=STORAGE_ACCOUNT,
         container_name=container_name,
         user_delegation_key=user_delegation_key,
@@ -69,17 +68,42 @@ def create_container_sas(
         start=start_time
     )
 
-    # Cache the SAS token for its validity period.
-    cache_duration = int((expiry_time - start_time).total_seconds())
-    print(f"Caching {container_name} container SAS token for {cache_duration} seconds")
-    cache.set(container_name, {"value": container_sas, "expiry": expiry_time}, cache_duration)
 
-    return container_sas
+def get_container_sas(container_name: str) -> str:
+    """
+    Return the cached SAS token of the container. The user delegation key is only looked up to create a new one.
+    """
+    container_sas = container_sas_tokens.get(container_name)
+    record_cache("sas", container_sas is not None)
+    if container_sas is not None:
+        return container_sas
+
+    with time_cache_fill("sas"):
+        user_delegation_key = request_user_delegation_key()
+        start_time = datetime.datetime.now(datetime.timezone.utc)
+        # A token is only valid as long as the key it is signed with
+        expiry_time = min(start_time + VALIDITY, get_expiry(user_delegation_key))
+        return container_sas_tokens.get_or_set(
+            container_name, lambda: create_container_sas(user_delegation_key, container_name, start_time, expiry_time),
+            (expiry_time - CACHE_BUFFER_TIME).timestamp())
+
+
+def blob_sas_url_builder(container_name: str) -> Callable[[str, Optional[str]], str]:
+    """
+    Resolve the SAS token of the container once and return a function that formats blob URLs with it.
+    Use it when building the URLs of many blobs within one request.
+    """
+    prefix = f"{HOST}/{container_name}/"
+    suffix = f".jpg?{get_container_sas(container_name)}"
+
+    def blob_sas_url(image_name: str, image_version: Optional[str] = None) -> str:
+        # The version only changes with the image, so browsers can keep caching the URL until then
+        if image_version:
+            return f"{prefix}{image_name.lower()}{suffix}&v={image_version}"
+        return f"{prefix}{image_name.lower()}{suffix}"
+
+    return blob_sas_url
 
 
-def get_blob_sas_url(container_name: str, image_name: str) -> str:
-    blob_name = f'{image_name.lower()}.jpg'
-    user_delegation_key = request_user_delegation_key()
-    sas_token = create_container_sas(user_delegation_key, container_name)
-    # Add timestamp to URL so that the browser reloads the image
-    return f"{HOST}/{container_name}/{blob_name}?{sas_token}&timestamp={time.time()}"
+def get_blob_sas_url(container_name: str, image_name: str, image_version: Optional[str] = None) -> str:
+    return blob_sas_url_builder(container_name)(image_name, image_version)
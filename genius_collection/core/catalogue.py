@@ -0,0 +1,94 @@
+"""
+Snapshot of all cards as prebuilt JSON, shared by the collections of all users. The collection of a user is the
+snapshot with the quantities of the user appended to every card, see CardViewSet.list.
+"""
+import gzip
+import threading
+from typing import NamedTuple
+
+from django.db.models import Count, Max
+from rest_framework.utils.encoders import JSONEncoder
+
+from .blob_sas import blob_sas_url_builder, get_container_sas
+from .models import QUERY_CHUNK_SIZE, Card
+
+CATALOGUE_FIELDS = ['id', 'name', 'acronym', 'job', 'start_at_ipt', 'email', 'wish_destination', 'wish_person',
+                    'wish_skill', 'best_advice', 'image_version', 'updated_at']
+CATALOGUE_CONTAINER = 'card-thumbnails'
+
+# Encodes like the JSONRenderer of DRF
+encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+class CatalogueSnapshot(NamedTuple):
+    # Changes with every card, and with the SAS token of the image URLs
+    version: str
+    # Position of every card in the catalogue by id
+    positions: dict[int, int]
+    # The JSON object of every card without its closing brace, so that the quantities can be appended
+    fragments: list[bytes]
+    # The JSON object of every card as in the collection of a user who does not own it
+    unowned: list[bytes]
+    json: bytes
+    gzip: bytes
+
+    def render_collection(self, ownerships: dict) -> bytes:
+        """
+        Return the JSON of the collection with the given (quantity, last_received) per card id.
+        Only the owned cards are encoded per user.
+        """
+        parts = list(self.unowned)
+        for card_id, (quantity, last_received) in ownerships.items():
+            position = self.positions.get(card_id)
+            # Unless the card was created after the snapshot
+            if position is not None:
+                parts[position] = b'%s,"quantity":%d,"last_received":%s}' % (
+                    self.fragments[position], quantity, encoder.encode(last_received).encode())
+        return b'[' + b','.join(parts) + b']'
+
+
+def get_catalogue_version() -> str:
+    """
+    Every change of a card sets its updated_at, and deleted cards change the count. So the version follows all
+    changes, also those of other processes.
+    """
+    stats = Card.objects.aggregate(count=Count('id'), updated_at=Max('updated_at'))
+    updated_at = stats['updated_at'].isoformat() if stats['updated_at'] else ''
+    return f'{stats["count"]}:{updated_at}:{get_container_sas(CATALOGUE_CONTAINER)}'
+
+
+def build_catalogue_snapshot(version: str) -> CatalogueSnapshot:
+    blob_sas_url = blob_sas_url_builder(CATALOGUE_CONTAINER)
+    positions, fragments = {}, []
+    for card in Card.objects.order_by('id').values(*CATALOGUE_FIELDS).iterator(chunk_size=QUERY_CHUNK_SIZE):
+        card['image_url'] = blob_sas_url(card['email'], card['image_version'])
+        positions[card['id']] = len(fragments)
+        fragments.append(encoder.encode(card).encode()[:-1])
+    unowned = [fragment + b',"quantity":0,"last_received":null}' for fragment in fragments]
+    catalogue = b'[' + b','.join(fragment + b'}' for fragment in fragments) + b']'
+    return CatalogueSnapshot(version, positions, fragments, unowned, catalogue, gzip.compress(catalogue, mtime=0))
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_catalogue_snapshot(version: str = None) -> CatalogueSnapshot:
+    """
+    Return the snapshot of this process, rebuilt if a card changed since. Pass the current catalogue version if it
+    is already known.
+    """
+    global _snapshot
+
+    if version is None:
+        version = get_catalogue_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _snapshot_lock:
+        if _snapshot is not None and _snapshot.version == version:
+            # Another thread rebuilt the snapshot while this one was waiting
+            return _snapshot
+        _snapshot = build_catalogue_snapshot(version)
+        return _snapshot
@@ -0,0 +1,30 @@
+import hashlib
+from typing import Optional
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+
+
+def make_etag(*parts) -> str:
+    """
+    Build an ETag from everything the representation depends on.
+    """
+    return quote_etag(hashlib.sha256(':'.join(str(p) for p in parts).encode()).hexdigest()[:32])
+
+
+def set_etag(response, etag):
+    response['ETag'] = etag
+    # The representation depends on the user, and clients should ask again on every use
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def get_not_modified_response(request, etag) -> Optional[HttpResponse]:
+    """
+    Returns a 304 response if the client already has the representation with this ETag (If-None-Match).
+    """
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        set_etag(response, etag)
+    return response
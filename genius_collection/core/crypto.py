@@ -16,11 +16,15 @@ def decode_value(val):
     return int.from_bytes(decoded, 'big')
 
 
-def rsa_pem_from_jwk(jwk):
+def rsa_public_key_from_jwk(jwk):
     return RSAPublicNumbers(
         n=decode_value(jwk['n']),
         e=decode_value(jwk['e'])
-    ).public_key(default_backend()).public_bytes(
+    ).public_key(default_backend())
+
+
+def rsa_pem_from_jwk(jwk):
+    return rsa_public_key_from_jwk(jwk).public_bytes(
         encoding=serialization.Encoding.PEM,
         format=serialization.PublicFormat.SubjectPublicKeyInfo
-    )
\ No newline at end of file
+    )
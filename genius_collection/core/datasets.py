@@ -0,0 +1,88 @@
+"""
+Synthetic data for benchmarks, see the commands generate_dataset, benchmark_collection and benchmark_endpoints.
+"""
+import datetime
+import random
+from typing import NamedTuple
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .leaderboard import invalidate_leaderboard
+from .models import QUERY_CHUNK_SIZE, Card, Ownership, Quiz, User
+from .quiz_pool import invalidate_quiz_candidate_index
+
+CARD_EMAIL_PREFIX = 'synthetic.card'
+USER_EMAIL_PREFIX = 'synthetic.user'
+JOBS = ['Consultant', 'Senior Consultant', 'Principal', 'Partner', 'Business Analyst', 'Software Engineer']
+QUIZ_TYPES = [Quiz.QuizType.IMAGE, Quiz.QuizType.NAME, Quiz.QuizType.JOB, Quiz.QuizType.ACRONYM]
+
+
+class Dataset(NamedTuple):
+    cards: int
+    users: int
+    ownerships: int
+    quizzes: int
+
+
+def generate_dataset(num_cards: int, num_users: int, owned_per_user: int, quizzes_per_user: int,
+                     seed: int = None) -> Dataset:
+    """
+    Create cards, users with a random collection each, and answered quiz questions. The same seed creates the
+    same dataset.
+    """
+    rng = random.Random(seed)
+    start = datetime.date(2000, 1, 1)
+    now = timezone.now()
+    with transaction.atomic():
+        Card.objects.bulk_create([
+            Card(name=f'Synthetic Card {i}', acronym=f'{i % 1000:03}', job=rng.choice(JOBS),
+                 start_at_ipt=start + datetime.timedelta(days=rng.randrange(9000)),
+                 email=f'{CARD_EMAIL_PREFIX}{i}@ipt.ch',
+                 wish_destination='Lisbon', wish_person='Ada Lovelace', wish_skill='Juggling',
+                 best_advice='Ask early.', image_version=f'{i:016x}')
+            for i in range(num_cards)], batch_size=QUERY_CHUNK_SIZE)
+        User.objects.bulk_create([
+            User(first_name='Synthetic', last_name=f'User {i}', email=f'{USER_EMAIL_PREFIX}{i}@ipt.ch',
+                 quiz_score=rng.randrange(1000), last_received_unique=now)
+            for i in range(num_users)], batch_size=QUERY_CHUNK_SIZE)
+
+        card_ids = list(Card.objects.filter(email__startswith=CARD_EMAIL_PREFIX).values_list('id', flat=True))
+        user_ids = list(User.objects.filter(email__startswith=USER_EMAIL_PREFIX).values_list('id', flat=True))
+        ownerships, quizzes = [], []
+        num_ownerships = num_quizzes = 0
+        for user_id in user_ids:
+            for card_id in rng.sample(card_ids, min(owned_per_user, len(card_ids))):
+                ownerships.append(Ownership(user_id=user_id, card_id=card_id, quantity=rng.randint(1, 5),
+                                            last_received=now))
+            for _ in range(quizzes_per_user if card_ids else 0):
+                quizzes.append(Quiz(user_id=user_id, question_true_card_id=rng.choice(card_ids),
+                                    question_type=rng.choice(QUIZ_TYPES), answer_type=Quiz.QuizType.NAME,
+                                    answer_timestamp=now, answer_options=4, answer_correct=rng.random() < 0.6))
+            # Written in chunks, so that the largest datasets do not have to fit into memory
+            if len(ownerships) + len(quizzes) >= QUERY_CHUNK_SIZE:
+                num_ownerships += len(Ownership.objects.bulk_create(ownerships, batch_size=QUERY_CHUNK_SIZE))
+                num_quizzes += len(Quiz.objects.bulk_create(quizzes, batch_size=QUERY_CHUNK_SIZE))
+                ownerships, quizzes = [], []
+        num_ownerships += len(Ownership.objects.bulk_create(ownerships, batch_size=QUERY_CHUNK_SIZE))
+        num_quizzes += len(Quiz.objects.bulk_create(quizzes, batch_size=QUERY_CHUNK_SIZE))
+        invalidate_leaderboard()
+        invalidate_quiz_candidate_index()
+    return Dataset(len(card_ids), len(user_ids), num_ownerships, num_quizzes)
+
+
+def delete_dataset() -> int:
+    """
+    Delete everything created by generate_dataset. Returns the number of deleted rows.
+    """
+    with transaction.atomic():
+        deleted = Quiz.objects.filter(Q(user__email__startswith=USER_EMAIL_PREFIX) |
+                                      Q(question_true_card__email__startswith=CARD_EMAIL_PREFIX)).delete()[0]
+        deleted += Ownership.objects.filter(Q(user__email__startswith=USER_EMAIL_PREFIX) |
+                                            Q(card__email__startswith=CARD_EMAIL_PREFIX)).delete()[0]
+        deleted += User.objects.filter(email__startswith=USER_EMAIL_PREFIX).delete()[0]
+        deleted += Card.objects.filter(email__startswith=CARD_EMAIL_PREFIX).delete()[0]
+        invalidate_leaderboard()
+        invalidate_quiz_candidate_index()
+    return deleted
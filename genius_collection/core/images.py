@@ -0,0 +1,65 @@
+"""
+Renders the variants of the uploaded pictures, which the clients download instead of the original.
+"""
+import hashlib
+import io
+from typing import NamedTuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Image URLs are versioned by content, so the browser may keep an image until its URL changes
+IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# The original is replaced before the worker versions it with its variants, so until then (or for good, if the job
+# fails) its current URL points to the new picture. Browsers have to revalidate it.
+ORIGINAL_IMAGE_CACHE_CONTROL = 'no-cache'
+
+
+class ImageVariant(NamedTuple):
+    container_name: str
+    # The picture is scaled down to fit into this box, keeping its aspect ratio
+    max_size: tuple[int, int]
+    quality: int
+
+
+IMAGE_VARIANTS = [
+    ImageVariant('card-detail-views', (1024, 1024), 85),
+    ImageVariant('card-thumbnails', (320, 320), 80),
+]
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+def get_image_version(data: bytes) -> str:
+    """
+    Version the image by its content, so its URLs only change when the picture does.
+    """
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def render_variants(data: bytes) -> dict[str, bytes]:
+    """
+    Decode the JPEG once and encode every variant as progressive JPEG, which browsers show before it is loaded
+    completely. Returns the encoded variants by container.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.format != 'JPEG':
+            raise InvalidImage(f'Expected a JPEG, got {image.format}')
+        # Let the decoder scale down by a power of two on the fly, which is much faster than decoding in full
+        largest = max(variant.max_size for variant in IMAGE_VARIANTS)
+        image.draft('RGB', largest)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    except (UnidentifiedImageError, OSError) as e:
+        raise InvalidImage(str(e)) from e
+
+    variants = {}
+    # Every variant is scaled from the next larger one, and no metadata of the original is kept
+    for variant in sorted(IMAGE_VARIANTS, key=lambda v: v.max_size, reverse=True):
+        image = image.copy()
+        image.thumbnail(variant.max_size, Image.Resampling.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=variant.quality, progressive=True, optimize=True)
+        variants[variant.container_name] = output.getvalue()
+    return variants
@@ -0,0 +1,202 @@
+"""
+Instruments every request: the number and duration of its SQL queries, the hits and misses of the caches in front
+of Azure and its total latency. They are sent in the Server-Timing header of the response and summed up per
+endpoint for the instrumentation endpoint. Views declare their query budget with the query_budget decorator.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metrics import count_cache_lookup
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    db_time: float = 0.0
+    cache_hits: Counter = field(default_factory=Counter)
+    cache_misses: Counter = field(default_factory=Counter)
+
+
+@dataclass
+class EndpointStats:
+    requests: int = 0
+    total_time: float = 0.0
+    db_time: float = 0.0
+    queries: int = 0
+    max_queries: int = 0
+    budget_exceeded: int = 0
+    cache_hits: Counter = field(default_factory=Counter)
+    cache_misses: Counter = field(default_factory=Counter)
+
+
+# Copied into the threads and event loops of the request by asgiref, so async views are instrumented as well
+_request_stats: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar('request_stats', default=None)
+_endpoint_stats: dict[str, EndpointStats] = {}
+_endpoint_stats_lock = threading.Lock()
+
+
+def query_budget(max_queries: int):
+    """
+    Declare the maximum number of queries of the decorated view method. Exceeding it is logged, and fails the
+    request if the setting QUERY_BUDGETS_ENFORCED is set, like in the tests.
+    """
+    def decorate(func):
+        func.query_budget = max_queries
+        return func
+
+    return decorate
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _request_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    Receiver of the connection_created signal, see apps.py.
+    """
+    # The signal is sent again whenever the connection reconnects
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_cache(name: str, hit: bool):
+    """
+    Count a cache lookup for the Server-Timing header and for the Prometheus metrics, also outside of requests.
+    """
+    count_cache_lookup(name, hit)
+    stats = _request_stats.get()
+    if stats is not None:
+        (stats.cache_hits if hit else stats.cache_misses)[name] += 1
+
+
+def get_endpoint(request, view_func) -> tuple[str, Optional[int]]:
+    """
+    Return the name of the view method handling the request, e.g. CardViewSet.transfer, and its query budget.
+    """
+    view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+    if view_class is None:
+        return f'{view_func.__module__}.{view_func.__name__}', None
+    # Viewsets map the methods to their actions
+    actions = getattr(view_func, 'actions', None)
+    method_name = actions.get(request.method.lower()) if actions else request.method.lower()
+    handler = getattr(view_class, method_name or '', None)
+    return f'{view_class.__name__}.{method_name}', getattr(handler, 'query_budget', None)
+
+
+def format_server_timing(stats: RequestStats, total_time: float) -> str:
+    metrics = [f'db;dur={stats.db_time * 1e3:.1f};desc="{stats.queries} queries"']
+    for name in sorted(stats.cache_hits.keys() | stats.cache_misses.keys()):
+        metrics.append(f'cache-{name};desc="{stats.cache_hits[name]} hits {stats.cache_misses[name]} misses"')
+    metrics.append(f'total;dur={total_time * 1e3:.1f}')
+    return ', '.join(metrics)
+
+
+def get_endpoint_stats() -> dict:
+    """
+    Return the stats of all endpoints that handled a request in this process.
+    """
+    with _endpoint_stats_lock:
+        return {endpoint: {
+            'requests': stats.requests,
+            'avg_ms': round(stats.total_time / stats.requests * 1e3, 2),
+            'avg_db_ms': round(stats.db_time / stats.requests * 1e3, 2),
+            'avg_queries': round(stats.queries / stats.requests, 2),
+            'max_queries': stats.max_queries,
+            'budget_exceeded': stats.budget_exceeded,
+            'cache_hits': dict(stats.cache_hits),
+            'cache_misses': dict(stats.cache_misses),
+        } for endpoint, stats in sorted(_endpoint_stats.items())}
+
+
+def reset_endpoint_stats():
+    with _endpoint_stats_lock:
+        _endpoint_stats.clear()
+
+
+class InstrumentationMiddleware:
+    """
+    Should be the first middleware, so that the latency includes all others. Async-capable, so that async views
+    are not pushed into the thread of the sync views when served with ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_stats.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    @staticmethod
+    def finish(request, response, stats: RequestStats, total_time: float):
+        response['Server-Timing'] = format_server_timing(stats, total_time)
+
+        # Not set if no view was resolved
+        endpoint, budget = getattr(request, '_instrumented_endpoint', (None, None))
+        if endpoint is None:
+            return response
+        budget_exceeded = budget is not None and stats.queries > budget
+        with _endpoint_stats_lock:
+            endpoint_stats = _endpoint_stats.setdefault(endpoint, EndpointStats())
+            endpoint_stats.requests += 1
+            endpoint_stats.total_time += total_time
+            endpoint_stats.db_time += stats.db_time
+            endpoint_stats.queries += stats.queries
+            endpoint_stats.max_queries = max(endpoint_stats.max_queries, stats.queries)
+            endpoint_stats.budget_exceeded += budget_exceeded
+            endpoint_stats.cache_hits.update(stats.cache_hits)
+            endpoint_stats.cache_misses.update(stats.cache_misses)
+
+        if budget_exceeded:
+            message = f'{endpoint} ran {stats.queries} queries, its budget is {budget}'
+            if settings.QUERY_BUDGETS_ENFORCED:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._instrumented_endpoint = get_endpoint(request, view_func)
@@ -0,0 +1,210 @@
+import datetime
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .images import IMAGE_CACHE_CONTROL, InvalidImage, get_image_version, render_variants
+from .jwt_validation import forget_user
+from .leaderboard import invalidate_leaderboard
+from .models import QUERY_CHUNK_SIZE, Card, Job, Ownership, OwnershipTombstone, User
+from .quiz_pool import invalidate_quiz_candidate_index
+from .storage import get_blob_storage
+
+# A worker has to finish a job within its lease, otherwise another worker takes it over
+JOB_LEASE = datetime.timedelta(minutes=10)
+# Doubled with every failed attempt
+RETRY_DELAY = datetime.timedelta(seconds=30)
+
+logger = logging.getLogger(__name__)
+
+_handlers: dict[str, Callable[[Job], Optional[dict]]] = {}
+
+
+def job_handler(kind: str):
+    """
+    Register the decorated function to run the jobs of the given kind. It gets the job and returns its result.
+    Jobs may run more than once, so the function has to be idempotent.
+    """
+    def register(func):
+        _handlers[kind] = func
+        return func
+
+    return register
+
+
+def enqueue_job(kind: str, payload: dict, idempotency_key: str = None, created_by: User = None) -> tuple[Job, bool]:
+    """
+    Queue a new job, or return the existing job with the same idempotency key. Like get_or_create.
+    """
+    if kind not in _handlers:
+        raise ValueError(f'Unknown job kind: {kind}')
+    try:
+        with transaction.atomic():
+            job = Job.objects.create(kind=kind, payload=payload, idempotency_key=idempotency_key,
+                                     created_by=created_by)
+            return job, True
+    except IntegrityError:
+        if idempotency_key is None:
+            raise
+        return Job.objects.get(idempotency_key=idempotency_key), False
+
+
+def claim_job(worker_id: str) -> Optional[Job]:
+    """
+    Lock the next due job for this worker. Returns None if there is nothing to do.
+    """
+    while True:
+        now = timezone.now()
+        due = Q(status=Job.Status.QUEUED, run_after__lte=now) | Q(status=Job.Status.RUNNING, locked_until__lt=now)
+        with transaction.atomic():
+            job = Job.objects.select_for_update(skip_locked=True).filter(due).order_by('run_after', 'id').first()
+            if job is None:
+                return None
+            # Databases without row locks (SQLite) rely on these compare-and-swaps to hand out a job only once
+            lease = Job.objects.filter(pk=job.pk, status=job.status, locked_until=job.locked_until)
+            if job.status == Job.Status.RUNNING and job.attempts >= job.max_attempts:
+                # The workers of all attempts crashed or got stuck
+                lease.update(status=Job.Status.FAILED, finished_at=now, error='Lease expired.', locked_by=None,
+                             locked_until=None)
+                continue
+            claimed = lease.update(status=Job.Status.RUNNING, locked_by=worker_id, locked_until=now + JOB_LEASE,
+                                   attempts=F('attempts') + 1)
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def report_progress(job: Job, progress: int, total: int = None):
+    """
+    Store the progress of the job. Called within the transaction of a step, it commits together with the step.
+    """
+    job.progress = progress
+    job.total = total if total is not None else job.total
+    Job.objects.filter(pk=job.pk).update(progress=job.progress, total=job.total)
+
+
+def run_job(job: Job):
+    try:
+        result = _handlers[job.kind](job)
+    except Exception:
+        logger.exception('Job %s failed in attempt %s of %s', job, job.attempts, job.max_attempts)
+        if job.attempts < job.max_attempts:
+            changes = {'status': Job.Status.QUEUED,
+                       'run_after': timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)}
+        else:
+            changes = {'status': Job.Status.FAILED, 'finished_at': timezone.now()}
+        changes.update(error=traceback.format_exc(), locked_by=None, locked_until=None)
+    else:
+        logger.info('Job %s succeeded', job)
+        changes = {'status': Job.Status.SUCCEEDED, 'result': result, 'finished_at': timezone.now(),
+                   'locked_by': None, 'locked_until': None}
+
+    # Only the worker holding the lease may finish the job
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(**changes)
+    for field, value in changes.items():
+        setattr(job, field, value)
+
+
+def run_pending_jobs(worker_id: str) -> int:
+    """
+    Run jobs until none is due anymore. Returns the number of jobs run.
+    """
+    count = 0
+    while (job := claim_job(worker_id)) is not None:
+        run_job(job)
+        count += 1
+    return count
+
+
+@job_handler('distribute')
+def distribute_cards(job: Job) -> dict:
+    """
+    Gives every user of the payload [quantity] random cards. Every chunk of users commits together with the
+    progress, so a retry continues after the last finished chunk instead of giving cards twice.
+    """
+    user_ids = job.payload['user_ids']
+    qty = job.payload['quantity']
+    for start in range(job.progress, len(user_ids), QUERY_CHUNK_SIZE):
+        chunk = user_ids[start:start + QUERY_CHUNK_SIZE]
+        with transaction.atomic():
+            # Users deleted in the meantime are left out, users listed several times get cards for every time
+            users_by_id = User.objects.only('id').in_bulk(chunk)
+            users = [users_by_id[user_id] for user_id in chunk if user_id in users_by_id]
+            Ownership.objects.distribute_random_cards_to_users(users, qty)
+            report_progress(job, start + len(chunk), len(user_ids))
+    return {'receivers': len(user_ids), 'cards': len(user_ids) * qty}
+
+
+@job_handler('delete_user_and_card')
+def delete_user_and_card(job: Job) -> dict:
+    """
+    Deletes a user, its connected card and all ownerships related to the card or user, and the picture.
+    Parts that are already gone are skipped, so the job can be run again.
+    """
+    email = job.payload['email']
+    report_progress(job, 0, 2)
+    with transaction.atomic():
+        user_to_delete = User.objects.filter(email=email).first()
+        if user_to_delete is not None:
+            Ownership.objects.filter(user=user_to_delete).delete()
+            user_to_delete.delete()
+            transaction.on_commit(lambda: forget_user(email))
+            user_answer = 'User Objekt wurde in der Datenbank gefunden und gelöscht.'
+        else:
+            user_answer = 'User Objekt wurde nicht gelöscht, da es in der Datenbank nicht gefunden wurde.'
+
+        card_to_delete = Card.objects.filter(email=email).first()
+        if card_to_delete is not None:
+            Ownership.objects.filter(card=card_to_delete).delete()
+            OwnershipTombstone.objects.create(card_id=card_to_delete.pk)
+            card_to_delete.delete()
+            invalidate_quiz_candidate_index()
+            card_answer = 'Card Objekt wurde in der Datenbank gefunden und gelöscht.'
+        else:
+            card_answer = 'Card Objekt wurde nicht gelöscht, da es in der Datenbank nicht gefunden wurde.'
+        invalidate_leaderboard()
+        report_progress(job, 1)
+
+    if get_blob_storage().delete('card-originals', f'{email}.jpg'):
+        image_answer = 'Card Image wurde im Storage Container gefunden und gelöscht.'
+    else:
+        image_answer = 'Card Image wurde nicht gelöscht, da es im Storage Container nicht gefunden wurde.'
+    report_progress(job, 2)
+
+    return {'status': f'User-Email: [{email}]. {user_answer} {card_answer} {image_answer}'}
+
+
+@job_handler('render_picture')
+def render_picture(job: Job) -> dict:
+    """
+    Renders the variants of the uploaded picture of a card and uploads them concurrently. The card only gets the
+    new image version afterwards, so its URLs never point to variants that are not uploaded yet.
+    """
+    email = job.payload['email']
+    storage = get_blob_storage()
+    original = storage.download('card-originals', f'{email}.jpg')
+    # Of the current original, in case it was replaced since this job was queued
+    image_version = get_image_version(original)
+    try:
+        variants = render_variants(original)
+    except InvalidImage as e:
+        # Would fail again, so it is not retried
+        return {'status': f'Bild von [{email}] konnte nicht verarbeitet werden: {e}'}
+
+    def upload(container_name):
+        # The URLs of the variants are built with the lowercase email
+        storage.upload(container_name, f'{email.lower()}.jpg', variants[container_name], content_type='image/jpeg',
+                       cache_control=IMAGE_CACHE_CONTROL)
+
+    with ThreadPoolExecutor(len(variants)) as pool:
+        list(pool.map(upload, variants))
+
+    with transaction.atomic():
+        Card.objects.filter(email=email).update(image_version=image_version, updated_at=timezone.now())
+        invalidate_quiz_candidate_index()
+    return {'image_version': image_version, 'variants': {name: len(data) for name, data in variants.items()}}
@@ -0,0 +1,266 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+
+import aiohttp
+import requests
+from asgiref.sync import sync_to_async
+
+from .crypto import rsa_public_key_from_jwk
+from .instrumentation import record_cache
+from .tiered_cache import TieredCache
+
+logger = logging.getLogger(__name__)
+
+JWKS_REFRESH_INTERVAL = 24 * 60 * 60
+# Refresh in the background once a key set is older than this, so requests never wait for the expiry
+JWKS_REFRESH_AHEAD = 60 * 60
+# Unknown kids are not looked up again for this long
+UNKNOWN_KID_DURATION = 5 * 60
+# A new key set is fetched for an unknown kid at most this often
+MIN_FETCH_INTERVAL = 30
+FETCH_TIMEOUT = 5
+
+
+# The key stores keep the parsed keys in memory, so only the shared tier is used
+jwks_documents = TieredCache('jwks', maxsize=0)
+
+
+class JWKSFetchError(Exception):
+    pass
+
+
+class UnknownKidError(KeyError):
+    pass
+
+
+class JWKSKeyStore:
+    """
+    Keeps the parsed public keys of a JWKS endpoint in memory by kid.
+    Concurrent fetches are merged into one, and the key set is refreshed in the background before it expires.
+    Fetched key sets are shared with the other processes through the shared cache, see tiered_cache.py.
+    """
+
+    def __init__(self, jwks_uri, refresh_interval=JWKS_REFRESH_INTERVAL, refresh_ahead=JWKS_REFRESH_AHEAD,
+                 unknown_kid_duration=UNKNOWN_KID_DURATION, min_fetch_interval=MIN_FETCH_INTERVAL,
+                 timeout=FETCH_TIMEOUT):
+        self.jwks_uri = jwks_uri
+        self.refresh_interval = refresh_interval
+        self.refresh_ahead = refresh_ahead
+        self.unknown_kid_duration = unknown_kid_duration
+        self.min_fetch_interval = min_fetch_interval
+        self.timeout = timeout
+        self._keys = {}
+        self._fetched_at = None
+        # When the key set in memory was fetched by any process, in seconds since the epoch
+        self._shared_fetched_at = 0
+        self._unknown_kids = {}
+        self._fetch_lock = threading.Lock()
+        self._async_fetch = None
+        self._async_fetch_lock = threading.Lock()
+        self._background_refresh = None
+
+    def get_key(self, kid):
+        now = time.monotonic()
+        key = self._keys.get(kid)
+        if key is not None:
+            if now - self._fetched_at > self.refresh_interval:
+                try:
+                    self.refresh(force=True)
+                except JWKSFetchError as e:
+                    # Rather keep using an outdated key than failing every request
+                    logger.warning("Refresh of expired %s failed: %s", self.jwks_uri, e)
+                    return key
+                return self.get_key(kid)
+            record_cache('jwk', True)
+            if now - self._fetched_at > self.refresh_interval - self.refresh_ahead:
+                self.refresh_in_background()
+            return key
+
+        record_cache('jwk', False)
+
+        unknown_until = self._unknown_kids.get(kid)
+        if unknown_until is not None and unknown_until > now:
+            raise UnknownKidError(kid)
+
+        self.refresh(force=False)
+        key = self._keys.get(kid)
+        if key is None:
+            self._unknown_kids[kid] = time.monotonic() + self.unknown_kid_duration
+            raise UnknownKidError(kid)
+        return key
+
+    async def aget_key(self, kid):
+        """
+        Like get_key, but fetches with the async HTTP client, so that the event loop is not blocked.
+        """
+        now = time.monotonic()
+        key = self._keys.get(kid)
+        if key is not None:
+            if now - self._fetched_at > self.refresh_interval:
+                try:
+                    await self.arefresh(force=True)
+                except JWKSFetchError as e:
+                    logger.warning("Refresh of expired %s failed: %s", self.jwks_uri, e)
+                    return key
+                return await self.aget_key(kid)
+            record_cache('jwk', True)
+            if now - self._fetched_at > self.refresh_interval - self.refresh_ahead:
+                self.refresh_in_background()
+            return key
+
+        record_cache('jwk', False)
+
+        unknown_until = self._unknown_kids.get(kid)
+        if unknown_until is not None and unknown_until > now:
+            raise UnknownKidError(kid)
+
+        await self.arefresh(force=False)
+        key = self._keys.get(kid)
+        if key is None:
+            self._unknown_kids[kid] = time.monotonic() + self.unknown_kid_duration
+            raise UnknownKidError(kid)
+        return key
+
+    def refresh(self, force=True):
+        """
+        Fetch the key set. Threads arriving while a fetch is running wait for it instead of fetching again.
+        Unless forced, nothing is fetched if the key set is younger than the minimal fetch interval.
+        """
+        fetched_at = self._fetched_at
+        with self._fetch_lock:
+            if self._fetched_at != fetched_at:
+                # Another thread fetched the key set while this one was waiting
+                return
+            if not force and fetched_at is not None and time.monotonic() - fetched_at < self.min_fetch_interval:
+                return
+            self._keys = self.fetch_keys()
+            self._fetched_at = time.monotonic()
+            self._unknown_kids = {}
+
+    async def arefresh(self, force=True):
+        """
+        Like refresh, but without blocking. Callers arriving while a fetch is running await its result,
+        whichever thread or event loop they run in.
+        """
+        fetched_at = self._fetched_at
+        with self._async_fetch_lock:
+            if self._fetched_at != fetched_at:
+                return
+            if not force and fetched_at is not None and time.monotonic() - fetched_at < self.min_fetch_interval:
+                return
+            fetch = self._async_fetch
+            if fetch is None:
+                fetch = self._async_fetch = concurrent.futures.Future()
+                is_fetching = True
+            else:
+                is_fetching = False
+
+        if not is_fetching:
+            await asyncio.wrap_future(fetch)
+            return
+        try:
+            keys = await self.afetch_keys()
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self._unknown_kids = {}
+            fetch.set_result(None)
+        except BaseException as e:
+            fetch.set_exception(e)
+            raise
+        finally:
+            with self._async_fetch_lock:
+                self._async_fetch = None
+
+    def refresh_in_background(self):
+        if self._background_refresh is not None and self._background_refresh.is_alive():
+            return
+        self._background_refresh = threading.Thread(target=self._refresh_quietly, daemon=True)
+        self._background_refresh.start()
+
+    def _refresh_quietly(self):
+        try:
+            self.refresh(force=True)
+        except JWKSFetchError as e:
+            # The current keys stay valid until the next attempt
+            logger.warning("Background refresh of %s failed: %s", self.jwks_uri, e)
+
+    def fetch_keys(self):
+        jwks = self.get_shared_jwks()
+        if jwks is not None:
+            return self.parse_keys(jwks)
+
+        logger.info("Fetching JWKS from %s", self.jwks_uri)
+        try:
+            resp = requests.get(self.jwks_uri, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise JWKSFetchError(f'Could not fetch {self.jwks_uri}: {e.__class__.__name__}')
+        if not resp.ok:
+            raise JWKSFetchError(f'Received {resp.status_code} response code from {self.jwks_uri}')
+        try:
+            jwks = resp.json()
+        except ValueError:
+            raise JWKSFetchError(f'Received malformed response from {self.jwks_uri}')
+        keys = self.parse_keys(jwks)
+        self.share_jwks(jwks)
+        return keys
+
+    async def afetch_keys(self):
+        jwks = await sync_to_async(self.get_shared_jwks)()
+        if jwks is not None:
+            return self.parse_keys(jwks)
+
+        logger.info("Fetching JWKS from %s", self.jwks_uri)
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+                async with session.get(self.jwks_uri) as resp:
+                    if not resp.ok:
+                        raise JWKSFetchError(f'Received {resp.status} response code from {self.jwks_uri}')
+                    jwks = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise JWKSFetchError(f'Could not fetch {self.jwks_uri}: {e.__class__.__name__}')
+        except ValueError:
+            raise JWKSFetchError(f'Received malformed response from {self.jwks_uri}')
+        keys = self.parse_keys(jwks)
+        await sync_to_async(self.share_jwks)(jwks)
+        return keys
+
+    def get_shared_jwks(self):
+        """
+        Return the key set another process fetched after the one in memory, unless it is due for a refresh.
+        """
+        document = jwks_documents.get(self.jwks_uri)
+        if document is None:
+            return None
+        jwks, fetched_at = document
+        if fetched_at <= self._shared_fetched_at or time.time() - fetched_at > self.refresh_ahead:
+            return None
+        self._shared_fetched_at = fetched_at
+        return jwks
+
+    def share_jwks(self, jwks):
+        self._shared_fetched_at = time.time()
+        jwks_documents.set(self.jwks_uri, (jwks, self._shared_fetched_at), self._shared_fetched_at + self.refresh_interval)
+
+    def parse_keys(self, jwks):
+        try:
+            return {jwk['kid']: rsa_public_key_from_jwk(jwk) for jwk in jwks['keys'] if jwk.get('kty') == 'RSA'}
+        except (TypeError, KeyError):
+            raise JWKSFetchError(f'Received malformed response from {self.jwks_uri}')
+
+
+_key_stores = {}
+_key_stores_lock = threading.Lock()
+
+
+def get_key_store(jwks_uri) -> JWKSKeyStore:
+    """
+    Return the process-wide key store of the JWKS endpoint.
+    """
+    key_store = _key_stores.get(jwks_uri)
+    if key_store is None:
+        with _key_stores_lock:
+            key_store = _key_stores.setdefault(jwks_uri, JWKSKeyStore(jwks_uri))
+    return key_store
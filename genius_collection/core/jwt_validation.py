@@ -1,12 +1,16 @@
-import datetime
+import hashlib
 import logging
 import re
-from django.core.cache import cache
+import time
 from django.http import HttpRequest
-import requests
 import jwt
 
-from .crypto import rsa_pem_from_jwk
+from .instrumentation import record_cache
+from .jwks import JWKSFetchError, UnknownKidError, get_key_store
+from .metrics import time_cache_fill
+from .models import User
+from .tiered_cache import TieredCache
+from .ttl_cache import TTLCache
 
 from rest_framework import authentication
 from rest_framework import exceptions
@@ -23,32 +27,73 @@ class InvalidAuthorizationToken(AzureVerifyTokenError):
         super().__init__(f'Invalid authorization token: {details}')
 
 
+# Verified tokens by their hash, so that repeated calls with the same token skip the signature verification
+verified_tokens = TTLCache(maxsize=1024)
+# User ids by email, so that endpoints which only need the id of the current user don't query it. Only in the
+# shared cache, so that the worker deleting a user forgets its id in all processes
+user_ids = TieredCache('user-id', maxsize=0)
+USER_ID_TTL = 60 * 60
+
+
 class JWTAccessTokenAuthentication(authentication.BaseAuthentication):
-    def authenticate(self, request: HttpRequest):
-        regex_bearer = re.compile(r'^[Bb]earer (.*)$')
-        valid_audience = 'api://ae04e6aa-6cb5-4c16-9d3b-45bd6a79845c'
-        issue = 'https://sts.windows.net/a9080dcf-8589-4cb6-a2e2-21398dc6c671/'
-        jwks_uri = 'https://login.microsoftonline.com/a9080dcf-8589-4cb6-a2e2-21398dc6c671/discovery/v2.0/keys'
+    regex_bearer = re.compile(r'^[Bb]earer (.*)$')
+    valid_audience = 'api://ae04e6aa-6cb5-4c16-9d3b-45bd6a79845c'
+    issuer = 'https://sts.windows.net/a9080dcf-8589-4cb6-a2e2-21398dc6c671/'
+    jwks_uri = 'https://login.microsoftonline.com/a9080dcf-8589-4cb6-a2e2-21398dc6c671/discovery/v2.0/keys'
 
+    def authenticate(self, request: HttpRequest):
+        raw_jwt, token_hash = self.get_token(request)
+        current_user = verified_tokens.get(token_hash)
+        record_cache('token', current_user is not None)
+        if current_user is None:
+            with time_cache_fill('token'):
+                decoded_token = self.verify_jwt(token=raw_jwt,
+                                                valid_audiences=[self.valid_audience],
+                                                issuer=self.issuer,
+                                                jwks_uri=self.jwks_uri,
+                                                verify=True, )
+            current_user = self.remember_token(token_hash, decoded_token)
+        return dict(current_user), self
+
+    async def aauthenticate(self, request: HttpRequest):
+        """
+        Like authenticate, for async views. A missing signing key is fetched without blocking the event loop.
+        """
+        raw_jwt, token_hash = self.get_token(request)
+        current_user = verified_tokens.get(token_hash)
+        record_cache('token', current_user is not None)
+        if current_user is None:
+            with time_cache_fill('token'):
+                decoded_token = await self.averify_jwt(token=raw_jwt,
+                                                       valid_audiences=[self.valid_audience],
+                                                       issuer=self.issuer,
+                                                       jwks_uri=self.jwks_uri,
+                                                       verify=True, )
+            current_user = self.remember_token(token_hash, decoded_token)
+        return dict(current_user), self
+
+    def get_token(self, request: HttpRequest):
+        """
+        Return the raw JWT of the authorization header and its hash.
+        """
         # Extract header
         header_authorization_value = request.headers.get('authorization')
         if not header_authorization_value:
             raise exceptions.AuthenticationFailed("Authorization header is not present")
         # Extract supposed raw JWT
-        match = regex_bearer.match(header_authorization_value)
+        match = self.regex_bearer.match(header_authorization_value)
         if not match:
             raise exceptions.AuthenticationFailed("Authorization header must start with Bearer followed by its token")
         raw_jwt = match.groups()[-1]
-        decoded_token = self.verify_jwt(token=raw_jwt,
-                                        valid_audiences=[valid_audience],
-                                        issuer=issue,
-                                        jwks_uri=jwks_uri,
-                                        verify=True, )
+        return raw_jwt, hashlib.sha256(raw_jwt.encode()).hexdigest()
 
+    @staticmethod
+    def remember_token(token_hash, decoded_token) -> dict:
         current_user = {'email': decoded_token['unique_name'],
                         'first_name': decoded_token['given_name'],
                         'last_name': decoded_token['family_name']}
-        return current_user, self
+        verified_tokens.set(token_hash, current_user, expires_at=decoded_token['exp'])
+        return current_user
 
     def verify_jwt(self,
                    token,
@@ -58,6 +103,20 @@ class JWTAccessTokenAuthentication(authentication.BaseAuthentication):
                    verify=True
                    ):
         public_key = self.get_public_key(token=token, jwks_uri=jwks_uri)
+        return self.decode_jwt(token, public_key, valid_audiences, issuer, verify)
+
+    async def averify_jwt(self,
+                          token,
+                          valid_audiences,
+                          jwks_uri,
+                          issuer,
+                          verify=True
+                          ):
+        public_key = await self.aget_public_key(token=token, jwks_uri=jwks_uri)
+        return self.decode_jwt(token, public_key, valid_audiences, issuer, verify)
+
+    @staticmethod
+    def decode_jwt(token, public_key, valid_audiences, issuer, verify=True):
         try:
             decoded = jwt.decode(
                 token,
@@ -74,8 +133,21 @@ class JWTAccessTokenAuthentication(authentication.BaseAuthentication):
 
     def get_public_key(self, token, jwks_uri):
         kid = self.get_kid(token)
-        jwk = self.get_jwk(kid=kid, jwks_uri=jwks_uri)
-        return rsa_pem_from_jwk(jwk)
+        try:
+            return get_key_store(jwks_uri).get_key(kid)
+        except JWKSFetchError as e:
+            raise AzureVerifyTokenError(str(e))
+        except UnknownKidError:
+            raise InvalidAuthorizationToken('kid not recognized')
+
+    async def aget_public_key(self, token, jwks_uri):
+        kid = self.get_kid(token)
+        try:
+            return await get_key_store(jwks_uri).aget_key(kid)
+        except JWKSFetchError as e:
+            raise AzureVerifyTokenError(str(e))
+        except UnknownKidError:
+            raise InvalidAuthorizationToken('kid not recognized')
 
     @staticmethod
     def get_kid(token):
@@ -87,28 +159,37 @@ class JWTAccessTokenAuthentication(authentication.BaseAuthentication):
         except KeyError:
             raise InvalidAuthorizationToken('kid missing from headers')
 
-    @staticmethod
-    def get_jwk(kid, jwks_uri):
-        cached_jwk = cache.get(kid)
-        if cached_jwk:
-            return cached_jwk
-
-        # If the JWK for the given 'kid' is not found in the cache, fetch the JWKS
-        resp = requests.get(jwks_uri)
-        if not resp.ok:
-            raise AzureVerifyTokenError(
-                f'Received {resp.status_code} response code from {jwks_uri}'
-            )
-        try:
-            jwks = resp.json()
-        except (ValueError, TypeError):
-            raise AzureVerifyTokenError(
-                f'Received malformed response from {jwks_uri}'
-            )
-        for jwk in jwks.get('keys'):
-            cache_duration = int(datetime.timedelta(days=1).total_seconds())
-            print(f"Caching JWK for KID '{jwk.get('kid')}' for {cache_duration} seconds")
-            cache.set(jwk.get('kid'), jwk, cache_duration)
-            if jwk.get('kid') == kid:
-                return jwk
-        raise InvalidAuthorizationToken('kid not recognized')
+
+def get_current_user(request) -> User:
+    """
+    Return the User of the authenticated identity. It is loaded at most once per request.
+    Raises User.DoesNotExist if the identity has no User yet.
+    """
+    current_user = getattr(request, '_current_user', None)
+    if current_user is None:
+        email = request.user['email']
+        user_id = user_ids.get(email)
+        if user_id is not None:
+            current_user = User.objects.filter(pk=user_id, email=email).first()
+        if current_user is None:
+            current_user = User.objects.get(email=email)
+            user_ids.set(email, current_user.pk, time.time() + USER_ID_TTL)
+        request._current_user = current_user
+    return current_user
+
+
+def get_current_user_id(request) -> int:
+    """
+    Return the id of the User of the authenticated identity, without a query if it is known.
+    """
+    current_user = getattr(request, '_current_user', None)
+    if current_user is not None:
+        return current_user.pk
+    user_id = user_ids.get(request.user['email'])
+    if user_id is None:
+        user_id = get_current_user(request).pk
+    return user_id
+
+
+def forget_user(email):
+    user_ids.delete(email)
@@ -0,0 +1,146 @@
+import base64
+import binascii
+import json
+import time
+import uuid
+
+from django.db import transaction
+from django.db.models import Count, F, Sum, Window
+from django.db.models.functions import Rank
+
+from .tiered_cache import TieredCache
+
+LEADERBOARD_CACHE = "leaderboard"
+LEADERBOARD_GENERATION_CACHE = "leaderboard_generation"
+LEADERBOARD_CACHE_DURATION = 60 * 60
+BOARDS = {'cards': 'rankingCards', 'quiz': 'rankingQuiz'}
+
+# Only in the shared cache, so that the changes of every process, e.g. of the worker, invalidate it
+leaderboards = TieredCache('leaderboard', maxsize=0)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def invalidate_leaderboard():
+    """
+    Start a new generation of the leaderboard once the current transaction commits, so it is rebuilt on the next
+    read.
+    """
+    transaction.on_commit(bump_leaderboard_generation)
+
+
+def bump_leaderboard_generation():
+    """
+    Make every process build a new leaderboard. A build that read the ranking before stores it under the old
+    generation, where it is not read anymore.
+    """
+    leaderboards.set(LEADERBOARD_GENERATION_CACHE, uuid.uuid4().hex)
+
+
+def get_leaderboard() -> dict:
+    # Read before the ranking, like the version of the quiz candidate index. Without a known generation (e.g. after
+    # a restart of the cache) the stored leaderboards cannot be trusted, so a new one is set
+    generation = leaderboards.get_or_set(LEADERBOARD_GENERATION_CACHE, lambda: uuid.uuid4().hex)
+    return leaderboards.get_or_set(f'{LEADERBOARD_CACHE}:{generation}', build_leaderboard,
+                                   time.time() + LEADERBOARD_CACHE_DURATION)
+
+
+def build_leaderboard() -> dict:
+    """
+    Rank all users by unique cards and by quiz score with a single windowed query.
+    """
+    # Imported here because the model managers invalidate the leaderboard.
+    from .models import Card, Distribution, Ownership, User
+
+    users = User.objects.annotate(
+        unique_cards_count=Count('ownership'),
+        cards_rank=Window(Rank(), order_by=[F('unique_cards_count').desc(),
+                                            F('last_received_unique').asc(nulls_last=True),
+                                            F('email').asc()]),
+        quiz_rank=Window(Rank(), order_by=[F('quiz_score').desc(), F('email').asc()])
+    ).values('email', 'first_name', 'last_name', 'last_received_unique', 'quiz_score', 'unique_cards_count',
+             'cards_rank', 'quiz_rank').order_by('cards_rank')
+
+    ranking_cards = []
+    ranking_quiz = []
+    unique_cards_counts = {}
+    for u in users:
+        score = {
+            'uniqueCardsCount': u['unique_cards_count'],
+            'displayName': f'{u["first_name"]} {u["last_name"]}',
+            'userEmail': u['email'],
+            'last_received_unique': u['last_received_unique'],
+            'quizScore': u['quiz_score']
+        }
+        ranking_cards.append(dict(score, rank=u['cards_rank']))
+        ranking_quiz.append(dict(score, rank=u['quiz_rank']))
+        unique_cards_counts[u['email']] = u['unique_cards_count']
+    ranking_quiz.sort(key=lambda r: r['rank'])
+    positions = {board: {r['userEmail']: i for i, r in enumerate(ranking)}
+                 for board, ranking in (('cards', ranking_cards), ('quiz', ranking_quiz))}
+
+    last_distribution = Distribution.objects.order_by('-timestamp').values_list('timestamp', flat=True).first()
+
+    return {
+        # Identifies this build of the leaderboard, e.g. for ETags
+        'version': uuid.uuid4().hex,
+        'rankingCards': ranking_cards,
+        'rankingQuiz': ranking_quiz,
+        'positions': positions,
+        'uniqueCardsCounts': unique_cards_counts,
+        'totalCardQuantity': Ownership.objects.aggregate(total_quantity=Sum('quantity'))['total_quantity'],
+        'allCardsCount': Card.objects.count(),
+        'lastDistribution': last_distribution
+    }
+
+
+def encode_cursor(row: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps([row['userEmail'], row['rank']]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        email, rank = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(email), int(rank)
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+
+
+def get_leaderboard_page(board: str, cursor: str = None, limit: int = 20) -> dict:
+    """
+    Return [limit] rows of a ranking, starting after the row the cursor points to.
+    The cursor names the last row of the previous page, so pages continue after that user even if ranks moved.
+    """
+    leaderboard = get_leaderboard()
+    ranking = leaderboard[BOARDS[board]]
+    start = 0
+    if cursor:
+        email, rank = decode_cursor(cursor)
+        position = leaderboard['positions'][board].get(email)
+        # Fall back to the rank if the user of the cursor is gone in the meantime
+        start = max(rank, 0) if position is None else position + 1
+    rows = ranking[start:start + limit]
+    has_next = start + limit < len(ranking)
+    return {
+        'results': rows,
+        'next': encode_cursor(rows[-1]) if rows and has_next else None,
+        'count': len(ranking)
+    }
+
+
+def get_leaderboard_around(board: str, email: str, radius: int = 5) -> dict:
+    """
+    Return the rows ranked at most [radius] places above or below the given user.
+    """
+    leaderboard = get_leaderboard()
+    ranking = leaderboard[BOARDS[board]]
+    position = leaderboard['positions'][board].get(email)
+    if position is None:
+        return {'results': [], 'rank': None, 'count': len(ranking)}
+    return {
+        'results': ranking[max(0, position - radius):position + radius + 1],
+        'rank': ranking[position]['rank'],
+        'count': len(ranking)
+    }
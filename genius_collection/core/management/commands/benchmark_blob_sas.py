@@ -0,0 +1,31 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from genius_collection.core import blob_sas
+from genius_collection.core.testing import stub_container_sas
+
+
+class Command(BaseCommand):
+    help = 'Measures the cost per card of building blob SAS URLs one by one and in a batch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, nargs='+', default=[10, 100, 1000],
+                            help='Numbers of cards to build URLs for.')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of runs per measurement, best is kept.')
+
+    def handle(self, *args, **options):
+        container_name = 'card-thumbnails'
+        # Seed the cache, so that neither Azure nor the SAS signing is part of the measurement
+        with stub_container_sas(container_name):
+            self.stdout.write(f'{"cards":>8} {"single [us/card]":>18} {"batched [us/card]":>18}')
+            for num_cards in options['cards']:
+                emails = [f'first.last{i}@ipt.ch' for i in range(num_cards)]
+                single = min(timeit.repeat(
+                    lambda: [blob_sas.get_blob_sas_url(container_name, e) for e in emails],
+                    number=1, repeat=options['repeat']))
+                # Like the list endpoints, which build all URLs of a response with one builder
+                batched = min(timeit.repeat(
+                    lambda: list(map(blob_sas.blob_sas_url_builder(container_name), emails)),
+                    number=1, repeat=options['repeat']))
+                self.stdout.write(f'{num_cards:>8} {single / num_cards * 1e6:>18.2f} {batched / num_cards * 1e6:>18.2f}')
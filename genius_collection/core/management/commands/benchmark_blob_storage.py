@@ -0,0 +1,40 @@
+import os
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from genius_collection.core.storage import close_blob_service_client, get_blob_storage
+
+
+class Command(BaseCommand):
+    help = ('Measures the upload and delete latency of the configured blob storage backend, '
+            'see the setting BLOB_STORAGE_BACKEND. The blobs are written to a separate container.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--container', default='benchmark', help='Container the blobs are written to.')
+        parser.add_argument('--count', type=int, default=20, help='Number of blobs uploaded and deleted.')
+        parser.add_argument('--size', type=int, default=200 * 1024, help='Size of a blob in bytes.')
+        parser.add_argument('--fresh-clients', action='store_true',
+                            help='Create a new client and credential for every call, like before the clients '
+                                 'were pooled.')
+
+    def handle(self, *args, **options):
+        storage = get_blob_storage()
+        data = os.urandom(options['size'])
+        latencies = {'upload': [], 'delete': []}
+        for i in range(options['count']):
+            for operation, call in [('upload', lambda name: storage.upload(options['container'], name, data,
+                                                                             content_type='image/jpeg')),
+                                    ('delete', lambda name: storage.delete(options['container'], name))]:
+                if options['fresh_clients']:
+                    close_blob_service_client()
+                start = time.perf_counter()
+                call(f'{i}.jpg')
+                latencies[operation].append(time.perf_counter() - start)
+
+        self.stdout.write(f'{type(storage).__name__}, {"fresh" if options["fresh_clients"] else "pooled"} clients')
+        self.stdout.write(f'{"operation":>10} {"first [ms]":>11} {"p50 [ms]":>9} {"max [ms]":>9}')
+        for operation, values in latencies.items():
+            self.stdout.write(f'{operation:>10} {values[0] * 1e3:>11.1f} {statistics.median(values) * 1e3:>9.1f} '
+                              f'{max(values) * 1e3:>9.1f}')
@@ -0,0 +1,103 @@
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.renderers import JSONRenderer
+
+from genius_collection.core.catalogue import get_catalogue_snapshot
+from genius_collection.core.datasets import USER_EMAIL_PREFIX, generate_dataset
+from genius_collection.core.models import Ownership, User
+from genius_collection.core.testing import stub_container_sas
+
+# The collection query before it was rebuilt on the user id, kept as baseline
+EMAIL_CTE_QUERY = """
+    with co as (
+    select
+        *
+    from
+        core_ownership co
+    join core_user cu on
+        co.user_id = cu.id
+    where
+        cu.email = %s)
+    select
+        coalesce(co.quantity, 0) as quantity,
+        co.last_received,
+        cc.*
+    from
+        core_card cc
+    left join co on
+        cc.id = co.card_id
+"""
+
+# The collection query on the user id, before the cards were taken from the catalogue snapshot
+USER_ID_QUERY = """
+    select
+        coalesce(co.quantity, 0) as quantity,
+        co.last_received,
+        cc.*
+    from
+        core_card cc
+    left join core_ownership co on
+        co.card_id = cc.id
+        and co.user_id = %s
+"""
+
+
+def blob_sas_url(image_name, image_version=None):
+    return f'https://gcollection.blob.core.windows.net/card-thumbnails/{image_name}.jpg?sig=benchmark&v={image_version}'
+
+
+class Command(BaseCommand):
+    help = ('Measures building the collection of the card list against a generated dataset. '
+            'The dataset is created in a transaction that is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=2000, help='Number of generated cards.')
+        parser.add_argument('--users', type=int, default=2000, help='Number of generated users.')
+        parser.add_argument('--owned', type=int, default=200, help='Number of distinct cards owned per user.')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of requests per measurement.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            dataset = generate_dataset(options['cards'], options['users'], options['owned'], 0)
+            self.stdout.write(f'Generated {dataset}')
+            users = list(User.objects.filter(email__startswith=USER_EMAIL_PREFIX))
+            sample = random.sample(users, min(options['repeat'], len(users)))
+
+            renderer = JSONRenderer()
+
+            def email_cte():
+                for user in sample:
+                    with connection.cursor() as cursor:
+                        cursor.execute(EMAIL_CTE_QUERY, [user.email])
+                        columns = [col[0] for col in cursor.description]
+                        card_dicts = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                    renderer.render([dict(c, **{'image_url': blob_sas_url(c['email'], c['image_version'])})
+                                     for c in card_dicts])
+
+            def user_id_query():
+                for user in sample:
+                    with connection.cursor() as cursor:
+                        cursor.execute(USER_ID_QUERY, [user.id])
+                        columns = [col[0] for col in cursor.description]
+                        card_dicts = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                    renderer.render([dict(c, **{'image_url': blob_sas_url(c['email'], c['image_version'])})
+                                     for c in card_dicts])
+
+            def catalogue_snapshot():
+                for user in sample:
+                    snapshot = get_catalogue_snapshot()
+                    ownerships = {card_id: (quantity, last_received) for card_id, quantity, last_received in
+                                  Ownership.objects.filter(user=user).values_list('card_id', 'quantity',
+                                                                                  'last_received')}
+                    snapshot.render_collection(ownerships)
+
+            self.stdout.write(f'{"query":>20} {"ms/request":>12}')
+            with stub_container_sas('card-thumbnails'):
+                for name, run in [('email CTE', email_cte), ('user id query', user_id_query),
+                                  ('catalogue snapshot', catalogue_snapshot)]:
+                    best = min(timeit.repeat(run, number=1, repeat=3))
+                    self.stdout.write(f'{name:>20} {best / len(sample) * 1e3:>12.2f}')
+            transaction.set_rollback(True)
@@ -0,0 +1,201 @@
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from genius_collection.core.datasets import USER_EMAIL_PREFIX, generate_dataset
+from genius_collection.core.jobs import enqueue_job, run_job
+from genius_collection.core.leaderboard import bump_leaderboard_generation
+from genius_collection.core.models import Job, Ownership, User
+from genius_collection.core.otp import generate_otp
+from genius_collection.core.testing import (SigningKey, local_identity_provider, local_shared_cache,
+                                            stub_container_sas)
+
+AUDIENCE = 'api://benchmark'
+ISSUER = 'https://sts.example.com/benchmark/'
+# Tracing the allocations slows down the requests, so they are profiled in separate runs
+PROFILE_RUNS = 3
+
+
+class Command(BaseCommand):
+    help = ('Measures the latency, the number of queries and the allocated memory of the core endpoints. '
+            'The requests are sent through the test client, with a local identity provider and fake SAS tokens. '
+            'By default, the dataset is generated in a temporary test database. '
+            'Compare the results of two runs with --output and --compare.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of generated users.')
+        parser.add_argument('--cards', type=int, default=500, help='Number of generated cards.')
+        parser.add_argument('--owned', type=int, default=100, help='Number of distinct cards owned per user.')
+        parser.add_argument('--quizzes', type=int, default=20, help='Number of answered questions per user.')
+        parser.add_argument('--existing', action='store_true',
+                            help='Use the dataset of the generate_dataset command in the configured database '
+                                 'instead. All changes of the requests are rolled back.')
+        parser.add_argument('--repeat', type=int, default=50, help='Number of measured requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=5, help='Number of requests before measuring.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--compare', help='Compare with the results of an earlier run and fail on regressions.')
+        parser.add_argument('--max-slowdown', type=float,
+                            help='Fail if the median latency of an endpoint grows by more than this factor. '
+                                 'Only the number of queries is compared otherwise, as the latency depends on '
+                                 'the machine.')
+        parser.add_argument('--max-allocation-growth', type=float,
+                            help='Fail if the allocated memory of an endpoint grows by more than this factor.')
+
+    def handle(self, *args, **options):
+        if options['existing']:
+            results = self.run(options)
+        else:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                dataset = generate_dataset(options['cards'], options['users'], options['owned'],
+                                           options['quizzes'], seed=0)
+                self.stdout.write(f'Generated {dataset}')
+                results = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f), results, options['max_slowdown'], options['max_allocation_growth'])
+
+    def run(self, options) -> dict:
+        signing_key = SigningKey('benchmark')
+        with transaction.atomic(), local_shared_cache(), local_identity_provider(signing_key, AUDIENCE, ISSUER), \
+                stub_container_sas('card-thumbnails', 'card-detail-views', 'card-originals'), \
+                override_settings(ALLOWED_HOSTS=['testserver'], QUERY_BUDGETS_ENFORCED=True):
+            user = User.objects.filter(email__startswith=USER_EMAIL_PREFIX).order_by('id').first()
+            if user is None:
+                raise CommandError('There is no generated dataset, see the generate_dataset command.')
+            User.objects.filter(pk=user.pk).update(is_admin=True)
+            token = signing_key.sign(AUDIENCE, ISSUER, email=user.email)
+            client = Client(headers={'Authorization': f'Bearer {token}'})
+
+            results = {
+                'dataset': {'users': User.objects.count(), 'ownerships': Ownership.objects.count()},
+                'environment': {'python': platform.python_version(), 'database': connection.vendor},
+                'endpoints': {}}
+            for name, prepare, send in self.get_endpoints(client, user, options['warmup'] + options['repeat']):
+                results['endpoints'][name] = self.measure(prepare, send, options['warmup'], options['repeat'])
+            transaction.set_rollback(True)
+        return results
+
+    @staticmethod
+    def get_endpoints(client, user, num_requests):
+        """
+        Returns the name, a function preparing the data of a request and a function sending it, per endpoint.
+        Jobs are run directly instead, like by the worker.
+        """
+        # Every transfer takes a card from another giver, so that no giver runs out of cards
+        givers = iter(Ownership.objects.exclude(user=user).select_related('user').order_by('id')[
+                      :num_requests + PROFILE_RUNS])
+
+        def prepare_transfer():
+            ownership = next(givers)
+            # The distributions in between change the quantity, and with it the OTP
+            ownership.refresh_from_db(fields=['quantity', 'last_received'])
+            otp, _ = generate_otp(ownership)
+            return {'giver': ownership.user.email, 'id': ownership.card_id, 'otp': otp}
+
+        def no_data():
+            return None
+
+        def drop_leaderboard():
+            bump_leaderboard_generation()
+
+        def prepare_distribute_job():
+            user_ids = list(User.objects.values_list('id', flat=True))
+            job, _ = enqueue_job('distribute', {'quantity': 1, 'user_ids': user_ids})
+            return job
+
+        def run_distribute_job(job):
+            run_job(job)
+            if job.status != Job.Status.SUCCEEDED:
+                raise CommandError(f'{job} failed: {job.error}')
+
+        return [
+            ('cards', no_data, lambda data: client.get('/cards/')),
+            ('overview', no_data, lambda data: client.get('/overview/')),
+            # Builds the leaderboard on every request
+            ('overview_cold', drop_leaderboard, lambda data: client.get('/overview/')),
+            # Only queues the job
+            ('distribute', no_data, lambda data: client.post(
+                '/distribute/', {'quantity': 1, 'receivers': 'all'}, content_type='application/json')),
+            ('distribute_job', prepare_distribute_job, run_distribute_job),
+            ('quiz_question', no_data, lambda data: client.post(
+                '/quiz/question/', {}, content_type='application/json')),
+            ('transfer', prepare_transfer, lambda data: client.post(
+                '/cards/transfer/', data, content_type='application/json')),
+        ]
+
+    @staticmethod
+    def measure(prepare, send, warmup, repeat) -> dict:
+        def checked_send(data):
+            response = send(data)
+            # Jobs have no response
+            if response is not None and response.status_code >= 300:
+                raise CommandError(f'{response.status_code}: {response.content[:200]}')
+
+        latencies = []
+        for i in range(warmup + repeat):
+            data = prepare()
+            start = time.perf_counter()
+            checked_send(data)
+            if i >= warmup:
+                latencies.append(time.perf_counter() - start)
+
+        queries, allocations = [], []
+        tracemalloc.start()
+        try:
+            for _ in range(PROFILE_RUNS):
+                data = prepare()
+                tracemalloc.reset_peak()
+                allocated_before = tracemalloc.get_traced_memory()[0]
+                with CaptureQueriesContext(connection) as captured:
+                    checked_send(data)
+                queries.append(len(captured))
+                allocations.append(tracemalloc.get_traced_memory()[1] - allocated_before)
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'p50_ms': round(statistics.median(latencies) * 1e3, 2),
+            'p99_ms': round(statistics.quantiles(latencies, n=100)[98] * 1e3, 2),
+            'queries': max(queries),
+            'allocated_kb': round(statistics.median(allocations) / 1024, 1),
+        }
+
+    def report(self, results):
+        self.stdout.write(f'{"endpoint":>14} {"p50 [ms]":>9} {"p99 [ms]":>9} {"queries":>8} {"alloc [KB]":>11}')
+        for name, result in results['endpoints'].items():
+            self.stdout.write(f'{name:>14} {result["p50_ms"]:>9.2f} {result["p99_ms"]:>9.2f} '
+                              f'{result["queries"]:>8} {result["allocated_kb"]:>11.1f}')
+
+    def compare(self, baseline, results, max_slowdown, max_allocation_growth):
+        regressions = []
+        for name, result in results['endpoints'].items():
+            before = baseline['endpoints'].get(name)
+            if before is None:
+                continue
+            self.stdout.write(f'{name:>14} p50 {result["p50_ms"] / before["p50_ms"]:>5.2f}x, '
+                              f'queries {before["queries"]} -> {result["queries"]}, '
+                              f'alloc {result["allocated_kb"] / before["allocated_kb"]:>5.2f}x')
+            if result['queries'] > before['queries']:
+                regressions.append(f'{name}: {result["queries"]} instead of {before["queries"]} queries')
+            if max_slowdown and result['p50_ms'] > before['p50_ms'] * max_slowdown:
+                regressions.append(f'{name}: p50 of {result["p50_ms"]} ms instead of {before["p50_ms"]} ms')
+            if max_allocation_growth and result['allocated_kb'] > before['allocated_kb'] * max_allocation_growth:
+                regressions.append(f'{name}: {result["allocated_kb"]} KB allocated instead of '
+                                   f'{before["allocated_kb"]} KB')
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from genius_collection.core.datasets import delete_dataset, generate_dataset
+
+
+class Command(BaseCommand):
+    help = ('Generates synthetic cards, users, collections and quiz answers for benchmarks. '
+            'All of them can be removed again with --delete.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of generated users, e.g. 1000 to 50000.')
+        parser.add_argument('--cards', type=int, default=500, help='Number of generated cards.')
+        parser.add_argument('--owned', type=int, default=100, help='Number of distinct cards owned per user.')
+        parser.add_argument('--quizzes', type=int, default=20, help='Number of answered questions per user.')
+        parser.add_argument('--seed', type=int, default=0, help='Generates the same dataset for the same seed.')
+        parser.add_argument('--delete', action='store_true', help='Delete the generated dataset instead.')
+
+    def handle(self, *args, **options):
+        if options['delete']:
+            self.stdout.write(f'Deleted {delete_dataset()} rows.')
+            return
+        dataset = generate_dataset(options['cards'], options['users'], options['owned'], options['quizzes'],
+                                   seed=options['seed'])
+        self.stdout.write(f'Generated {dataset}.')
@@ -0,0 +1,92 @@
+import asyncio
+import datetime
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from genius_collection.core.models import Card, Job, User
+from genius_collection.core.testing import (
+    SigningKey, SimulatedBlobStorage, local_identity_provider, stub_container_sas
+)
+
+AUDIENCE = 'api://loadtest'
+ISSUER = 'https://sts.example.com/loadtest/'
+EMAIL = 'loadtest.user@ipt.ch'
+
+
+class Command(BaseCommand):
+    help = ('Uploads pictures concurrently through the WSGI and the ASGI handler and compares the throughput. '
+            'Azure is replaced by a blob storage that only waits, and by a local JWKS endpoint. '
+            'Meant to be run against a local database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help='Number of uploads per handler.')
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Threads of the WSGI worker, e.g. the --threads of gunicorn.')
+        parser.add_argument('--concurrency', type=int, default=50, help='Concurrent uploads to the ASGI worker.')
+        parser.add_argument('--latency', type=float, default=0.1, help='Seconds the simulated blob storage waits.')
+        parser.add_argument('--size', type=int, default=500 * 1024, help='Size of the uploaded picture in bytes.')
+
+    def handle(self, *args, **options):
+        SimulatedBlobStorage.latency = options['latency']
+        signing_key = SigningKey('loadtest')
+        headers = {'Authorization': f'Bearer {signing_key.sign(AUDIENCE, ISSUER, email=EMAIL)}'}
+        picture = b'\xff\xd8' + b'\0' * (options['size'] - 2)
+
+        Card.objects.create(name='Load Test', acronym='LDT', job='Load Test', start_at_ipt=datetime.date(2020, 1, 1),
+                            email=EMAIL)
+        User.objects.create(first_name='Load', last_name='Test', email=EMAIL)
+        try:
+            with local_identity_provider(signing_key, AUDIENCE, ISSUER), stub_container_sas('card-originals'), \
+                    override_settings(BLOB_STORAGE_BACKEND='genius_collection.core.testing.SimulatedBlobStorage',
+                                      ALLOWED_HOSTS=['testserver']):
+                self.stdout.write(f'{"handler":>24} {"req/s":>8} {"p50 [ms]":>9} {"p99 [ms]":>9}')
+                self.report(f'WSGI, {options["threads"]} threads',
+                            *self.run_wsgi(picture, headers, options['requests'], options['threads']))
+                self.report(f'ASGI, {options["concurrency"]} concurrent',
+                            *asyncio.run(self.run_asgi(picture, headers, options['requests'],
+                                                       options['concurrency'])))
+        finally:
+            Job.objects.filter(kind='render_picture', payload__email=EMAIL).delete()
+            User.objects.filter(email=EMAIL).delete()
+            Card.objects.filter(email=EMAIL).delete()
+
+    @staticmethod
+    def run_wsgi(picture, headers, num_requests, threads):
+        def upload(_):
+            start = time.perf_counter()
+            response = Client().post('/picture/', {'file': SimpleUploadedFile('p.jpg', picture, 'image/jpeg')},
+                                     headers=headers)
+            assert response.status_code == 200, response.content
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            latencies = list(pool.map(upload, range(num_requests)))
+        return time.perf_counter() - start, latencies
+
+    @staticmethod
+    async def run_asgi(picture, headers, num_requests, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def upload():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await AsyncClient().post(
+                    '/picture/', {'file': SimpleUploadedFile('p.jpg', picture, 'image/jpeg')}, headers=headers)
+                assert response.status_code == 200, response.content
+                return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*[upload() for _ in range(num_requests)])
+        return time.perf_counter() - start, latencies
+
+    def report(self, handler, duration, latencies):
+        p99 = statistics.quantiles(latencies, n=100)[98]
+        self.stdout.write(f'{handler:>24} {len(latencies) / duration:>8.1f} {statistics.median(latencies) * 1e3:>9.1f} '
+                          f'{p99 * 1e3:>9.1f}')
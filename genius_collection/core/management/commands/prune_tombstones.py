@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from genius_collection.core.sync import TOMBSTONE_RETENTION, prune_tombstones
+
+
+class Command(BaseCommand):
+    help = f'Deletes the tombstones of ownerships deleted more than {TOMBSTONE_RETENTION.days} days ago.'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Deleted {prune_tombstones()} tombstones.')
@@ -0,0 +1,46 @@
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from genius_collection.core.jobs import claim_job, run_job, run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued background jobs, e.g. distributions and deletions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run the due jobs and exit instead of waiting for more.')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait before looking for new jobs when the queue is empty.')
+
+    def handle(self, *args, **options):
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        if options['once']:
+            self.stdout.write(f'Ran {run_pending_jobs(worker_id)} jobs.')
+            return
+
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+            self.stdout.write('Stopping after the current job.')
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        self.stdout.write(f'Worker {worker_id} started.')
+        while not stopping:
+            # Like a request, every job starts with a usable database connection
+            close_old_connections()
+            job = claim_job(worker_id)
+            if job is None:
+                time.sleep(options['poll_interval'])
+                continue
+            self.stdout.write(f'Running {job}.')
+            run_job(job)
+            self.stdout.write(f'Finished {job}.')
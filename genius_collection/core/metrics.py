@@ -0,0 +1,103 @@
+"""
+Prometheus metrics of the business operations and the caches in front of Azure, scraped at /metrics/.
+
+Served by several worker processes, set the environment variable PROMETHEUS_MULTIPROC_DIR to an empty directory
+before they start. Every process then writes its metrics to memory mapped files in it, which are summed up on
+every scrape.
+"""
+import functools
+import inspect
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+OPERATIONS = Counter('genius_collection_operations_total', 'Handled business operations by response status.',
+                     ['operation', 'status'])
+OPERATION_DURATION = Histogram('genius_collection_operation_duration_seconds',
+                               'Latency of the business operations.', ['operation'],
+                               buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+CACHE_LOOKUPS = Counter('genius_collection_cache_lookups_total', 'Lookups of the token, JWK and SAS caches.',
+                        ['cache', 'result'])
+CACHE_FILL_DURATION = Histogram('genius_collection_cache_fill_duration_seconds',
+                                'Latency of creating a missing cache entry, e.g. verifying a token.', ['cache'],
+                                buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+
+
+@functools.cache
+def _cache_lookups(cache: str, hit: bool):
+    # Resolving the labels takes a lock, so the children are resolved once per cache
+    return CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss')
+
+
+def count_cache_lookup(cache: str, hit: bool):
+    _cache_lookups(cache, hit).inc()
+
+
+def time_cache_fill(cache: str):
+    """
+    Context manager observing the duration of its block, e.g. `with time_cache_fill('sas'): ...`.
+    """
+    return CACHE_FILL_DURATION.labels(cache).time()
+
+
+def observe_operation(operation: str):
+    """
+    Count the calls of the decorated view method by the status of their response and observe their latency.
+    Works for async views as well. Exceptions without a status code are counted as 500.
+    """
+    duration = OPERATION_DURATION.labels(operation)
+
+    def observe(start, status_code):
+        duration.observe(time.perf_counter() - start)
+        OPERATIONS.labels(operation, str(status_code)).inc()
+
+    def decorate(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                status_code = 500
+                try:
+                    response = await func(*args, **kwargs)
+                    status_code = response.status_code
+                    return response
+                except Exception as e:
+                    # Like the APIExceptions of DRF, which are turned into responses by the view
+                    status_code = getattr(e, 'status_code', 500)
+                    raise
+                finally:
+                    observe(start, status_code)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                status_code = 500
+                try:
+                    response = func(*args, **kwargs)
+                    status_code = response.status_code
+                    return response
+                except Exception as e:
+                    # Like the APIExceptions of DRF, which are turned into responses by the view
+                    status_code = getattr(e, 'status_code', 500)
+                    raise
+                finally:
+                    observe(start, status_code)
+        return wrapper
+
+    return decorate
+
+
+def get_metrics() -> bytes:
+    """
+    Return the metrics in the text exposition format, of all processes if PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_user_quiz_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='image_version',
+            field=models.CharField(blank=True, max_length=16, null=True),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.3 on 2026-10-18 11:55
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicates(model, email, fields=None):
+    """
+    Move the rows referencing duplicates of the given email to the oldest of them and delete the others.
+    The ownerships of a card moved to the same user are merged by 0015_unique_ownership_user_card.
+    """
+    rows = model.objects.filter(email=email).order_by('id')
+    kept = rows.first()
+    duplicate_ids = list(rows.exclude(id=kept.id).values_list('id', flat=True))
+    for relation in model._meta.related_objects:
+        if relation.one_to_many:
+            relation.related_model.objects.filter(**{f'{relation.field.name}__in': duplicate_ids}).update(
+                **{relation.field.name: kept.id})
+    if fields:
+        for field, value in fields.items():
+            setattr(kept, field, value)
+        kept.save(update_fields=list(fields))
+    model.objects.filter(id__in=duplicate_ids).delete()
+
+
+def merge_duplicate_users_and_cards(apps, schema_editor):
+    """
+    Concurrent first logins could create several users with the same email. Merge them, and the cards, into one.
+    """
+    User = apps.get_model('core', 'User')
+    Card = apps.get_model('core', 'Card')
+    duplicates = User.objects.values('email').annotate(count=Count('id'), quiz_score=Sum('quiz_score'))
+    for duplicate in duplicates.filter(count__gt=1):
+        merge_duplicates(User, duplicate['email'], {'quiz_score': duplicate['quiz_score']})
+    duplicates = Card.objects.values('email').annotate(count=Count('id'))
+    for duplicate in duplicates.filter(count__gt=1):
+        merge_duplicates(Card, duplicate['email'])
+
+
+class Migration(migrations.Migration):
+    # The merge has to commit before the unique indexes are created: on PostgreSQL, the deferred foreign key
+    # checks of the moved rows would otherwise block the ALTER TABLE
+    atomic = False
+
+    dependencies = [
+        ('core', '0010_card_image_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_users_and_cards, migrations.RunPython.noop, atomic=True),
+        migrations.AlterField(
+            model_name='card',
+            name='email',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='email',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.3 on 2026-10-18 12:04
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_alter_card_email_alter_user_email'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='ownership',
+            name='otp_valid_to',
+        ),
+        migrations.RemoveField(
+            model_name='ownership',
+            name='otp_value',
+        ),
+    ]
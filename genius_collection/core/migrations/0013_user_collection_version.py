@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-18 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_remove_ownership_otp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='collection_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.3 on 2026-10-18 12:14
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def merge_duplicate_ownerships(apps, schema_editor):
+    """
+    Concurrent get_or_create calls could create several ownerships of the same card. Merge them into one.
+    """
+    Ownership = apps.get_model('core', 'Ownership')
+    duplicates = Ownership.objects.values('user_id', 'card_id').annotate(
+        count=Count('id'), total_quantity=Sum('quantity'), max_last_received=Max('last_received')
+    ).filter(count__gt=1)
+    for duplicate in duplicates:
+        ownerships = Ownership.objects.filter(user_id=duplicate['user_id'], card_id=duplicate['card_id']).order_by('id')
+        kept = ownerships.first()
+        ownerships.exclude(id=kept.id).delete()
+        kept.quantity = duplicate['total_quantity']
+        kept.last_received = duplicate['max_last_received']
+        kept.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_sync_updated_at_and_tombstones'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ownerships, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ownership',
+            constraint=models.UniqueConstraint(fields=('user', 'card'), name='unique_ownership_user_card'),
+        ),
+    ]
@@ -1,7 +1,15 @@
 import random
-from django.db import models
+from collections import Counter
+from django.db import connection, models, transaction
+from django.db.models import Case, F, Value, When
 from django.utils import timezone
 
+from .leaderboard import invalidate_leaderboard
+from .otp import verify_otp
+
+# Keeps the number of bound parameters of a single query below SQLite's limit.
+QUERY_CHUNK_SIZE = 500
+
 
 class Card(models.Model):
     def __str__(self):
@@ -11,11 +19,15 @@ class Card(models.Model):
     acronym = models.CharField(max_length=3)
     job = models.CharField(max_length=200)
     start_at_ipt = models.DateField()
-    email = models.CharField(max_length=200)
+    email = models.CharField(max_length=200, unique=True)
     wish_destination = models.CharField(max_length=2000, null=True)
     wish_person = models.CharField(max_length=2000, null=True)
     wish_skill = models.CharField(max_length=2000, null=True)
     best_advice = models.CharField(max_length=2000, null=True)
+    # Changes whenever a new picture is uploaded, to version the image URLs
+    image_version = models.CharField(max_length=16, null=True, blank=True)
+    # Queryset updates have to set it explicitly, see the delta sync of the collections
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
 
 class UserManager(models.Manager):
@@ -23,6 +35,7 @@ class UserManager(models.Manager):
     # https://docs.djangoproject.com/en/4.2/ref/models/instances/
     def create_user(self, first_name, last_name, email, init_cards=10, init_self=20):
         user = self.create(first_name=first_name, last_name=last_name, email=email)
+        invalidate_leaderboard()
         Ownership.objects.distribute_random_cards(user, init_cards)
         try:
             Ownership.objects.distribute_self_cards_to_user(user, init_self)
@@ -30,12 +43,19 @@ class UserManager(models.Manager):
         except Card.DoesNotExist:
             return user, False
 
+    def bump_collection_versions(self, user_ids):
+        """
+        Marks the quantities in the card collections of the given users as changed, which renews their ETags.
+        Changes of the cards themselves renew the ETags of all users with the catalogue version.
+        """
+        self.filter(id__in=user_ids).update(collection_version=F('collection_version') + 1)
+
 
 class User(models.Model):
     def __str__(self):
         return f'{self.first_name} {self.last_name}'
 
-    email = models.CharField(max_length=200)
+    email = models.CharField(max_length=200, unique=True)
     first_name = models.CharField(max_length=200)
     last_name = models.CharField(max_length=200)
     cards = models.ManyToManyField(Card, through='Ownership')
@@ -43,54 +63,127 @@ class User(models.Model):
     last_login = models.DateTimeField(auto_now=True)
     last_received_unique = models.DateTimeField(null=True)
     quiz_score = models.IntegerField(default=0)
+    # Increased whenever the cards shown in the collection of the user change
+    collection_version = models.PositiveIntegerField(default=0)
     objects = UserManager()
 
 
 class OwnershipManager(models.Manager):
 
+    # Inserts the ownership or adds to its quantity in one statement. As existing ownerships have a quantity of
+    # at least 1, a returned quantity equal to the added one means that the ownership was just created.
+    upsert_query = """
+        insert into core_ownership (user_id, card_id, quantity, last_received, updated_at)
+        values (%s, %s, %s, %s, %s)
+        on conflict (user_id, card_id) do update set
+            quantity = core_ownership.quantity + excluded.quantity,
+            last_received = excluded.last_received,
+            updated_at = excluded.updated_at
+        returning id, quantity
+    """
+
     def add_card_to_user(self, user, card, qty=1):
         """
         Increase the quantity of the owned card of a user or add it as a new ownership.
+        Returns the ownership and whether the card is new to the user, like get_or_create.
         """
-        # Check if the user already owns the card
-        ownership, created = self.get_or_create(user=user, card=card)
+        now = timezone.now()
+        with transaction.atomic():
+            ownership, created = self.upsert_ownership(user, card, qty, now)
+            if created:
+                User.objects.filter(pk=user.pk).update(last_received_unique=now,
+                                                       collection_version=F('collection_version') + 1)
+                user.last_received_unique = now
+            else:
+                User.objects.bump_collection_versions([user.pk])
+            invalidate_leaderboard()
+        return ownership, created
 
-        if created:
-            ownership.quantity = qty
-            user.last_received_unique = timezone.now()
-            user.save()
-        else:
-            ownership.quantity += qty
-            ownership.last_received = timezone.now()
-        ownership.save()
+    def upsert_ownership(self, user, card, qty, now):
+        """
+        Add [qty] cards to the ownership of the user, without updating the user.
+        Returns the ownership and whether it was just created.
+        """
+        db_now = connection.ops.adapt_datetimefield_value(now)
+        with connection.cursor() as cursor:
+            cursor.execute(self.upsert_query, [user.pk, card.pk, qty, db_now, db_now])
+            ownership_id, quantity = cursor.fetchone()
 
-        return ownership
+        ownership = self.model.from_db(self.db, ['id', 'user_id', 'card_id', 'quantity', 'last_received', 'updated_at'],
+                                       [ownership_id, user.pk, card.pk, quantity, now, now])
+        ownership.user = user
+        ownership.card = card
+        return ownership, quantity == qty
 
     def remove_card_from_user(self, user, card):
         """
         Decrease the owned quantity by 1. Deletes the ownership if qty == 0
         """
-        ownership = self.get(user=user, card=card)
-        if ownership.quantity > 1:
-            ownership.quantity -= 1
-            ownership.save()
-            return ownership
-        else:
-            ownership.delete()
-            return None
+        with transaction.atomic():
+            ownership = self.select_for_update().get(user=user, card=card)
+            User.objects.bump_collection_versions([user.pk])
+            invalidate_leaderboard()
+            if ownership.quantity > 1:
+                self.filter(pk=ownership.pk).update(quantity=F('quantity') - 1, updated_at=timezone.now())
+                ownership.quantity -= 1
+                return ownership
+            else:
+                ownership.delete()
+                OwnershipTombstone.objects.create(user_id=user.pk, card_id=card.pk)
+                return None
 
     def distribute_random_cards(self, user, qty):
         """
         Gives the user [qty] new cards. Duplicates possible.
         """
-        cards = Card.objects.all()
-        num_cards = len(cards)
-        if num_cards == 0:
+        self.distribute_random_cards_to_users([user], qty)
+
+    def distribute_random_cards_to_users(self, users, qty):
+        """
+        Gives every user [qty] new random cards. Duplicates possible, also of users, who get [qty] cards per
+        occurrence. The cards are drawn in memory and written with a few bulk statements per chunk of users.
+        """
+        card_ids = list(Card.objects.values_list('id', flat=True))
+        if len(card_ids) == 0:
             return
-        card_indices = random.choices(range(num_cards), k=qty)
 
-        for idx in card_indices:
-            self.add_card_to_user(user=user, card=Card.objects.all()[idx])
+        # Merge duplicates into one quantity delta per (user, card)
+        deltas = {}
+        for user in users:
+            deltas.setdefault(user.id, Counter()).update(random.choices(card_ids, k=qty))
+        user_ids = list(deltas.keys())
+
+        now = timezone.now()
+        new_unique_user_ids = set()
+        with transaction.atomic():
+            for i in range(0, len(user_ids), QUERY_CHUNK_SIZE):
+                chunk = user_ids[i:i + QUERY_CHUNK_SIZE]
+                existing = {(o.user_id, o.card_id): o for o in self.select_for_update().filter(user_id__in=chunk)}
+                to_create = []
+                to_update = []
+                for user_id in chunk:
+                    for card_id, delta in deltas[user_id].items():
+                        ownership = existing.get((user_id, card_id))
+                        if ownership is None:
+                            to_create.append(self.model(user_id=user_id, card_id=card_id, quantity=delta))
+                            new_unique_user_ids.add(user_id)
+                        else:
+                            ownership.quantity += delta
+                            ownership.last_received = now
+                            ownership.updated_at = now
+                            to_update.append(ownership)
+                self.bulk_create(to_create, batch_size=QUERY_CHUNK_SIZE)
+                self.bulk_update(to_update, ['quantity', 'last_received', 'updated_at'], batch_size=QUERY_CHUNK_SIZE)
+                User.objects.bump_collection_versions(chunk)
+
+            unique_ids = list(new_unique_user_ids)
+            for i in range(0, len(unique_ids), QUERY_CHUNK_SIZE):
+                User.objects.filter(id__in=unique_ids[i:i + QUERY_CHUNK_SIZE]).update(last_received_unique=now)
+            invalidate_leaderboard()
+
+        for user in users:
+            if user.id in new_unique_user_ids:
+                user.last_received_unique = now
 
     def distribute_self_cards_to_user(self, user, qty):
         """
@@ -99,34 +192,76 @@ class OwnershipManager(models.Manager):
         card = Card.objects.get(email=user.email)
         self.add_card_to_user(user=user, card=card, qty=qty)
 
-    def transfer_ownership(self, to_user, giver_ownership, card):
+    def transfer_ownership(self, to_user, giver_ownership, otp):
         """
-        Remove 1 card from giver and give it to receiver.
+        Remove 1 card from giver and give it to receiver, if the OTP matches the giver's ownership.
+        The card is only taken if the ownership is still in the state the OTP was derived from,
+        so one OTP transfers at most one card.
+        Returns None if the OTP is not valid (anymore).
         """
-        from_user = giver_ownership.user
+        if not verify_otp(giver_ownership, otp):
+            return None
 
-        receiver_ownership = self.add_card_to_user(user=to_user, card=card)
-        giver_ownership.otp_valid_to = None
-        giver_ownership.otp_value = None
-        giver_ownership.save()
-        giver_ownership = self.remove_card_from_user(user=from_user, card=card)
+        now = timezone.now()
+        with transaction.atomic():
+            taken = self.filter(pk=giver_ownership.pk, quantity=giver_ownership.quantity,
+                                last_received=giver_ownership.last_received).update(quantity=F('quantity') - 1,
+                                                                                     updated_at=now)
+            if not taken:
+                return None
+            deleted, _ = self.filter(pk=giver_ownership.pk, quantity=0).delete()
+            if deleted:
+                OwnershipTombstone.objects.create(user_id=giver_ownership.user_id, card_id=giver_ownership.card_id)
+            receiver_ownership, created = self.upsert_ownership(to_user, giver_ownership.card, 1, now)
 
+            # Both users in one statement, which locks them in the same order in every transfer between them
+            changes = {'collection_version': F('collection_version') + 1}
+            if created:
+                changes['last_received_unique'] = Case(When(pk=to_user.pk, then=Value(now)),
+                                                       default=F('last_received_unique'))
+                to_user.last_received_unique = now
+            User.objects.filter(id__in=sorted([giver_ownership.user_id, to_user.pk])).update(**changes)
+            invalidate_leaderboard()
+
+        if deleted:
+            return None, receiver_ownership
+        giver_ownership.quantity -= 1
         return giver_ownership, receiver_ownership
 
 
 class Ownership(models.Model):
     user = models.ForeignKey(User, on_delete=models.RESTRICT)
     card = models.ForeignKey(Card, on_delete=models.RESTRICT)
-    otp_value = models.CharField(null=True, max_length=16)
-    otp_valid_to = models.DateTimeField(null=True)
     quantity = models.PositiveIntegerField(default=1)
     last_received = models.DateTimeField(auto_now_add=True)
+    # Queryset updates have to set it explicitly, see the delta sync of the collections
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     objects = OwnershipManager()
 
+    class Meta:
+        constraints = [
+            # Also the index of the collection query, which looks up the cards of one user
+            models.UniqueConstraint(fields=['user', 'card'], name='unique_ownership_user_card')
+        ]
+
     def __str__(self):
         return f'{self.user} besitzt {self.quantity} {self.card}'
 
 
+class OwnershipTombstone(models.Model):
+    """
+    Remembers deleted ownerships, so that clients syncing a collection learn about them.
+    Without a user, the card itself was deleted.
+    """
+    def __str__(self):
+        return f'user: {self.user_id} card: {self.card_id} deleted_at: {self.deleted_at}'
+
+    # No foreign keys, the user or card may not exist anymore
+    user_id = models.PositiveIntegerField(null=True)
+    card_id = models.PositiveIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
 class Distribution(models.Model):
     def __str__(self):
         return f'qty: {self.quantity} triggered_by: {self.user} timestamp: {self.timestamp}'
@@ -157,4 +292,40 @@ class Quiz(models.Model):
     question_true_card = models.ForeignKey(Card, on_delete=models.RESTRICT, related_name='true_card')
     answer_timestamp = models.DateTimeField(null=True)
     answer_options = models.IntegerField(null=True)
-    answer_correct = models.BooleanField(null=True)
\ No newline at end of file
+    answer_correct = models.BooleanField(null=True)
+
+
+class Job(models.Model):
+    """
+    Work that runs in the background, see jobs.py and the worker command.
+    """
+    class Status(models.TextChoices):
+        QUEUED = 'QUEUED'
+        RUNNING = 'RUNNING'
+        SUCCEEDED = 'SUCCEEDED'
+        FAILED = 'FAILED'
+
+    def __str__(self):
+        return f'{self.kind} #{self.id}: {self.status} ({self.progress}/{self.total})'
+
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    # Enqueuing a job with the key of an existing job returns the existing job
+    idempotency_key = models.CharField(max_length=200, unique=True, null=True)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.QUEUED)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True)
+    result = models.JSONField(null=True)
+    error = models.TextField(null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    # A running job whose lease expired is picked up again, e.g. after its worker crashed
+    locked_by = models.CharField(max_length=200, null=True)
+    locked_until = models.DateTimeField(null=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
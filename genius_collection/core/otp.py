@@ -0,0 +1,39 @@
+import datetime
+from string import ascii_lowercase
+
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+OTP_LENGTH = 16
+OTP_WINDOW = datetime.timedelta(minutes=5)
+OTP_SALT = "genius_collection.core.otp"
+
+
+def get_window(moment: datetime.datetime) -> int:
+    return int(moment.timestamp() // OTP_WINDOW.total_seconds())
+
+
+def compute_otp(ownership, window: int) -> str:
+    """
+    The OTP is derived from the state of the ownership. Taking or receiving a card changes the quantity or
+    the time of the last reception, so an OTP becomes invalid as soon as it has been used once.
+    """
+    message = f'{ownership.pk}:{ownership.quantity}:{ownership.last_received.isoformat()}:{window}'
+    digest = salted_hmac(OTP_SALT, message, algorithm='sha256').digest()
+    return ''.join(ascii_lowercase[b % len(ascii_lowercase)] for b in digest[:OTP_LENGTH])
+
+
+def generate_otp(ownership, now=None) -> tuple[str, datetime.datetime]:
+    """
+    Returns the current OTP of the ownership and the time until it is accepted.
+    Nothing is stored, so showing a card stays a pure read.
+    """
+    window = get_window(now or timezone.now())
+    # The OTP of the previous window is accepted as well, so an OTP is valid for at least one full window
+    valid_to = datetime.datetime.fromtimestamp((window + 2) * OTP_WINDOW.total_seconds(), tz=datetime.timezone.utc)
+    return compute_otp(ownership, window), valid_to
+
+
+def verify_otp(ownership, otp, now=None) -> bool:
+    window = get_window(now or timezone.now())
+    return any(constant_time_compare(otp, compute_otp(ownership, w)) for w in (window, window - 1))
@@ -0,0 +1,81 @@
+import random
+import threading
+import time
+import uuid
+
+from django.db import transaction
+
+from .models import Card
+from .tiered_cache import TieredCache
+
+QUIZ_POOL_VERSION_CACHE = "quiz_pool_version"
+# Rebuild at the latest after this many seconds, in case the shared cache lost an invalidation
+QUIZ_POOL_MAX_AGE = 10 * 60
+
+# Only in the shared cache, so that the cards changed by every process, e.g. by the worker, rebuild the index
+quiz_pool_versions = TieredCache('quiz-pool', maxsize=0)
+
+
+class QuizCandidateIndex:
+    """
+    All cards grouped by their answer value per (question field, answer field) pair.
+    A question picks distinct answers by sampling groups, so no two options show the same answer.
+    """
+
+    def __init__(self, cards):
+        self.cards = cards
+        self._pools = {}
+
+    def get_pool(self, question_field, answer_field):
+        pool = self._pools.get((question_field, answer_field))
+        if pool is None:
+            groups = {}
+            for card in self.cards:
+                question_value = getattr(card, question_field)
+                answer_value = getattr(card, answer_field)
+                # Cards that cannot answer the question (null values) are left out
+                if question_value is not None and answer_value is not None:
+                    groups.setdefault(answer_value, []).append(card)
+            pool = list(groups.values())
+            self._pools[(question_field, answer_field)] = pool
+        return pool
+
+    def sample(self, question_field, answer_field, k):
+        """
+        Return up to [k] cards with distinct answer values.
+        """
+        pool = self.get_pool(question_field, answer_field)
+        return [random.choice(group) for group in random.sample(pool, min(k, len(pool)))]
+
+
+_index = None
+_index_version = None
+_index_built_at = 0
+_index_lock = threading.Lock()
+
+
+def invalidate_quiz_candidate_index():
+    """
+    Change the shared version once the current transaction commits, so every process rebuilds its index on its
+    next question.
+    """
+    transaction.on_commit(lambda: quiz_pool_versions.set(QUIZ_POOL_VERSION_CACHE, uuid.uuid4().hex))
+
+
+def get_quiz_candidate_index() -> QuizCandidateIndex:
+    global _index, _index_version, _index_built_at
+
+    # Without a known version (e.g. after a restart of the cache) the index cannot be trusted, so a new one is set
+    version = quiz_pool_versions.get_or_set(QUIZ_POOL_VERSION_CACHE, lambda: uuid.uuid4().hex)
+    index = _index
+    if index is not None and version == _index_version and time.monotonic() - _index_built_at < QUIZ_POOL_MAX_AGE:
+        return index
+
+    with _index_lock:
+        if _index is not index:
+            # Another thread rebuilt the index while this one was waiting
+            return _index
+        _index = QuizCandidateIndex(list(Card.objects.all()))
+        _index_version = version
+        _index_built_at = time.monotonic()
+        return _index
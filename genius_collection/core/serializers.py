@@ -1,10 +1,8 @@
 from rest_framework import serializers
-from datetime import timedelta
-from django.utils import timezone
-from random import choice
-from string import ascii_lowercase
 
-from .models import Card, User, Ownership
+from .models import Card, User, Ownership, Job
+from .jwt_validation import get_current_user_id
+from .otp import generate_otp
 from genius_collection.core.blob_sas import get_blob_sas_url
 from django.db.models import QuerySet
 
@@ -15,6 +13,13 @@ class UserSerializer(serializers.HyperlinkedModelSerializer):
         fields = ['email', 'first_name', 'last_name', 'is_admin', 'quiz_score']
 
 
+class JobSerializer(serializers.HyperlinkedModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'progress', 'total', 'result', 'error', 'attempts', 'created_at',
+                  'finished_at']
+
+
 class CardSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Card
@@ -24,21 +29,16 @@ class CardSerializer(serializers.HyperlinkedModelSerializer):
     def to_representation(self, obj):
         data = super().to_representation(obj)
 
-        data['image_url'] = get_blob_sas_url("card-detail-views", obj.email)
+        data['image_url'] = get_blob_sas_url("card-detail-views", obj.email, obj.image_version)
 
-        current_user = User.objects.get(email=self.context['request'].user['email'])
-        ownership = Ownership.objects.filter(card=obj, user=current_user).first()
+        ownership = Ownership.objects.filter(card=obj, user_id=get_current_user_id(self.context['request'])).first()
         if ownership is None:
             data['otp_value'] = None
             data['otp_valid_to'] = None
             data['last_received'] = None
             data['quantity'] = 0
         else:
-            ownership.otp_value = ''.join(choice(ascii_lowercase) for _ in range(16))
-            ownership.otp_valid_to = timezone.now() + timedelta(minutes=5)
-            ownership.save()
-            data['otp_value'] = ownership.otp_value
-            data['otp_valid_to'] = ownership.otp_valid_to
+            data['otp_value'], data['otp_valid_to'] = generate_otp(ownership)
             data['last_received'] = ownership.last_received
             data['quantity'] = ownership.quantity
         return data
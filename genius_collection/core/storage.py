@@ -0,0 +1,163 @@
+"""
+Access to the blob storage. The backend is configured with the setting BLOB_STORAGE_BACKEND,
+so that tests and benchmarks can run without Azure (see testing.py).
+"""
+import asyncio
+import os
+import tempfile
+import threading
+import weakref
+from pathlib import Path
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+from azure.core.exceptions import ResourceNotFoundError
+from azure.identity import DefaultAzureCredential
+from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+from azure.storage.blob import BlobServiceClient, ContentSettings
+from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
+
+STORAGE_ACCOUNT = "gcollection"
+HOST = f"https://{STORAGE_ACCOUNT}.blob.core.windows.net"
+
+_client_lock = threading.Lock()
+_blob_service_client: Optional[BlobServiceClient] = None
+# Async clients only work within the event loop that created them. With the task closing them, by loop
+_async_blob_service_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def get_blob_service_client() -> BlobServiceClient:
+    """
+    Return the process-wide client of the storage account. It is created on first use and keeps its connections
+    open, and its credential caches the access token, so the credential chain is only probed once per process.
+    The client is thread-safe.
+    """
+    global _blob_service_client
+    if _blob_service_client is None:
+        with _client_lock:
+            if _blob_service_client is None:
+                _blob_service_client = BlobServiceClient(HOST, credential=DefaultAzureCredential())
+    return _blob_service_client
+
+
+def close_blob_service_client():
+    """
+    Close the process-wide client, the next call of get_blob_service_client creates a new one.
+    """
+    global _blob_service_client
+    with _client_lock:
+        client, _blob_service_client = _blob_service_client, None
+    if client is not None:
+        client.close()
+        client.credential.close()
+
+
+def get_async_blob_service_client() -> AsyncBlobServiceClient:
+    """
+    Return the async client of the running event loop, created on first use like get_blob_service_client.
+    Served with ASGI, all requests of a process share the client of its loop. The loops of async_to_sync, e.g. of
+    a single request when the app is served with WSGI, get their own client, which is closed when the loop ends.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _async_blob_service_clients.get(loop)
+    if entry is None:
+        client = AsyncBlobServiceClient(HOST, credential=AsyncDefaultAzureCredential())
+        entry = _async_blob_service_clients[loop] = (client, loop.create_task(_close_when_cancelled(client)))
+    return entry[0]
+
+
+async def _close_when_cancelled(client: AsyncBlobServiceClient):
+    """
+    Wait until the task is cancelled, which asyncio.run does with all pending tasks before it closes the loop.
+    """
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await client.close()
+        await client.credential.close()
+
+
+class AzureBlobStorage:
+    """
+    Stores the blobs in the Azure storage account, authenticated with managed identity.
+    Every method has an async variant for the async views, which does not block the event loop.
+    """
+
+    def upload(self, container_name: str, blob_name: str, data, content_type: str = None, cache_control: str = None):
+        blob_client = get_blob_service_client().get_blob_client(container_name, blob_name)
+        blob_client.upload_blob(data, overwrite=True, content_settings=ContentSettings(
+            content_type=content_type, cache_control=cache_control))
+
+    async def aupload(self, container_name: str, blob_name: str, data, content_type: str = None,
+                      cache_control: str = None):
+        blob_client = get_async_blob_service_client().get_blob_client(container_name, blob_name)
+        await blob_client.upload_blob(data, overwrite=True, content_settings=ContentSettings(
+            content_type=content_type, cache_control=cache_control))
+
+    def download(self, container_name: str, blob_name: str) -> bytes:
+        return get_blob_service_client().get_blob_client(container_name, blob_name).download_blob().readall()
+
+    def delete(self, container_name: str, blob_name: str) -> bool:
+        """
+        Returns False if the blob did not exist.
+        """
+        try:
+            get_blob_service_client().get_blob_client(container_name, blob_name).delete_blob()
+            return True
+        except ResourceNotFoundError:
+            return False
+
+
+class FileSystemBlobStorage:
+    """
+    Stores the blobs as files below the setting BLOB_STORAGE_ROOT, one directory per container.
+    For local development and tests, the content type and cache control are not kept.
+    """
+
+    def __init__(self, root=None):
+        self.root = Path(root or settings.BLOB_STORAGE_ROOT)
+
+    def path(self, container_name: str, blob_name: str) -> Path:
+        path = (self.root / container_name / blob_name).resolve()
+        if self.root.resolve() not in path.parents:
+            raise ValueError(f'Invalid blob name: {blob_name}')
+        return path
+
+    def upload(self, container_name: str, blob_name: str, data, content_type: str = None, cache_control: str = None):
+        path = self.path(container_name, blob_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Readers never see a partially written blob
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as file:
+            file.write(data if isinstance(data, bytes) else data.read())
+        os.replace(file.name, path)
+
+    async def aupload(self, container_name: str, blob_name: str, data, content_type: str = None,
+                      cache_control: str = None):
+        await sync_to_async(self.upload, thread_sensitive=False)(container_name, blob_name, data, content_type,
+                                                                 cache_control)
+
+    def download(self, container_name: str, blob_name: str) -> bytes:
+        return self.path(container_name, blob_name).read_bytes()
+
+    def delete(self, container_name: str, blob_name: str) -> bool:
+        try:
+            self.path(container_name, blob_name).unlink()
+            return True
+        except FileNotFoundError:
+            return False
+
+
+_storages = {}
+
+
+def get_blob_storage():
+    """
+    Return the process-wide instance of the configured backend.
+    """
+    backend = settings.BLOB_STORAGE_BACKEND
+    storage = _storages.get(backend)
+    if storage is None:
+        storage = _storages.setdefault(backend, import_string(backend)())
+    return storage
@@ -0,0 +1,66 @@
+import datetime
+
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Card, Ownership, OwnershipTombstone
+
+# Changes of transactions that were still running during a sync have older timestamps than the returned cursor.
+# The cursor lags behind by this margin, so the next sync picks them up (clients apply changes idempotently).
+SYNC_OVERLAP = datetime.timedelta(seconds=30)
+# Clients with older cursors have to load their collection in full, as the tombstones may be gone
+TOMBSTONE_RETENTION = datetime.timedelta(days=30)
+
+
+class InvalidSyncCursor(ValueError):
+    pass
+
+
+def encode_cursor(moment: datetime.datetime) -> str:
+    return moment.astimezone(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def decode_cursor(cursor: str) -> datetime.datetime:
+    try:
+        since = parse_datetime(cursor)
+    except ValueError:
+        raise InvalidSyncCursor(cursor)
+    if since is None or timezone.is_naive(since):
+        raise InvalidSyncCursor(cursor)
+    return since
+
+
+def get_collection_changes(user, since: datetime.datetime = None) -> dict:
+    """
+    Return the cards whose data or ownership by the user changed after [since], and the ids of deleted cards.
+    Without [since], or if it is older than the kept tombstones, the whole collection is returned ('full').
+    """
+    now = timezone.now()
+    full = since is None or since < now - TOMBSTONE_RETENTION
+
+    ownership = Ownership.objects.filter(user=user, card=OuterRef('pk'))
+    cards = Card.objects.annotate(
+        quantity=Coalesce(Subquery(ownership.values('quantity')), 0),
+        last_received=Subquery(ownership.values('last_received'))
+    ).order_by('id')
+    removed_card_ids = []
+    if not full:
+        changed_ownerships = Ownership.objects.filter(user=user, updated_at__gt=since).values('card_id')
+        deleted_ownerships = OwnershipTombstone.objects.filter(user_id=user.pk, deleted_at__gt=since).values('card_id')
+        cards = cards.filter(Q(updated_at__gt=since) | Q(id__in=changed_ownerships) | Q(id__in=deleted_ownerships))
+        removed_card_ids = list(OwnershipTombstone.objects.filter(user_id__isnull=True, deleted_at__gt=since)
+                                .values_list('card_id', flat=True))
+
+    return {
+        'full': full,
+        'cards': list(cards.values()),
+        'removed': removed_card_ids,
+        'cursor': encode_cursor(now - SYNC_OVERLAP)
+    }
+
+
+def prune_tombstones() -> int:
+    deleted, _ = OwnershipTombstone.objects.filter(deleted_at__lt=timezone.now() - TOMBSTONE_RETENTION).delete()
+    return deleted
@@ -0,0 +1,188 @@
+"""
+Local stand-ins for the external services, to be used in tests and benchmarks.
+"""
+import asyncio
+import base64
+import contextlib
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from . import blob_sas
+from .jwt_validation import JWTAccessTokenAuthentication
+from .models import Card
+from .tiered_cache import SHARED_CACHE
+
+
+def create_card(i: int, **fields) -> Card:
+    """
+    Create the i-th card of a test. The given fields replace the defaults.
+    """
+    return Card.objects.create(**{'name': f'Card {i}', 'acronym': f'C{i}', 'job': 'Job',
+                                  'start_at_ipt': datetime.date(2020, 1, 1), 'email': f'card{i}@ipt.ch', **fields})
+
+
+def create_cards(count: int, **fields) -> list[Card]:
+    return [create_card(i, **fields) for i in range(count)]
+
+
+def encode_value(val: int) -> str:
+    return base64.urlsafe_b64encode(val.to_bytes((val.bit_length() + 7) // 8, 'big')).rstrip(b'=').decode()
+
+
+class SigningKey:
+    """
+    An RSA key pair that signs tokens like Azure AD and publishes its public part as a JWK.
+    """
+
+    def __init__(self, kid):
+        self.kid = kid
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    @property
+    def jwk(self) -> dict:
+        numbers = self.private_key.public_key().public_numbers()
+        return {'kty': 'RSA', 'use': 'sig', 'kid': self.kid, 'n': encode_value(numbers.n), 'e': encode_value(numbers.e)}
+
+    def sign(self, audience, issuer, email='test.user@ipt.ch', first_name='Test', last_name='User',
+             expires_in=3600) -> str:
+        now = int(time.time())
+        claims = {'aud': audience, 'iss': issuer, 'iat': now, 'nbf': now, 'exp': now + expires_in,
+                  'unique_name': email, 'given_name': first_name, 'family_name': last_name}
+        return jwt.encode(claims, self.private_key, algorithm='RS256', headers={'kid': self.kid})
+
+
+class LocalJWKSServer:
+    """
+    Serves the JWKS of the given signing keys over HTTP on localhost and counts the requests.
+    """
+
+    def __init__(self, *signing_keys):
+        self.signing_keys = list(signing_keys)
+        self.requests = 0
+        self.delay = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.delay)
+                body = json.dumps({'keys': [k.jwk for k in server.signing_keys]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = None
+
+    @property
+    def jwks_uri(self) -> str:
+        return f'http://127.0.0.1:{self._httpd.server_port}/discovery/v2.0/keys'
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+
+class SimulatedBlobStorage:
+    """
+    Keeps the blobs in memory and waits like a remote storage would, see the setting BLOB_STORAGE_BACKEND.
+    """
+    latency = 0
+
+    def __init__(self):
+        self.blobs = {}
+        self.cache_controls = {}
+
+    def upload(self, container_name, blob_name, data, content_type=None, cache_control=None):
+        time.sleep(self.latency)
+        self.blobs[(container_name, blob_name)] = data if isinstance(data, bytes) else data.read()
+        self.cache_controls[(container_name, blob_name)] = cache_control
+
+    async def aupload(self, container_name, blob_name, data, content_type=None, cache_control=None):
+        await asyncio.sleep(self.latency)
+        self.blobs[(container_name, blob_name)] = data if isinstance(data, bytes) else data.read()
+        self.cache_controls[(container_name, blob_name)] = cache_control
+
+    def download(self, container_name, blob_name):
+        time.sleep(self.latency)
+        return self.blobs[(container_name, blob_name)]
+
+    def delete(self, container_name, blob_name):
+        time.sleep(self.latency)
+        return self.blobs.pop((container_name, blob_name), None) is not None
+
+
+@contextlib.contextmanager
+def local_identity_provider(signing_key: SigningKey, audience: str, issuer: str):
+    """
+    Accept the tokens signed by the given key for the audience and issuer, instead of the tokens of Azure AD.
+    """
+    with LocalJWKSServer(signing_key) as server, \
+            mock.patch.object(JWTAccessTokenAuthentication, 'jwks_uri', server.jwks_uri), \
+            mock.patch.object(JWTAccessTokenAuthentication, 'issuer', issuer), \
+            mock.patch.object(JWTAccessTokenAuthentication, 'valid_audience', audience):
+        yield server
+
+
+@contextlib.contextmanager
+def stub_container_sas(*container_names):
+    """
+    Cache a fake SAS token for the given containers in this process, so that building blob URLs does not call Azure.
+    """
+    expires_at = time.time() + 3600
+    for container_name in container_names:
+        blob_sas.container_sas_tokens.local.set(container_name, 'sv=2021-08-06&sig=stub', expires_at)
+    try:
+        yield
+    finally:
+        for container_name in container_names:
+            blob_sas.container_sas_tokens.local.delete(container_name)
+
+
+def local_shared_cache() -> override_settings:
+    """
+    Replaces the shared cache by one in memory, so that no entries of other databases are found in it.
+    """
+    return override_settings(CACHES={
+        **settings.CACHES,
+        SHARED_CACHE: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': SHARED_CACHE}})
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Fails the requests exceeding the query budget of their view, see instrumentation.py.
+    Replaces the shared cache by one in memory, see tiered_cache.py.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._query_budgets_enforced = settings.QUERY_BUDGETS_ENFORCED
+        settings.QUERY_BUDGETS_ENFORCED = True
+        self._shared_cache = local_shared_cache()
+        self._shared_cache.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._shared_cache.disable()
+        settings.QUERY_BUDGETS_ENFORCED = self._query_budgets_enforced
+        super().teardown_test_environment(**kwargs)
@@ -1,4 +1,21 @@
-from genius_collection.core.jwt_validation import JWTAccessTokenAuthentication
+import time
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from rest_framework.test import APIClient
+
+from genius_collection.core import views
+from genius_collection.core.jwt_validation import (
+    JWTAccessTokenAuthentication,
+    forget_user,
+    get_current_user,
+    get_current_user_id,
+    verified_tokens
+)
+from genius_collection.core.models import User
+from genius_collection.core.testing import LocalJWKSServer, SigningKey
+from genius_collection.core.ttl_cache import TTLCache
 
 
 # for local debugging only
@@ -17,3 +34,124 @@ def test_verify_jwt():
         verify=True,
     )
     print(payload)
+
+
+class VerifiedTokenCacheTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.signing_key = SigningKey('kid-1')
+        cls.server = LocalJWKSServer(cls.signing_key).__enter__()
+        cls.authenticator = JWTAccessTokenAuthentication()
+        cls.authenticator.jwks_uri = cls.server.jwks_uri
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.__exit__(None, None, None)
+        super().tearDownClass()
+
+    def setUp(self):
+        verified_tokens.clear()
+
+    def authenticate(self, token):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        return self.authenticator.authenticate(request)[0]
+
+    def test_repeated_token_is_verified_once(self):
+        token = self.signing_key.sign(self.authenticator.valid_audience, self.authenticator.issuer,
+                                      email='anna@ipt.ch')
+
+        with mock.patch.object(self.authenticator, 'verify_jwt', wraps=self.authenticator.verify_jwt) as verify_jwt:
+            users = [self.authenticate(token) for _ in range(5)]
+
+        self.assertEqual(1, verify_jwt.call_count)
+        self.assertEqual({'email': 'anna@ipt.ch', 'first_name': 'Test', 'last_name': 'User'}, users[-1])
+        self.assertEqual({'size': 1, 'maxsize': 1024, 'hits': 4, 'misses': 1}, verified_tokens.stats())
+
+    def test_entry_expires_with_the_token(self):
+        token = self.signing_key.sign(self.authenticator.valid_audience, self.authenticator.issuer, expires_in=1)
+        self.authenticate(token)
+
+        with mock.patch('time.time', return_value=time.time() + 2):
+            self.assertIsNone(verified_tokens.get(next(iter(verified_tokens._entries))))
+
+    def test_cache_is_bounded(self):
+        cache = TTLCache(maxsize=2)
+        for key in 'abc':
+            cache.set(key, key)
+        cache.get('b')
+        cache.set('d', 'd')
+
+        self.assertEqual(['b', 'd'], list(cache._entries))
+
+
+class CurrentUserTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch')
+
+    def setUp(self):
+        caches['shared'].clear()
+
+    def request(self, email='anna@ipt.ch'):
+        request = RequestFactory().get('/')
+        request.user = {'email': email}
+        return request
+
+    def test_user_is_loaded_once_per_request(self):
+        request = self.request()
+
+        with self.assertNumQueries(1):
+            users = [get_current_user(request) for _ in range(3)]
+
+        self.assertEqual(self.user, users[0])
+        self.assertTrue(all(u is users[0] for u in users))
+
+    def test_known_user_id_needs_no_query(self):
+        get_current_user(self.request())
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user.pk, get_current_user_id(self.request()))
+
+    def test_forgotten_user_id_is_queried_again(self):
+        get_current_user(self.request())
+        # Shared by all processes, e.g. with the worker deleting the user
+        forget_user('anna@ipt.ch')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.user.pk, get_current_user_id(self.request()))
+
+    def test_unknown_user(self):
+        with self.assertRaises(User.DoesNotExist):
+            get_current_user(self.request('nobody@ipt.ch'))
+
+
+class UserInitTest(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user={'email': 'anna@ipt.ch', 'first_name': 'Anna', 'last_name': 'A'})
+
+    def test_first_login_creates_the_user(self):
+        response = self.client.post('/users/init/')
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(1, User.objects.filter(email='anna@ipt.ch').count())
+
+    def test_concurrent_first_login_finds_the_created_user(self):
+        User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch')
+        lookups = []
+
+        def get_current_user_before_the_other_login(request):
+            lookups.append(request)
+            # The first lookup happens before the concurrent login commits its user
+            if len(lookups) == 1:
+                raise User.DoesNotExist
+            return get_current_user(request)
+
+        with mock.patch.object(views, 'get_current_user', side_effect=get_current_user_before_the_other_login):
+            response = self.client.post('/users/init/')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('User in Datenbank gefunden.', response.data['status'])
+        self.assertEqual(1, User.objects.filter(email='anna@ipt.ch').count())
@@ -0,0 +1,34 @@
+import io
+import json
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from genius_collection.core.datasets import delete_dataset, generate_dataset
+from genius_collection.core.models import Ownership, Quiz, User
+
+
+class DatasetTest(TestCase):
+    def test_generate_and_delete(self):
+        dataset = generate_dataset(num_cards=10, num_users=20, owned_per_user=5, quizzes_per_user=2, seed=1)
+
+        self.assertEqual((10, 20, 100, 40), dataset)
+        self.assertEqual(100, Ownership.objects.count())
+        self.assertEqual(10 + 20 + 100 + 40, delete_dataset())
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Quiz.objects.exists())
+
+
+class BenchmarkEndpointsTest(TestCase):
+    def test_all_endpoints_are_measured(self):
+        generate_dataset(num_cards=10, num_users=20, owned_per_user=5, quizzes_per_user=2, seed=1)
+
+        with tempfile.NamedTemporaryFile('r') as output:
+            call_command('benchmark_endpoints', '--existing', '--repeat=2', '--warmup=1', f'--output={output.name}',
+                         stdout=io.StringIO())
+            results = json.load(output)
+
+        self.assertEqual({'cards', 'overview', 'overview_cold', 'distribute', 'distribute_job', 'quiz_question',
+                          'transfer'}, set(results['endpoints']))
+        self.assertEqual(3, results['endpoints']['cards']['queries'])
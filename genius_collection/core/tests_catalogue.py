@@ -0,0 +1,76 @@
+import gzip
+import json
+import time
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from genius_collection.core.blob_sas import container_sas_tokens
+from genius_collection.core.catalogue import get_catalogue_snapshot
+from genius_collection.core.models import User, Ownership
+from genius_collection.core.testing import create_cards
+
+
+class CatalogueTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cards = create_cards(3)
+        cls.anna = User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch')
+        cls.bert = User.objects.create(first_name='Bert', last_name='B', email='bert@ipt.ch')
+
+    def setUp(self):
+        container_sas_tokens.set('card-thumbnails', 'sig=test', time.time() + 24 * 60 * 60)
+        self.client = APIClient()
+        self.client.force_authenticate(user={'email': 'anna@ipt.ch', 'first_name': 'Anna', 'last_name': 'A'})
+
+    def test_collection_combines_the_catalogue_with_the_quantities(self):
+        Ownership.objects.add_card_to_user(self.anna, self.cards[1], qty=3)
+
+        cards = self.client.get('/cards/').json()
+
+        self.assertEqual(['Card 0', 'Card 1', 'Card 2'], [c['name'] for c in cards])
+        self.assertEqual([0, 3, 0], [c['quantity'] for c in cards])
+        self.assertIsNone(cards[0]['last_received'])
+        self.assertTrue(cards[1]['last_received'].endswith('Z'))
+        self.assertEqual('2020-01-01', cards[1]['start_at_ipt'])
+        self.assertTrue(cards[1]['image_url'].startswith('https://'))
+
+    def test_snapshot_is_built_once_for_all_users(self):
+        get_catalogue_snapshot()
+        bert_client = APIClient()
+        bert_client.force_authenticate(user={'email': 'bert@ipt.ch', 'first_name': 'Bert', 'last_name': 'B'})
+
+        # The current user, the version of the catalogue and the ownerships
+        with self.assertNumQueries(3):
+            bert_client.get('/cards/')
+
+    def test_snapshot_is_rebuilt_when_a_card_changes(self):
+        snapshot = get_catalogue_snapshot()
+
+        card = self.cards[0]
+        card.job = 'New Job'
+        card.save()
+
+        self.assertIsNot(snapshot, get_catalogue_snapshot())
+        self.assertEqual('New Job', self.client.get('/cards/').json()[0]['job'])
+
+    def test_catalogue_is_served_compressed(self):
+        response = self.client.get('/cards/catalogue/', HTTP_ACCEPT_ENCODING='gzip, br')
+
+        self.assertEqual('gzip', response['Content-Encoding'])
+        cards = json.loads(gzip.decompress(response.content))
+        self.assertEqual(3, len(cards))
+        self.assertNotIn('quantity', cards[0])
+        not_modified = self.client.get('/cards/catalogue/', HTTP_ACCEPT_ENCODING='gzip',
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(304, not_modified.status_code)
+        self.assertIn('Accept-Encoding', not_modified['Vary'])
+
+    def test_plain_and_compressed_catalogue_have_different_etags(self):
+        compressed = self.client.get('/cards/catalogue/', HTTP_ACCEPT_ENCODING='gzip')
+
+        plain = self.client.get('/cards/catalogue/', HTTP_IF_NONE_MATCH=compressed['ETag'])
+
+        self.assertEqual(200, plain.status_code)
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertNotEqual(compressed['ETag'], plain['ETag'])
@@ -0,0 +1,85 @@
+import time
+
+from django.core.cache import caches
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from genius_collection.core.blob_sas import container_sas_tokens
+from genius_collection.core.models import User, Ownership
+from genius_collection.core.testing import create_cards
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cards = create_cards(3)
+        cls.anna = User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch')
+        cls.bert = User.objects.create(first_name='Bert', last_name='B', email='bert@ipt.ch')
+
+    def setUp(self):
+        caches['shared'].clear()
+        for container in ['card-thumbnails', 'card-detail-views']:
+            container_sas_tokens.set(container, 'sig=test', time.time() + 24 * 60 * 60)
+        self.client = APIClient()
+        self.client.force_authenticate(user={'email': 'anna@ipt.ch', 'first_name': 'Anna', 'last_name': 'A'})
+
+    def get_again(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_collection_shows_the_quantities_of_the_user(self):
+        Ownership.objects.add_card_to_user(self.anna, self.cards[1], qty=3)
+        Ownership.objects.add_card_to_user(self.bert, self.cards[2])
+
+        response = self.client.get('/cards/')
+
+        self.assertEqual([0, 3, 0], [c['quantity'] for c in response.json()])
+        self.assertTrue(response.json()[1]['image_url'].startswith('https://'))
+
+    def test_unchanged_collection_is_not_modified(self):
+        response = self.client.get('/cards/')
+
+        # The user and the catalogue version
+        with self.assertNumQueries(2):
+            second_response = self.get_again('/cards/', response)
+
+        self.assertEqual(304, second_response.status_code)
+        self.assertEqual(response['ETag'], second_response['ETag'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_new_card_changes_the_etag(self):
+        response = self.client.get('/cards/')
+
+        Ownership.objects.add_card_to_user(self.anna, self.cards[0])
+
+        self.assertEqual(200, self.get_again('/cards/', response).status_code)
+
+    def test_other_users_do_not_change_the_etag(self):
+        response = self.client.get('/cards/')
+
+        Ownership.objects.add_card_to_user(self.bert, self.cards[0])
+
+        self.assertEqual(304, self.get_again('/cards/', response).status_code)
+
+    def test_card_edits_change_the_etag_of_everyone(self):
+        response = self.client.get('/cards/')
+        User.objects.create(first_name='Card', last_name='1', email='card1@ipt.ch')
+        card_owner_client = APIClient()
+        card_owner_client.force_authenticate(user={'email': 'card1@ipt.ch', 'first_name': 'Card', 'last_name': '1'})
+
+        card_owner_client.post('/cards/modify/', {'job': 'New Job', 'wish_destination': 'Bern', 'wish_person': 'Anna',
+                                                  'wish_skill': 'Python', 'best_advice': 'Test'}, format='json')
+
+        self.assertEqual(200, self.get_again('/cards/', response).status_code)
+        # Renewed by the catalogue version instead of updating every user
+        self.assertEqual(0, User.objects.get(pk=self.anna.pk).collection_version)
+
+    def test_overview_is_not_modified_until_the_leaderboard_changes(self):
+        response = self.client.get('/overview/')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(304, self.get_again('/overview/', response).status_code)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Ownership.objects.add_card_to_user(self.bert, self.cards[0])
+
+        self.assertEqual(200, self.get_again('/overview/', response).status_code)
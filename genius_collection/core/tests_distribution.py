@@ -0,0 +1,81 @@
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from genius_collection.core.models import User, Ownership
+from genius_collection.core.testing import create_card, create_cards
+
+
+class DistributeRandomCardsToUsersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cards = create_cards(5)
+        cls.users = [User.objects.create(first_name='User', last_name=str(i), email=f'user{i}@ipt.ch')
+                     for i in range(20)]
+
+    def test_distributes_quantity_to_every_user(self):
+        Ownership.objects.distribute_random_cards_to_users(self.users, 7)
+
+        for user in self.users:
+            total = Ownership.objects.filter(user=user).aggregate(Sum('quantity'))['quantity__sum']
+            self.assertEqual(7, total)
+
+    def test_users_listed_twice_get_cards_twice(self):
+        Ownership.objects.distribute_random_cards_to_users([self.users[0], self.users[1], self.users[0]], 7)
+
+        self.assertEqual(14, Ownership.objects.filter(user=self.users[0]).aggregate(Sum('quantity'))['quantity__sum'])
+        self.assertEqual(7, Ownership.objects.filter(user=self.users[1]).aggregate(Sum('quantity'))['quantity__sum'])
+
+    def test_merges_into_existing_ownerships(self):
+        Ownership.objects.create(user=self.users[0], card=self.cards[0], quantity=3)
+
+        Ownership.objects.distribute_random_cards_to_users(self.users[:1], 50)
+
+        self.assertEqual(53, Ownership.objects.filter(user=self.users[0]).aggregate(Sum('quantity'))['quantity__sum'])
+        self.assertEqual(1, Ownership.objects.filter(user=self.users[0], card=self.cards[0]).count())
+
+    def test_sets_last_received_unique_for_new_unique_cards(self):
+        for card in self.cards:
+            Ownership.objects.create(user=self.users[0], card=card)
+
+        Ownership.objects.distribute_random_cards_to_users(self.users[:2], 3)
+
+        self.assertIsNone(User.objects.get(pk=self.users[0].pk).last_received_unique)
+        self.assertIsNotNone(User.objects.get(pk=self.users[1].pk).last_received_unique)
+
+    def test_query_count_does_not_grow_with_users(self):
+        Ownership.objects.bulk_create([Ownership(user=u, card=c) for u in self.users for c in self.cards])
+
+        with CaptureQueriesContext(connection) as few_users:
+            Ownership.objects.distribute_random_cards_to_users(self.users[:2], 10)
+        with CaptureQueriesContext(connection) as all_users:
+            Ownership.objects.distribute_random_cards_to_users(self.users, 10)
+        self.assertEqual(len(few_users), len(all_users))
+
+
+class AddCardToUserTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.card = create_card(0)
+        cls.user = User.objects.create(first_name='User', last_name='0', email='user0@ipt.ch')
+
+    def test_reports_new_unique_cards(self):
+        ownership, created = Ownership.objects.add_card_to_user(self.user, self.card, qty=2)
+        self.assertTrue(created)
+        last_received_unique = User.objects.get(pk=self.user.pk).last_received_unique
+
+        ownership, created = Ownership.objects.add_card_to_user(self.user, self.card, qty=2)
+
+        self.assertFalse(created)
+        self.assertEqual(4, ownership.quantity)
+        self.assertEqual(4, Ownership.objects.get(pk=ownership.pk).quantity)
+        self.assertEqual(last_received_unique, User.objects.get(pk=self.user.pk).last_received_unique)
+
+    def test_upserts_with_one_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            Ownership.objects.add_card_to_user(self.user, self.card)
+
+        ownership_queries = [q['sql'] for q in queries.captured_queries if 'core_ownership' in q['sql']]
+        self.assertEqual(1, len(ownership_queries))
+        self.assertIn('ON CONFLICT', ownership_queries[0].upper())
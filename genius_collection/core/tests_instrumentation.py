@@ -0,0 +1,79 @@
+import time
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from genius_collection.core import views
+from genius_collection.core.instrumentation import (InstrumentationMiddleware, QueryBudgetExceeded,
+                                                     get_endpoint_stats, reset_endpoint_stats)
+from genius_collection.core.blob_sas import container_sas_tokens
+from genius_collection.core.catalogue import get_catalogue_snapshot
+from genius_collection.core.models import User
+from genius_collection.core.testing import create_card
+
+
+class InstrumentationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_card(0)
+        cls.anna = User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch', is_admin=True)
+
+    def setUp(self):
+        caches['shared'].clear()
+        reset_endpoint_stats()
+        container_sas_tokens.set('card-thumbnails', 'sig=test', time.time() + 24 * 60 * 60)
+        # Built by the first request otherwise, which takes another query
+        get_catalogue_snapshot()
+        self.client = APIClient()
+        self.client.force_authenticate(user={'email': 'anna@ipt.ch', 'first_name': 'Anna', 'last_name': 'A'})
+
+    def test_server_timing_reports_queries_and_caches(self):
+        response = self.client.get('/cards/')
+
+        metrics = response['Server-Timing'].split(', ')
+        self.assertRegex(metrics[0], r'^db;dur=[\d.]+;desc="3 queries"$')
+        # For the version of the catalogue, which is part of the ETag
+        self.assertIn('cache-sas;desc="1 hits 0 misses"', metrics)
+        self.assertRegex(metrics[-1], r'^total;dur=[\d.]+$')
+
+    def test_stats_are_summed_up_per_endpoint(self):
+        self.client.get('/cards/')
+        self.client.get('/cards/')
+
+        stats = self.client.get('/instrumentation/').data
+
+        self.assertEqual(2, stats['CardViewSet.list']['requests'])
+        self.assertEqual(3, stats['CardViewSet.list']['max_queries'])
+        self.assertEqual({'sas': 2}, stats['CardViewSet.list']['cache_hits'])
+
+    def test_exceeded_query_budget_fails_the_tests(self):
+        with mock.patch.object(views.CardViewSet.list, 'query_budget', 1):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'CardViewSet.list ran 3 queries, its budget is 1'):
+                self.client.get('/cards/')
+
+    @override_settings(QUERY_BUDGETS_ENFORCED=False)
+    def test_exceeded_query_budget_is_logged_otherwise(self):
+        with mock.patch.object(views.CardViewSet.list, 'query_budget', 1), \
+                self.assertLogs('genius_collection.core.instrumentation', 'WARNING'):
+            response = self.client.get('/cards/')
+
+        self.assertEqual(200, response.status_code)
+
+
+class AsyncInstrumentationTest(TestCase):
+    def setUp(self):
+        reset_endpoint_stats()
+
+    async def test_async_views_are_awaited_without_a_sync_thread(self):
+        acall = InstrumentationMiddleware.__acall__
+        with mock.patch.object(InstrumentationMiddleware, '__acall__', autospec=True, side_effect=acall) as mock_acall:
+            # Not authenticated, so the view answers without queries
+            response = await self.async_client.get('/picture/')
+
+        self.assertEqual(403, response.status_code)
+        mock_acall.assert_called_once()
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="0 queries", total;dur=[\d.]+$')
+        self.assertEqual(1, get_endpoint_stats()['PictureView.get']['requests'])
+
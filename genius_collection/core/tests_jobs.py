@@ -0,0 +1,144 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from genius_collection.core import jobs
+from genius_collection.core.leaderboard import get_leaderboard
+from genius_collection.core.models import User, Ownership, Job, Distribution
+from genius_collection.core.testing import create_cards
+
+
+def run_worker():
+    call_command('worker', '--once', stdout=StringIO())
+
+
+class JobQueueTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch', is_admin=True)
+
+    def setUp(self):
+        self.calls = 0
+
+        def flaky(job):
+            self.calls += 1
+            if self.calls < job.payload['fail_times'] + 1:
+                raise RuntimeError('Azure is down')
+            return {'calls': self.calls}
+
+        patcher = mock.patch.dict(jobs._handlers, {'flaky': flaky})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_idempotency_key_returns_the_existing_job(self):
+        job, created = jobs.enqueue_job('flaky', {'fail_times': 0}, idempotency_key='key-1')
+        same_job, same_created = jobs.enqueue_job('flaky', {'fail_times': 0}, idempotency_key='key-1')
+
+        self.assertTrue(created)
+        self.assertFalse(same_created)
+        self.assertEqual(job.id, same_job.id)
+
+    def test_failed_jobs_are_retried(self):
+        job, _ = jobs.enqueue_job('flaky', {'fail_times': 1})
+
+        run_worker()
+        self.assertEqual(Job.Status.QUEUED, Job.objects.get(pk=job.pk).status)
+        Job.objects.filter(pk=job.pk).update(run_after=job.run_after)
+        run_worker()
+
+        job.refresh_from_db()
+        self.assertEqual(Job.Status.SUCCEEDED, job.status)
+        self.assertEqual(2, job.attempts)
+        self.assertEqual({'calls': 2}, job.result)
+
+    def test_jobs_fail_after_the_last_attempt(self):
+        job, _ = jobs.enqueue_job('flaky', {'fail_times': 5})
+
+        for _ in range(job.max_attempts):
+            Job.objects.filter(pk=job.pk).update(run_after=job.run_after)
+            run_worker()
+
+        job.refresh_from_db()
+        self.assertEqual(Job.Status.FAILED, job.status)
+        self.assertIn('Azure is down', job.error)
+
+    def test_jobs_of_crashed_workers_are_taken_over(self):
+        job, _ = jobs.enqueue_job('flaky', {'fail_times': 0})
+        jobs.claim_job('crashed-worker')
+        Job.objects.filter(pk=job.pk).update(locked_until=job.run_after)
+
+        run_worker()
+
+        self.assertEqual(Job.Status.SUCCEEDED, Job.objects.get(pk=job.pk).status)
+
+
+class DistributeJobTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        create_cards(3)
+        cls.admin = User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch', is_admin=True)
+        cls.users = [User.objects.create(first_name='U', last_name=str(i), email=f'u{i}@ipt.ch') for i in range(4)]
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user={'email': 'anna@ipt.ch'})
+
+    def distribute(self, **headers):
+        return self.client.post('/distribute/', {'quantity': 2, 'receivers': 'all'}, format='json', **headers)
+
+    def test_distribution_returns_a_job(self):
+        response = self.distribute()
+        self.assertEqual(202, response.status_code)
+        self.assertFalse(Ownership.objects.exists())
+
+        run_worker()
+
+        self.assertEqual(10, Ownership.objects.aggregate(total=Sum('quantity'))['total'])
+        job = self.client.get(f'/jobs/{response.data["job_id"]}/').data
+        self.assertEqual('SUCCEEDED', job['status'])
+        self.assertEqual(5, job['progress'])
+        self.assertEqual(5, job['total'])
+
+    def test_receivers_listed_twice_get_cards_twice(self):
+        receivers = ['u0@ipt.ch', 'u1@ipt.ch', 'u0@ipt.ch']
+        response = self.client.post('/distribute/', {'quantity': 2, 'receivers': receivers}, format='json')
+        run_worker()
+
+        self.assertIn('3 * 2 = 6', response.data['status'])
+        self.assertEqual(4, Ownership.objects.filter(user=self.users[0]).aggregate(total=Sum('quantity'))['total'])
+        self.assertEqual(2, Ownership.objects.filter(user=self.users[1]).aggregate(total=Sum('quantity'))['total'])
+
+    def test_leaderboard_is_refreshed_by_the_job(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.distribute()
+        self.assertIsNone(get_leaderboard()['totalCardQuantity'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            run_worker()
+
+        self.assertEqual(10, get_leaderboard()['totalCardQuantity'])
+
+    def test_distribution_is_idempotent_by_key(self):
+        first = self.distribute(HTTP_IDEMPOTENCY_KEY='distribution-1')
+        second = self.distribute(HTTP_IDEMPOTENCY_KEY='distribution-1')
+        run_worker()
+
+        self.assertEqual(first.data['job_id'], second.data['job_id'])
+        self.assertEqual(1, Distribution.objects.count())
+        self.assertEqual(10, Ownership.objects.aggregate(total=Sum('quantity'))['total'])
+
+    def test_retries_continue_after_the_finished_users(self):
+        job, _ = jobs.enqueue_job('distribute', {'quantity': 2, 'user_ids': [u.id for u in self.users]})
+        # As if a previous attempt finished the first chunk before it failed
+        Job.objects.filter(pk=job.pk).update(progress=len(self.users))
+
+        run_worker()
+
+        self.assertFalse(Ownership.objects.exists())
+        self.assertEqual(Job.Status.SUCCEEDED, Job.objects.get(pk=job.pk).status)
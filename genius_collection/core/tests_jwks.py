@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from genius_collection.core.jwks import JWKSKeyStore, UnknownKidError
+from genius_collection.core.jwt_validation import JWTAccessTokenAuthentication, InvalidAuthorizationToken
+from genius_collection.core.testing import LocalJWKSServer, SigningKey
+
+AUDIENCE = 'api://test'
+ISSUER = 'https://sts.example.com/tenant/'
+
+
+class JWKSKeyStoreTest(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.signing_key = SigningKey('kid-1')
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.server = LocalJWKSServer(self.signing_key)
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+
+    def test_keys_are_fetched_once(self):
+        key_store = JWKSKeyStore(self.server.jwks_uri)
+
+        keys = [key_store.get_key('kid-1') for _ in range(100)]
+
+        self.assertEqual(1, self.server.requests)
+        self.assertTrue(all(k is keys[0] for k in keys))
+
+    def test_concurrent_misses_share_one_fetch(self):
+        self.server.delay = 0.2
+        key_store = JWKSKeyStore(self.server.jwks_uri)
+        threads = [threading.Thread(target=key_store.get_key, args=('kid-1',)) for _ in range(10)]
+
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(1, self.server.requests)
+
+    def test_concurrent_async_misses_share_one_fetch(self):
+        self.server.delay = 0.2
+        key_store = JWKSKeyStore(self.server.jwks_uri)
+
+        async def get_keys():
+            return await asyncio.gather(*[key_store.aget_key('kid-1') for _ in range(10)])
+
+        keys = asyncio.run(get_keys())
+
+        self.assertEqual(1, self.server.requests)
+        self.assertTrue(all(k is keys[0] for k in keys))
+
+    def test_unknown_kids_are_cached(self):
+        key_store = JWKSKeyStore(self.server.jwks_uri, min_fetch_interval=0)
+        key_store.get_key('kid-1')
+
+        for _ in range(10):
+            with self.assertRaises(UnknownKidError):
+                key_store.get_key('kid-unknown')
+
+        self.assertEqual(2, self.server.requests)
+
+    def test_new_kids_are_fetched(self):
+        key_store = JWKSKeyStore(self.server.jwks_uri, min_fetch_interval=0)
+        key_store.get_key('kid-1')
+        self.server.signing_keys.append(SigningKey('kid-2'))
+
+        self.assertIsNotNone(key_store.get_key('kid-2'))
+
+    def test_key_sets_are_shared_with_other_processes(self):
+        JWKSKeyStore(self.server.jwks_uri).get_key('kid-1')
+
+        # A key store of another process, which starts after the first one fetched the keys
+        self.assertIsNotNone(JWKSKeyStore(self.server.jwks_uri).get_key('kid-1'))
+        self.assertEqual(1, self.server.requests)
+
+    def test_refreshes_in_background_before_expiry(self):
+        key_store = JWKSKeyStore(self.server.jwks_uri, refresh_interval=0.2, refresh_ahead=0.1)
+        key_store.get_key('kid-1')
+        time.sleep(0.15)
+
+        key_store.get_key('kid-1')
+        key_store._background_refresh.join()
+
+        self.assertEqual(2, self.server.requests)
+
+    def test_verify_jwt(self):
+        token = self.signing_key.sign(AUDIENCE, ISSUER, email='anna@ipt.ch')
+        authenticator = JWTAccessTokenAuthentication()
+
+        payload = authenticator.verify_jwt(token=token, valid_audiences=[AUDIENCE], issuer=ISSUER,
+                                           jwks_uri=self.server.jwks_uri)
+
+        self.assertEqual('anna@ipt.ch', payload['unique_name'])
+        with self.assertRaises(InvalidAuthorizationToken):
+            authenticator.verify_jwt(token=SigningKey('kid-1').sign(AUDIENCE, ISSUER), valid_audiences=[AUDIENCE],
+                                     issuer=ISSUER, jwks_uri=self.server.jwks_uri)
@@ -0,0 +1,136 @@
+import datetime
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from genius_collection.core.leaderboard import LEADERBOARD_GENERATION_CACHE, build_leaderboard, get_leaderboard
+from genius_collection.core.models import User, Ownership
+from genius_collection.core.testing import create_card, create_cards
+from genius_collection.core.tiered_cache import TieredCache
+
+
+class LeaderboardTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cards = create_cards(3)
+        cls.anna = User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch', quiz_score=5)
+        cls.bert = User.objects.create(first_name='Bert', last_name='B', email='bert@ipt.ch', quiz_score=50)
+        cls.carl = User.objects.create(first_name='Carl', last_name='C', email='carl@ipt.ch')
+        for card in cls.cards:
+            Ownership.objects.create(user=cls.anna, card=card, quantity=2)
+        Ownership.objects.create(user=cls.bert, card=cls.cards[0])
+
+    def setUp(self):
+        caches['shared'].clear()
+
+    def test_rankings(self):
+        leaderboard = get_leaderboard()
+
+        self.assertEqual(['anna@ipt.ch', 'bert@ipt.ch', 'carl@ipt.ch'],
+                         [r['userEmail'] for r in leaderboard['rankingCards']])
+        self.assertEqual([3, 1, 0], [r['uniqueCardsCount'] for r in leaderboard['rankingCards']])
+        self.assertEqual(['bert@ipt.ch', 'anna@ipt.ch', 'carl@ipt.ch'],
+                         [r['userEmail'] for r in leaderboard['rankingQuiz']])
+        self.assertEqual([1, 2, 3], [r['rank'] for r in leaderboard['rankingQuiz']])
+        self.assertEqual(7, leaderboard['totalCardQuantity'])
+
+    def test_ties_are_broken_by_last_received_unique(self):
+        self.carl.last_received_unique = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        self.carl.save()
+        Ownership.objects.create(user=self.carl, card=self.cards[1])
+
+        leaderboard = get_leaderboard()
+
+        self.assertEqual(['anna@ipt.ch', 'carl@ipt.ch', 'bert@ipt.ch'],
+                         [r['userEmail'] for r in leaderboard['rankingCards']])
+
+    def test_ownership_changes_refresh_the_leaderboard(self):
+        get_leaderboard()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Ownership.objects.add_card_to_user(self.carl, self.cards[1])
+            Ownership.objects.add_card_to_user(self.carl, self.cards[2])
+
+        self.assertEqual(2, get_leaderboard()['uniqueCardsCounts']['carl@ipt.ch'])
+
+    def test_invalidation_by_another_process_refreshes_the_leaderboard(self):
+        get_leaderboard()
+        Ownership.objects.create(user=self.carl, card=self.cards[1])
+
+        # E.g. the worker after distributing cards
+        TieredCache('leaderboard', maxsize=0).set(LEADERBOARD_GENERATION_CACHE, 'next')
+
+        self.assertEqual(1, get_leaderboard()['uniqueCardsCounts']['carl@ipt.ch'])
+
+    def test_invalidation_during_a_build_is_not_lost(self):
+        def build_and_transfer():
+            stale = build_leaderboard()
+            # Another request commits a change after the ranking was read, but before the build is stored
+            with self.captureOnCommitCallbacks(execute=True):
+                Ownership.objects.add_card_to_user(self.carl, self.cards[1])
+            return stale
+
+        with mock.patch('genius_collection.core.leaderboard.build_leaderboard', side_effect=build_and_transfer):
+            self.assertEqual(0, get_leaderboard()['uniqueCardsCounts']['carl@ipt.ch'])
+
+        self.assertEqual(1, get_leaderboard()['uniqueCardsCounts']['carl@ipt.ch'])
+
+    def test_overview_does_not_query_per_user(self):
+        client = APIClient()
+        client.force_authenticate(user={'email': 'anna@ipt.ch'})
+        get_leaderboard()
+
+        with self.assertNumQueries(0):
+            response = client.get('/overview/')
+
+        self.assertEqual(3, response.data['myUniqueCardsCount'])
+        self.assertEqual(3, response.data['allCardsCount'])
+        self.assertEqual(1, response.data['rankingCards'][0]['rank'])
+
+
+class LeaderboardApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        card = create_card(0)
+        for i in range(25):
+            user = User.objects.create(first_name='User', last_name=str(i), email=f'user{i:02}@ipt.ch', quiz_score=i)
+            if i % 2 == 0:
+                Ownership.objects.create(user=user, card=card)
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user={'email': 'user10@ipt.ch'})
+
+    def test_pages_cover_the_ranking_once(self):
+        emails = []
+        cursor = ''
+        while cursor is not None:
+            response = self.client.get('/leaderboard/quiz/', {'limit': 10, 'cursor': cursor})
+            emails += [r['userEmail'] for r in response.data['results']]
+            cursor = response.data['next']
+
+        self.assertEqual([f'user{i:02}@ipt.ch' for i in reversed(range(25))], emails)
+
+    def test_cursor_continues_after_its_user_when_ranks_move(self):
+        first_page = self.client.get('/leaderboard/quiz/', {'limit': 3}).data
+        User.objects.filter(email='user24@ipt.ch').update(quiz_score=-1)
+        caches['shared'].clear()
+
+        second_page = self.client.get('/leaderboard/quiz/', {'limit': 3, 'cursor': first_page['next']}).data
+
+        self.assertEqual(['user21@ipt.ch', 'user20@ipt.ch', 'user19@ipt.ch'],
+                         [r['userEmail'] for r in second_page['results']])
+
+    def test_around_me(self):
+        response = self.client.get('/leaderboard/quiz/around-me/', {'radius': 2})
+
+        self.assertEqual(15, response.data['rank'])
+        self.assertEqual([12, 11, 10, 9, 8], [r['quizScore'] for r in response.data['results']])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(400, self.client.get('/leaderboard/cards/', {'cursor': 'nope'}).status_code)
+        self.assertEqual(400, self.client.get('/leaderboard/cards/', {'limit': 'x'}).status_code)
+        self.assertEqual(400, self.client.get('/leaderboard/cards/around-me/', {'radius': 0}).status_code)
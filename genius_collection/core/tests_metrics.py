@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+
+from genius_collection.core.instrumentation import record_cache
+from genius_collection.core.metrics import get_metrics
+from genius_collection.core.models import User
+
+
+def get_sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class OperationMetricsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(first_name='Bert', last_name='B', email='bert@ipt.ch')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user={'email': 'bert@ipt.ch'})
+
+    def test_operations_are_counted_by_status(self):
+        before = get_sample('genius_collection_operations_total', operation='transfer', status='404')
+        observed_before = get_sample('genius_collection_operation_duration_seconds_count', operation='transfer')
+
+        response = self.client.post('/cards/transfer/', {'giver': 'nobody@ipt.ch', 'id': 1, 'otp': '0'},
+                                    format='json')
+
+        self.assertEqual(404, response.status_code)
+        self.assertEqual(before + 1,
+                         get_sample('genius_collection_operations_total', operation='transfer', status='404'))
+        self.assertEqual(observed_before + 1,
+                         get_sample('genius_collection_operation_duration_seconds_count', operation='transfer'))
+
+    def test_cache_lookups_are_counted(self):
+        before = get_sample('genius_collection_cache_lookups_total', cache='sas', result='miss')
+
+        record_cache('sas', False)
+
+        self.assertEqual(before + 1, get_sample('genius_collection_cache_lookups_total', cache='sas', result='miss'))
+
+    def test_metrics_are_exposed_as_text(self):
+        response = self.client.get('/metrics/')
+
+        self.assertEqual(200, response.status_code)
+        self.assertIn(b'# TYPE genius_collection_operations_total counter', response.content)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_require_the_token_if_set(self):
+        self.assertEqual(403, self.client.get('/metrics/').status_code)
+        self.assertEqual(200, self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code)
+
+    @override_settings(METRICS_TOKEN=None, METRICS_REQUIRE_TOKEN=True)
+    def test_metrics_are_not_found_without_a_token_in_production(self):
+        self.assertEqual(404, self.client.get('/metrics/').status_code)
+
+
+class MultiProcessMetricsTest(SimpleTestCase):
+    def test_metrics_of_all_processes_are_summed_up(self):
+        script = ("from genius_collection.core.metrics import OPERATIONS; "
+                  "OPERATIONS.labels('transfer', '200').inc()")
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': directory}
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', script], env=env, check=True)
+
+            with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': directory}):
+                metrics = get_metrics().decode()
+
+        self.assertIn('genius_collection_operations_total{operation="transfer",status="200"} 2.0', metrics)
@@ -0,0 +1,101 @@
+import io
+import time
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+
+from genius_collection.core.blob_sas import container_sas_tokens
+from genius_collection.core.images import IMAGE_VARIANTS, InvalidImage, render_variants
+from genius_collection.core.jobs import run_pending_jobs
+from genius_collection.core.jwt_validation import JWTAccessTokenAuthentication
+from genius_collection.core.models import User, Card
+from genius_collection.core.storage import get_blob_storage
+from genius_collection.core.testing import LocalJWKSServer, SigningKey, create_card
+
+AUDIENCE = 'api://test'
+ISSUER = 'https://sts.example.com/tenant/'
+
+
+def make_jpeg(size):
+    output = io.BytesIO()
+    Image.new('RGB', size, 'teal').save(output, 'JPEG')
+    return output.getvalue()
+
+
+@override_settings(BLOB_STORAGE_BACKEND='genius_collection.core.testing.SimulatedBlobStorage')
+class AsyncPictureTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.signing_key = SigningKey('kid-1')
+        cls.server = LocalJWKSServer(cls.signing_key)
+        cls.server.__enter__()
+        cls.addClassCleanup(cls.server.__exit__, None, None, None)
+
+    @classmethod
+    def setUpTestData(cls):
+        create_card(0, name='Anna A', email='anna@ipt.ch')
+        User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch')
+
+    def setUp(self):
+        container_sas_tokens.set('card-originals', 'sig=test', time.time() + 24 * 60 * 60)
+        for name, value in [('jwks_uri', self.server.jwks_uri), ('issuer', ISSUER), ('valid_audience', AUDIENCE)]:
+            patcher = mock.patch.object(JWTAccessTokenAuthentication, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.headers = {'Authorization': f'Bearer {self.signing_key.sign(AUDIENCE, ISSUER, email="anna@ipt.ch")}'}
+
+    async def test_upload_stores_the_picture_and_renders_its_variants(self):
+        picture = SimpleUploadedFile('anna.jpg', make_jpeg((3000, 4000)), content_type='image/jpeg')
+
+        response = await self.async_client.post('/picture/', {'file': picture}, headers=self.headers)
+
+        self.assertEqual(200, response.status_code)
+        blobs = get_blob_storage().blobs
+        self.assertEqual(picture.file.getvalue(), blobs[('card-originals', 'anna@ipt.ch.jpg')])
+        # The card keeps its version until the variants are uploaded, so the original may not be kept as immutable
+        self.assertEqual('no-cache', get_blob_storage().cache_controls[('card-originals', 'anna@ipt.ch.jpg')])
+        self.assertIsNone((await Card.objects.aget(email='anna@ipt.ch')).image_version)
+
+        await sync_to_async(run_pending_jobs)('test-worker')
+
+        image_version = (await Card.objects.aget(email='anna@ipt.ch')).image_version
+        self.assertTrue(response.json().endswith(f'&v={image_version}'))
+        self.assertEqual(response.json(), (await self.async_client.get('/picture/', headers=self.headers)).json())
+        self.assertEqual((240, 320), Image.open(io.BytesIO(blobs[('card-thumbnails', 'anna@ipt.ch.jpg')])).size)
+        self.assertIn(('card-detail-views', 'anna@ipt.ch.jpg'), blobs)
+        self.assertIn('immutable', get_blob_storage().cache_controls[('card-thumbnails', 'anna@ipt.ch.jpg')])
+
+    async def test_only_jpegs_are_accepted(self):
+        picture = SimpleUploadedFile('anna.png', b'picture', content_type='image/png')
+
+        response = await self.async_client.post('/picture/', {'file': picture}, headers=self.headers)
+
+        self.assertEqual(400, response.status_code)
+
+    async def test_requests_without_token_are_rejected(self):
+        response = await self.async_client.get('/picture/')
+
+        self.assertEqual(403, response.status_code)
+
+
+class RenderVariantsTest(SimpleTestCase):
+    def test_variants_fit_their_box_and_are_progressive(self):
+        variants = render_variants(make_jpeg((4000, 3000)))
+
+        for variant in IMAGE_VARIANTS:
+            image = Image.open(io.BytesIO(variants[variant.container_name]))
+            self.assertEqual(variant.max_size[0], image.width)
+            self.assertTrue(image.info.get('progressive'))
+
+    def test_small_pictures_are_not_scaled_up(self):
+        variants = render_variants(make_jpeg((200, 100)))
+
+        self.assertEqual((200, 100), Image.open(io.BytesIO(variants['card-detail-views'])).size)
+
+    def test_invalid_pictures_are_rejected(self):
+        with self.assertRaises(InvalidImage):
+            render_variants(b'\xff\xd8picture')
@@ -0,0 +1,121 @@
+from django.core.cache import caches
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from genius_collection.core.leaderboard import get_leaderboard
+from genius_collection.core.models import User, Quiz
+from genius_collection.core.quiz_pool import (QUIZ_POOL_VERSION_CACHE, get_quiz_candidate_index,
+                                              invalidate_quiz_candidate_index)
+from genius_collection.core.testing import create_card
+from genius_collection.core.tiered_cache import TieredCache
+
+
+class QuizCandidateIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(8):
+            create_card(i, job=f'Job {i % 3}', email=f'user{i}@ipt.ch', wish_skill=None if i % 2 else f'Skill {i}')
+        User.objects.create(first_name='Anna', last_name='A', email='user0@ipt.ch')
+
+    def setUp(self):
+        caches['shared'].clear()
+
+    def test_sampled_answers_are_distinct(self):
+        index = get_quiz_candidate_index()
+
+        for _ in range(20):
+            cards = index.sample('name', 'job', 4)
+            self.assertEqual(3, len({c.job for c in cards}))
+
+    def test_cards_with_null_values_are_left_out(self):
+        cards = get_quiz_candidate_index().sample('wish_skill', 'name', 8)
+
+        self.assertEqual({0, 2, 4, 6}, {int(c.name[-1]) for c in cards})
+
+    def test_index_is_rebuilt_after_invalidation(self):
+        index = get_quiz_candidate_index()
+        self.assertIs(index, get_quiz_candidate_index())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_quiz_candidate_index()
+
+        self.assertIsNot(index, get_quiz_candidate_index())
+
+    def test_index_is_rebuilt_after_invalidation_by_another_process(self):
+        index = get_quiz_candidate_index()
+
+        # E.g. the worker after deleting a card
+        TieredCache('quiz-pool', maxsize=0).set(QUIZ_POOL_VERSION_CACHE, 'other')
+
+        self.assertIsNot(index, get_quiz_candidate_index())
+
+    def test_question_only_inserts_the_quiz(self):
+        client = APIClient()
+        client.force_authenticate(user={'email': 'user0@ipt.ch'})
+        client.post('/quiz/question/', {'question_type': 'name', 'answer_type': 'job'}, format='json')
+
+        with self.assertNumQueries(1):
+            response = client.post('/quiz/question/', {'question_type': 'name', 'answer_type': 'job'}, format='json')
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(3, len(response.data['answer_possible_values']))
+        self.assertEqual(2, Quiz.objects.count())
+
+
+class QuizRoundTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(6):
+            create_card(i, job=f'Job {i}', email=f'user{i}@ipt.ch')
+        cls.user = User.objects.create(first_name='Anna', last_name='A', email='user0@ipt.ch', quiz_score=100)
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user={'email': 'user0@ipt.ch'})
+
+    def test_round_creates_all_questions(self):
+        response = self.client.post('/quiz/round/', {'questions': 5, 'question_type': 'name', 'answer_type': 'job'},
+                                    format='json')
+
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(5, len(response.data['questions']))
+        self.assertEqual(set(Quiz.objects.values_list('id', flat=True)),
+                         {q['question_id'] for q in response.data['questions']})
+
+    def test_round_answers_update_the_score_once(self):
+        questions = self.client.post('/quiz/round/', {'questions': 4, 'question_type': 'name', 'answer_type': 'job'},
+                                     format='json').data['questions']
+        answers = [{'question_id': q['question_id'], 'answer': f'Job {q["question_value"][-1]}'} for q in questions]
+        answers[0]['answer'] = 'wrong'
+
+        with self.assertNumQueries(8):
+            response = self.client.post('/quiz/round/answer/', {'answers': answers}, format='json')
+
+        self.assertEqual([False, True, True, True], [a['is_correct'] for a in response.data['answers']])
+        self.assertEqual(100 - 8 + 3 * 25, response.data['new_score'])
+        self.assertEqual(100 - 8 + 3 * 25, User.objects.get(pk=self.user.pk).quiz_score)
+
+    def test_questions_are_answered_only_once(self):
+        questions = self.client.post('/quiz/round/', {'questions': 2, 'question_type': 'name', 'answer_type': 'job'},
+                                     format='json').data['questions']
+        answers = [{'question_id': q['question_id'], 'answer': 'wrong'} for q in questions]
+
+        self.client.post('/quiz/round/answer/', {'answers': answers[:1]}, format='json')
+        response = self.client.post('/quiz/round/answer/', {'answers': answers}, format='json')
+
+        self.assertIn('status', response.data['answers'][0])
+        self.assertEqual(-8, response.data['score_change'])
+
+    def test_answers_without_score_change_keep_the_leaderboard(self):
+        questions = self.client.post('/quiz/round/', {'questions': 1, 'question_type': 'name', 'answer_type': 'job'},
+                                     format='json').data['questions']
+        answers = [{'question_id': questions[0]['question_id'], 'answer': 'wrong'}]
+        self.client.post('/quiz/round/answer/', {'answers': answers}, format='json')
+        version = get_leaderboard()['version']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/quiz/round/answer/', {'answers': answers}, format='json')
+
+        self.assertEqual(0, response.data['score_change'])
+        self.assertEqual(version, get_leaderboard()['version'])
@@ -0,0 +1,53 @@
+import tempfile
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase
+
+from genius_collection.core import storage
+
+
+class FileSystemBlobStorageTest(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.storage = storage.FileSystemBlobStorage(root.name)
+
+    def test_upload_and_delete(self):
+        self.storage.upload('card-originals', 'anna@ipt.ch.jpg', b'picture')
+        async_to_sync(self.storage.aupload)('card-originals', 'anna@ipt.ch.jpg', b'new picture')
+
+        self.assertEqual(b'new picture', self.storage.path('card-originals', 'anna@ipt.ch.jpg').read_bytes())
+        self.assertTrue(self.storage.delete('card-originals', 'anna@ipt.ch.jpg'))
+        self.assertFalse(self.storage.delete('card-originals', 'anna@ipt.ch.jpg'))
+
+    def test_blob_name_outside_of_container(self):
+        with self.assertRaises(ValueError):
+            self.storage.upload('card-originals', '../../passwd', b'picture')
+
+
+class BlobServiceClientTest(SimpleTestCase):
+    def tearDown(self):
+        storage.close_blob_service_client()
+
+    def test_client_is_shared_until_closed(self):
+        client = storage.get_blob_service_client()
+        self.assertIs(client, storage.get_blob_service_client())
+
+        storage.close_blob_service_client()
+        self.assertIsNot(client, storage.get_blob_service_client())
+
+
+class AsyncBlobServiceClientTest(SimpleTestCase):
+    async def get_clients(self):
+        return storage.get_async_blob_service_client(), storage.get_async_blob_service_client()
+
+    def test_client_is_shared_within_its_loop_and_closed_with_it(self):
+        with mock.patch.object(storage.AsyncBlobServiceClient, 'close', autospec=True) as close:
+            client, same_client = async_to_sync(self.get_clients)()
+            # E.g. the next request served with WSGI
+            other_client, _ = async_to_sync(self.get_clients)()
+
+        self.assertIs(client, same_client)
+        self.assertIsNot(client, other_client)
+        self.assertEqual([mock.call(client), mock.call(other_client)], close.await_args_list)
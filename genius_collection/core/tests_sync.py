@@ -0,0 +1,90 @@
+import datetime
+import time
+
+from django.core.cache import caches
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from genius_collection.core.blob_sas import container_sas_tokens
+from genius_collection.core.models import User, Card, Ownership, OwnershipTombstone
+from genius_collection.core.otp import generate_otp
+from genius_collection.core.sync import encode_cursor, get_collection_changes
+from genius_collection.core.testing import create_cards
+
+
+class CollectionChangesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cards = create_cards(4)
+        cls.anna = User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch')
+        cls.bert = User.objects.create(first_name='Bert', last_name='B', email='bert@ipt.ch')
+        Ownership.objects.add_card_to_user(cls.anna, cls.cards[0], qty=2)
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.since = timezone.now()
+
+    def changed_cards(self, user):
+        changes = get_collection_changes(user, self.since)
+        return {c['id']: c['quantity'] for c in changes['cards']}
+
+    def test_without_cursor_the_whole_collection_is_returned(self):
+        changes = get_collection_changes(self.anna)
+
+        self.assertTrue(changes['full'])
+        self.assertEqual([2, 0, 0, 0], [c['quantity'] for c in changes['cards']])
+
+    def test_only_changed_ownerships_are_returned(self):
+        Ownership.objects.add_card_to_user(self.anna, self.cards[1])
+        Ownership.objects.add_card_to_user(self.bert, self.cards[2])
+
+        self.assertEqual({self.cards[1].id: 1}, self.changed_cards(self.anna))
+        self.assertEqual({self.cards[2].id: 1}, self.changed_cards(self.bert))
+
+    def test_distributions_are_returned(self):
+        Ownership.objects.distribute_random_cards_to_users([self.bert], 3)
+
+        self.assertEqual(3, sum(self.changed_cards(self.bert).values()))
+
+    def test_transferred_last_card_is_returned_with_quantity_zero(self):
+        Ownership.objects.add_card_to_user(self.bert, self.cards[3])
+        self.since = timezone.now()
+        ownership = Ownership.objects.get(user=self.bert, card=self.cards[3])
+
+        Ownership.objects.transfer_ownership(self.anna, ownership, generate_otp(ownership)[0])
+
+        self.assertEqual({self.cards[3].id: 0}, self.changed_cards(self.bert))
+        self.assertEqual({self.cards[3].id: 1}, self.changed_cards(self.anna))
+
+    def test_card_edits_are_returned_to_everyone(self):
+        card = Card.objects.get(pk=self.cards[2].pk)
+        card.job = 'New Job'
+        card.save()
+
+        self.assertEqual({self.cards[2].id: 0}, self.changed_cards(self.anna))
+
+    def test_deleted_cards_are_removed(self):
+        OwnershipTombstone.objects.create(card_id=self.cards[3].pk)
+        Card.objects.filter(pk=self.cards[3].pk).delete()
+
+        self.assertEqual([self.cards[3].pk], get_collection_changes(self.anna, self.since)['removed'])
+
+    def test_old_cursors_get_the_whole_collection(self):
+        changes = get_collection_changes(self.anna, self.since - datetime.timedelta(days=365))
+
+        self.assertTrue(changes['full'])
+        self.assertEqual(4, len(changes['cards']))
+
+    def test_changes_endpoint(self):
+        container_sas_tokens.set('card-thumbnails', 'sig=test', time.time() + 24 * 60 * 60)
+        client = APIClient()
+        client.force_authenticate(user={'email': 'anna@ipt.ch'})
+        Ownership.objects.add_card_to_user(self.anna, self.cards[1])
+
+        response = client.get('/cards/changes/', {'since': encode_cursor(self.since)})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([self.cards[1].id], [c['id'] for c in response.data['cards']])
+        self.assertIn('image_url', response.data['cards'][0])
+        self.assertEqual(400, client.get('/cards/changes/', {'since': 'yesterday'}).status_code)
@@ -0,0 +1,104 @@
+import base64
+import datetime
+import threading
+import time
+from unittest import mock
+
+from azure.storage.blob import UserDelegationKey
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from genius_collection.core import blob_sas
+from genius_collection.core.tiered_cache import TieredCache
+
+
+class TieredCacheTest(SimpleTestCase):
+    def setUp(self):
+        caches['shared'].clear()
+
+    def test_entries_are_shared_with_other_processes(self):
+        TieredCache('test').set('key', 'value', time.time() + 60)
+
+        # The cache of another process, whose L1 is empty
+        self.assertEqual('value', TieredCache('test').get('key'))
+        self.assertIsNone(TieredCache('other').get('key'))
+
+    def test_entries_expire_in_both_tiers(self):
+        cache = TieredCache('test')
+        cache.set('key', 'value', time.time() + 0.1)
+        time.sleep(0.15)
+
+        self.assertIsNone(cache.get('key'))
+        self.assertIsNone(TieredCache('test').get('key'))
+
+    def test_concurrent_misses_create_the_entry_once(self):
+        cache = TieredCache('test')
+        created = []
+
+        def create():
+            created.append(1)
+            time.sleep(0.1)
+            return 'value'
+
+        threads = [threading.Thread(target=cache.get_or_set, args=('key', create)) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(1, len(created))
+        self.assertEqual('value', cache.get('key'))
+
+    def test_waits_for_the_process_creating_the_entry(self):
+        other_process = TieredCache('test')
+        # The other process holds the lock, and stores the entry a little later
+        caches['shared'].add(other_process.shared_key('key:lock'), 1, 10)
+        threading.Timer(0.1, other_process.set, args=('key', 'value')).start()
+
+        value = TieredCache('test').get_or_set('key', lambda: self.fail('Created twice'))
+
+        self.assertEqual('value', value)
+
+    def test_unavailable_shared_cache_only_costs_the_l2(self):
+        cache = TieredCache('test')
+        with mock.patch.object(caches['shared'], 'get', side_effect=ConnectionError), \
+                mock.patch.object(caches['shared'], 'set', side_effect=ConnectionError), \
+                self.assertLogs('genius_collection.core.tiered_cache', 'WARNING'):
+            self.assertEqual('value', cache.get_or_set('key', lambda: 'value'))
+            self.assertEqual('value', cache.get('key'))
+
+
+class ContainerSasTest(SimpleTestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        blob_sas.user_delegation_keys.clear()
+        blob_sas.container_sas_tokens.clear()
+        self.addCleanup(blob_sas.user_delegation_keys.clear)
+        self.addCleanup(blob_sas.container_sas_tokens.clear)
+
+        self.key_expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=2)
+        key = UserDelegationKey()
+        key.signed_oid = key.signed_tid = 'test'
+        key.signed_start = '2020-01-01T00:00:00Z'
+        key.signed_expiry = self.key_expiry.strftime('%Y-%m-%dT%H:%M:%SZ')
+        key.signed_service = 'b'
+        key.signed_version = '2021-08-06'
+        key.value = base64.b64encode(b'secret').decode()
+        patcher = mock.patch('genius_collection.core.blob_sas.get_blob_service_client')
+        self.client = patcher.start().return_value
+        self.client.get_user_delegation_key.return_value = key
+        self.addCleanup(patcher.stop)
+
+    def test_tokens_are_created_once_for_all_processes(self):
+        sas = blob_sas.get_container_sas('card-thumbnails')
+        # The next worker process starts with an empty L1
+        blob_sas.user_delegation_keys.clear()
+        blob_sas.container_sas_tokens.clear()
+
+        self.assertEqual(sas, blob_sas.get_container_sas('card-thumbnails'))
+        self.assertEqual(1, self.client.get_user_delegation_key.call_count)
+
+    def test_tokens_expire_with_their_key(self):
+        sas = blob_sas.get_container_sas('card-thumbnails')
+
+        self.assertIn(f'se={self.key_expiry.strftime("%Y-%m-%dT%H%%3A%M%%3A%SZ")}', sas)
@@ -0,0 +1,153 @@
+import datetime
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from genius_collection.core.blob_sas import container_sas_tokens
+from genius_collection.core.models import User, Ownership
+from genius_collection.core.otp import OTP_WINDOW, generate_otp, verify_otp
+from genius_collection.core.testing import create_card
+
+
+def give_card(user, card, quantity):
+    Ownership.objects.create(user=user, card=card, quantity=quantity)
+    return Ownership.objects.get(user=user, card=card)
+
+
+class TransferTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.card = create_card(0)
+        cls.giver = User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch')
+        cls.receiver = User.objects.create(first_name='Bert', last_name='B', email='bert@ipt.ch')
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(user={'email': 'bert@ipt.ch'})
+
+    def transfer(self, otp=None):
+        if otp is None:
+            otp, _ = generate_otp(Ownership.objects.get(user=self.giver, card=self.card))
+        return self.client.post('/cards/transfer/', {'giver': 'anna@ipt.ch', 'id': self.card.id, 'otp': otp},
+                                format='json')
+
+    def test_transfer_moves_one_card(self):
+        give_card(self.giver, self.card, 2)
+
+        response = self.transfer()
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, Ownership.objects.get(user=self.giver).quantity)
+        self.assertEqual(1, Ownership.objects.get(user=self.receiver).quantity)
+
+    def test_transfer_updates_both_users_at_once(self):
+        give_card(self.giver, self.card, 2)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.transfer()
+
+        self.assertEqual(1, len([q for q in queries.captured_queries if q['sql'].startswith('UPDATE "core_user"')]))
+        self.assertEqual([1, 1], list(User.objects.order_by('id').values_list('collection_version', flat=True)))
+        self.receiver.refresh_from_db()
+        self.assertIsNotNone(self.receiver.last_received_unique)
+        self.assertIsNone(User.objects.get(pk=self.giver.pk).last_received_unique)
+
+    def test_otp_can_be_used_only_once(self):
+        otp, _ = generate_otp(give_card(self.giver, self.card, 3))
+
+        self.transfer(otp)
+        response = self.transfer(otp)
+
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(2, Ownership.objects.get(user=self.giver).quantity)
+
+    def test_last_card_is_removed_from_giver(self):
+        give_card(self.giver, self.card, 1)
+
+        self.transfer()
+
+        self.assertFalse(Ownership.objects.filter(user=self.giver).exists())
+        self.assertEqual(1, Ownership.objects.get(user=self.receiver).quantity)
+
+    def test_expired_otp_is_rejected(self):
+        ownership = give_card(self.giver, self.card, 1)
+        otp, valid_to = generate_otp(ownership, now=timezone.now() - datetime.timedelta(minutes=10))
+
+        response = self.transfer(otp)
+
+        self.assertLess(valid_to, timezone.now())
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(Ownership.objects.filter(user=self.receiver).exists())
+
+    def test_otp_of_previous_window_is_accepted(self):
+        ownership = give_card(self.giver, self.card, 1)
+        now = timezone.now()
+        otp, valid_to = generate_otp(ownership, now=now - OTP_WINDOW)
+
+        self.assertTrue(verify_otp(ownership, otp, now=now))
+        self.assertGreater(valid_to, now)
+
+    def test_card_detail_does_not_write(self):
+        ownership = give_card(self.giver, self.card, 1)
+        self.client.force_authenticate(user={'email': 'anna@ipt.ch'})
+        container_sas_tokens.set('card-detail-views', 'sig=test', time.time() + 24 * 60 * 60)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/cards/{self.card.id}/')
+
+        self.assertTrue(all(q['sql'].startswith('SELECT') for q in queries.captured_queries))
+        self.assertTrue(verify_otp(ownership, response.data['otp_value']))
+
+
+class ConcurrentTransferTest(TransactionTestCase):
+    """
+    Many receivers scan the same QR code at the same time. Only one of them may get the card.
+    """
+    receivers_count = 8
+
+    def setUp(self):
+        caches['shared'].clear()
+        self.card = create_card(0)
+        self.giver = User.objects.create(first_name='Anna', last_name='A', email='anna@ipt.ch')
+        self.receivers = [User.objects.create(first_name='R', last_name=str(i), email=f'r{i}@ipt.ch')
+                          for i in range(self.receivers_count)]
+        self.ownership = give_card(self.giver, self.card, 5)
+        self.otp, _ = generate_otp(self.ownership)
+
+    def transfer(self, receiver, results, barrier):
+        barrier.wait()
+        try:
+            while True:
+                try:
+                    ownership = Ownership.objects.get(pk=self.ownership.pk)
+                    results.append(Ownership.objects.transfer_ownership(receiver, ownership, self.otp))
+                    return
+                except OperationalError:
+                    # SQLite locks the whole database, the other transaction has to finish first
+                    time.sleep(0.01)
+        finally:
+            connection.close()
+
+    def test_concurrent_transfers_with_the_same_otp(self):
+        results = []
+        barrier = threading.Barrier(self.receivers_count)
+        threads = [threading.Thread(target=self.transfer, args=(r, results, barrier)) for r in self.receivers]
+
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(self.receivers_count, len(results))
+        self.assertEqual(1, len([r for r in results if r is not None]))
+        self.assertEqual(4, Ownership.objects.get(user=self.giver).quantity)
+        self.assertEqual(1, Ownership.objects.exclude(user=self.giver).count())
+        self.assertEqual(5, Ownership.objects.aggregate(total=Sum('quantity'))['total'])
@@ -0,0 +1,124 @@
+import logging
+import os
+import threading
+import time
+
+from django.core.cache import caches
+
+from .ttl_cache import TTLCache
+
+SHARED_CACHE = 'shared'
+# How long a process waits for another one creating the same entry, before creating it itself
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+class TieredCache:
+    """
+    In-process LRU cache (L1) in front of the cache shared by all worker processes (L2), the 'shared' entry of
+    settings.CACHES. Entries created by one process are found by the others, also after a restart or scale-out.
+    The entries expire at a given point in time in both tiers. Deleted entries may live on in the L1 of other
+    processes until then, or until the L1 TTL is over. With maxsize 0, only the shared tier is used.
+    If the shared cache is unavailable, the entries are only cached in the process.
+    """
+
+    def __init__(self, prefix, maxsize=1024, l1_ttl=None, alias=SHARED_CACHE, lock_timeout=LOCK_TIMEOUT):
+        self.prefix = prefix
+        self.alias = alias
+        self.lock_timeout = lock_timeout
+        self.local = TTLCache(maxsize=maxsize, ttl=l1_ttl)
+        self._create_locks = {}
+        self._create_locks_lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def _call_shared(self, method, *args, default=None):
+        try:
+            return getattr(self.shared, method)(*args)
+        except Exception as e:
+            # E.g. Redis is down, which should only cost the requests to Azure it saves
+            logger.warning("%s on the shared cache failed: %r", method, e)
+            return default
+
+    def shared_key(self, key) -> str:
+        return f'{self.prefix}:{key}'
+
+    def get(self, key, default=None):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        entry = self._call_shared('get', self.shared_key(key))
+        if entry is None:
+            return default
+        value, expires_at = entry
+        self.local.set(key, value, expires_at)
+        return value
+
+    def set(self, key, value, expires_at=None):
+        """
+        Store the value in both tiers until [expires_at] (seconds since the epoch), or forever.
+        """
+        self.local.set(key, value, expires_at)
+        timeout = None if expires_at is None else expires_at - time.time()
+        if timeout is None or timeout > 0:
+            self._call_shared('set', self.shared_key(key), (value, expires_at), timeout)
+
+    def delete(self, key):
+        self.local.delete(key)
+        self._call_shared('delete', self.shared_key(key))
+
+    def get_or_set(self, key, create, expires_at=None):
+        """
+        Return the cached value, or create and store it. Only one thread per process creates a missing entry, and
+        only one process if the shared cache adds keys atomically (e.g. Redis). The others wait for its result.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._create_lock(key):
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            lock_key = self.shared_key(f'{key}:lock')
+            # Without the shared cache, every process creates its own entry
+            is_locked = self._call_shared('add', lock_key, os.getpid(), self.lock_timeout, default=True)
+            if not is_locked:
+                value = self._wait_for(key)
+                if value is not None:
+                    return value
+                # The other process failed or took too long
+            try:
+                value = create()
+                self.set(key, value, expires_at)
+                return value
+            finally:
+                if is_locked:
+                    self._call_shared('delete', lock_key)
+
+    def _create_lock(self, key) -> threading.Lock:
+        with self._create_locks_lock:
+            return self._create_locks.setdefault(key, threading.Lock())
+
+    def _wait_for(self, key):
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = self.get(key)
+            if value is not None:
+                return value
+        return None
+
+    def clear(self):
+        """
+        Forget the entries of this process. The shared cache keeps them.
+        """
+        self.local.clear()
+
+    def stats(self) -> dict:
+        return self.local.stats()
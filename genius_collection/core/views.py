@@ -1,20 +1,40 @@
+import hmac
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.views import View
 from rest_framework import status, viewsets, mixins
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.views import APIView
-from genius_collection.core.serializers import UserSerializer, CardSerializer
-from django.db.models import Sum, Q, Count
-from django.db import connection, IntegrityError
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
-from .models import Card, Quiz, User, Ownership, Distribution
-from .jwt_validation import JWTAccessTokenAuthentication
-from genius_collection.core.blob_sas import get_blob_sas_url
-from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobServiceClient
+from genius_collection.core.serializers import UserSerializer, CardSerializer, JobSerializer
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.core.exceptions import ValidationError
+from .models import Card, Quiz, User, Ownership, Distribution, Job
+from .jwt_validation import JWTAccessTokenAuthentication, get_current_user, get_current_user_id
+from .catalogue import get_catalogue_snapshot, get_catalogue_version
+from .images import ORIGINAL_IMAGE_CACHE_CONTROL, get_image_version
+from .instrumentation import get_endpoint_stats, query_budget
+from .jobs import enqueue_job
+from .metrics import METRICS_CONTENT_TYPE, get_metrics, observe_operation
+from .storage import get_blob_storage
+from .sync import InvalidSyncCursor, decode_cursor, get_collection_changes
+from .quiz_pool import get_quiz_candidate_index, invalidate_quiz_candidate_index
+from .leaderboard import (
+    InvalidCursor,
+    get_leaderboard,
+    get_leaderboard_around,
+    get_leaderboard_page,
+    invalidate_leaderboard
+)
+from genius_collection.core.blob_sas import blob_sas_url_builder, get_blob_sas_url
+from .conditional import get_not_modified_response, make_etag, set_etag
 import random
-from azure.core.exceptions import ResourceNotFoundError
-import copy
 
 
 class UserViewSet(mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
@@ -27,31 +47,39 @@ class UserViewSet(mixins.RetrieveModelMixin, mixins.ListModelMixin, viewsets.Gen
 
     @action(detail=False, methods=['post'], url_path='init',
             description='Checks if an user exists. If not, the user is initialized')
+    @query_budget(16)
     def init(self, request):
         try:
-            current_user = User.objects.get(email=request.user['email'])
-            last_login = current_user.last_login
-            current_user.last_login = timezone.now()
-            current_user.save()
-
-            user_card = Card.objects.filter(email=current_user.email)
-
-            return Response(
-                data={'status': f'User in Datenbank gefunden.',
-                      'user': self.get_serializer(current_user).data,
-                      "card_id": user_card.get().pk if user_card.exists() else None,
-                      'last_login': last_login})
+            current_user = get_current_user(request)
         except User.DoesNotExist:
-            user, self_card_assigned = User.objects.create_user(first_name=request.user['first_name'],
-                                                                last_name=request.user['last_name'],
-                                                                email=request.user['email'])
+            try:
+                with transaction.atomic():
+                    user, self_card_assigned = User.objects.create_user(first_name=request.user['first_name'],
+                                                                        last_name=request.user['last_name'],
+                                                                        email=request.user['email'])
+
+                return Response(status=status.HTTP_201_CREATED,
+                                data={'status': 'User erfolgreich erstellt.',
+                                      'user': self.get_serializer(user).data,
+                                      'last_login': None,
+                                      "card_id": None,
+                                      'self_card_assigned': self_card_assigned})
+            except IntegrityError:
+                # A concurrent first login of the same user created it in the meantime
+                current_user = get_current_user(request)
+
+        last_login = current_user.last_login
+        current_user.last_login = timezone.now()
+        # Only the login time, so concurrent changes of the scores or collection version are kept
+        current_user.save(update_fields=['last_login'])
+
+        user_card = Card.objects.filter(email=current_user.email)
 
-            return Response(status=status.HTTP_201_CREATED,
-                            data={'status': 'User erfolgreich erstellt.',
-                                  'user': self.get_serializer(user).data,
-                                  'last_login': None,
-                                  "card_id": None,
-                                  'self_card_assigned': self_card_assigned})
+        return Response(
+            data={'status': f'User in Datenbank gefunden.',
+                  'user': self.get_serializer(current_user).data,
+                  "card_id": user_card.get().pk if user_card.exists() else None,
+                  'last_login': last_login})
 
 
 class CardViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
@@ -63,71 +91,89 @@ class CardViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
     queryset = Card.objects.all()
     serializer_class = CardSerializer
 
-    @staticmethod
-    def dict_fetchall(cursor):
-        """Return all rows from a cursor as a dict"""
-        columns = [col[0] for col in cursor.description]
-        return [
-            dict(zip(columns, row))
-            for row in cursor.fetchall()
-        ]
-
+    @query_budget(4)
     def list(self, request, *args, **kwargs):
-        # Override the list method to circumvent the serializer calling the DB many times
-        # https://www.cdrf.co/3.9/rest_framework.viewsets/ReadOnlyModelViewSet.html#list
-        cursor = connection.cursor()
-
-        query = """
-            with co as (
-            select
-                *
-            from
-                core_ownership co
-            join core_user cu on
-                co.user_id = cu.id
-            where
-                cu.email = %s)
-            select
-                coalesce(co.quantity, 0) as quantity,
-                co.last_received,
-                cc.*
-            from
-                core_card cc
-            left join co on
-                cc.id = co.card_id
-        """
-        cursor.execute(query, [request.user['email']])
-        card_dicts = self.dict_fetchall(cursor)
-        cards = [dict(c, **{'image_url': get_blob_sas_url('card-thumbnails', c['email'])}) for c in card_dicts]
-        return Response(cards)
+        # The collection only changes with the user's collection version and with the cards, including the SAS
+        # token of their image URLs
+        current_user = get_current_user(request)
+        catalogue_version = get_catalogue_version()
+        etag = make_etag(current_user.id, current_user.collection_version, catalogue_version)
+        not_modified = get_not_modified_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        # The cards are encoded once for all users, only the quantities are added per user
+        snapshot = get_catalogue_snapshot(catalogue_version)
+        ownerships = {card_id: (quantity, last_received) for card_id, quantity, last_received in
+                      Ownership.objects.filter(user=current_user).values_list('card_id', 'quantity', 'last_received')}
+        return set_etag(HttpResponse(snapshot.render_collection(ownerships), content_type='application/json'), etag)
+
+    @action(detail=False, methods=['get'], url_path='catalogue',
+            description='Returns all cards without quantities. Changes with every card and the SAS token.')
+    @query_budget(2)
+    def catalogue(self, request):
+        snapshot = get_catalogue_snapshot()
+        encoding = 'gzip' if 'gzip' in request.headers.get('Accept-Encoding', '') else 'identity'
+        # The compressed and the plain body differ in their bytes, so they need different strong ETags
+        etag = make_etag(snapshot.version, encoding)
+        response = get_not_modified_response(request, etag)
+        if response is None:
+            # Compressed once with the snapshot
+            if encoding == 'gzip':
+                response = HttpResponse(snapshot.gzip, content_type='application/json')
+                response['Content-Encoding'] = 'gzip'
+            else:
+                response = HttpResponse(snapshot.json, content_type='application/json')
+            set_etag(response, etag)
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+
+    @action(detail=False, methods=['get'], url_path='changes',
+            description='Returns the cards of the current user that changed since the given cursor.')
+    @query_budget(4)
+    def changes(self, request):
+        since = request.query_params.get('since')
+        try:
+            since = decode_cursor(since) if since else None
+        except InvalidSyncCursor:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'status': 'Ungültiger Cursor.'})
+
+        changes = get_collection_changes(get_current_user(request), since)
+        blob_sas_url = blob_sas_url_builder('card-thumbnails')
+        for card in changes['cards']:
+            card['image_url'] = blob_sas_url(card['email'], card['image_version'])
+        return Response(changes)
 
     @action(detail=False, methods=['post'], url_path='transfer',
             description='Removes a card from the giver and adds it to the current user.')
+    @observe_operation('transfer')
+    @query_budget(16)
     def transfer(self, request):
-        giver = User.objects.get(email=request.data['giver'])
-        card = Card.objects.get(id=request.data['id'])
-        current_user = User.objects.get(email=request.user['email'])
-
-        try:
-            ownership = Ownership.objects.get(user=giver, card=card)
-        except Ownership.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND,
-                            data={'status': f'Der Sender besitzt diese Karte nicht.'})
-
-        if ownership.otp_value != request.data['otp']:
-            return Response(status=status.HTTP_400_BAD_REQUEST,
-                            data={'status': f'Das OTP stimmt nicht mit dem in der Datenbank überein.'})
-
-        if ownership.otp_valid_to < timezone.now():
-            return Response(status=status.HTTP_400_BAD_REQUEST,
-                            data={
-                                'status': f'Das OTP ist nicht mehr gültig. Bitte den Sender, die Karte neu zu laden.'})
-
-        if ownership.user == current_user:
-            return Response(status=status.HTTP_400_BAD_REQUEST,
-                            data={'status': f'Du kannst nicht mit dir selbst tauschen.'})
-
-        giver_ownership, receiver_ownership = Ownership.objects.transfer_ownership(current_user, ownership, card)
+        current_user = get_current_user(request)
+
+        with transaction.atomic():
+            # Lock the ownership of the giver, so that concurrent transfers with the same OTP are serialized. The one
+            # of the receiver is locked with it in the order of their ids, so that transfers of the same card in both
+            # directions cannot deadlock. Only the ownerships are locked, not their users and cards.
+            ownerships = Ownership.objects.select_for_update(of=('self',)).select_related('user', 'card').filter(
+                user__email__in=[request.data['giver'], current_user.email], card_id=request.data['id'])
+            ownership = next((o for o in ownerships.order_by('id') if o.user.email == request.data['giver']), None)
+            if ownership is None:
+                return Response(status=status.HTTP_404_NOT_FOUND,
+                                data={'status': f'Der Sender besitzt diese Karte nicht.'})
+
+            if ownership.user_id == current_user.id:
+                return Response(status=status.HTTP_400_BAD_REQUEST,
+                                data={'status': f'Du kannst nicht mit dir selbst tauschen.'})
+
+            # Verifies the OTP against the locked state of the ownership, which changes with the transfer
+            transferred = Ownership.objects.transfer_ownership(current_user, ownership, request.data['otp'])
+            if transferred is None:
+                return Response(status=status.HTTP_400_BAD_REQUEST,
+                                data={
+                                    'status': f'Das OTP ist nicht mehr gültig. Bitte den Sender, die Karte neu zu laden.'})
+
+        giver_ownership, receiver_ownership = transferred
         if giver_ownership is None:
             return Response({'status': f'Karte erfolgreich transferiert. {receiver_ownership}.'})
         else:
@@ -135,6 +181,7 @@ class CardViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
 
     @action(detail=False, methods=['post'], url_path='modify',
             description='Modifies the card from the current user.')
+    @query_budget(8)
     def modify(self, request):
         # Retrieve the user_card object from the database
 
@@ -169,10 +216,12 @@ class CardViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
         except IntegrityError as e:
             return Response(status=status.HTTP_400_BAD_REQUEST,
                             data={'status': 'Could not save the card.', 'error': str(e)})
+        invalidate_quiz_candidate_index()
 
         if is_initial_card_creation:
+            invalidate_leaderboard()
             # give the user x times his own card
-            current_user = User.objects.get(email=request.user['email'])
+            current_user = get_current_user(request)
             Ownership.objects.distribute_self_cards_to_user(current_user, 20)
 
         return Response(CardSerializer(user_card, context={'request': request}).data)
@@ -185,41 +234,69 @@ class OverviewViewSet(APIView):
     authentication_classes = [JWTAccessTokenAuthentication]
 
     @action(methods=['get'], detail=False, description='Returns the score and ranking overview for the current user.')
+    @query_budget(5)
     def get(self, request):
-        user_cards = User.objects.get(email=request.user['email']).cards.all()
-        total_quantity = Ownership.objects.aggregate(total_quantity=Sum('quantity'))['total_quantity']
-
-        scores = [{
-            'uniqueCardsCount': u.cards.count(),
-            'displayName': str(u),
-            'userEmail': u.email,
-            'last_received_unique': u.last_received_unique,
-            'quizScore': u.quiz_score
-        } for u in User.objects.all()]
-        ranking_cards = copy.deepcopy(sorted(scores, key=lambda r: (
-            -r['uniqueCardsCount'], r['last_received_unique'] is None, r['last_received_unique'], r['userEmail'])))
-        ranking_quiz = copy.deepcopy(sorted(scores, key=lambda r: (-r['quizScore'], r['userEmail'])))
-
-        for i in range(len(ranking_cards)):
-            ranking_cards[i]['rank'] = i + 1
-        for i in range(len(ranking_quiz)):
-            ranking_quiz[i]['rank'] = i + 1
+        leaderboard = get_leaderboard()
+        etag = make_etag(leaderboard['version'], request.user['email'])
+        not_modified = get_not_modified_response(request, etag)
+        if not_modified is not None:
+            return not_modified
+
+        # 'cards' is the relation through Ownership, so the former total and distinct counts were both the number
+        # of unique cards of the current user.
+        my_unique_cards_count = leaderboard['uniqueCardsCounts'].get(request.user['email'], 0)
+
+        return set_etag(Response({
+            'myCardsCount': my_unique_cards_count,
+            'totalCardQuantity': leaderboard['totalCardQuantity'],
+            'myUniqueCardsCount': my_unique_cards_count,
+            'allCardsCount': leaderboard['allCardsCount'],
+            'duplicateCardsCount': 0,
+            'rankingCards': leaderboard['rankingCards'],
+            'rankingQuiz': leaderboard['rankingQuiz'],
+            'lastDistribution': leaderboard['lastDistribution']
+        }), etag)
+
+
+class LeaderboardViewSet(viewsets.GenericViewSet):
+    """
+    API endpoints that page through the card and quiz rankings.
+    """
+    authentication_classes = [JWTAccessTokenAuthentication]
+    max_limit = 100
+    max_radius = 50
 
+    @staticmethod
+    def get_int_param(request, name, default, maximum):
         try:
-            last_dist = Distribution.objects.latest('timestamp').timestamp
-        except ObjectDoesNotExist:
-            last_dist = None
-
-        return Response({
-            'myCardsCount': user_cards.count(),
-            'totalCardQuantity': total_quantity,
-            'myUniqueCardsCount': user_cards.distinct().count(),
-            'allCardsCount': Card.objects.all().count(),
-            'duplicateCardsCount': user_cards.count() - user_cards.distinct().count(),
-            'rankingCards': ranking_cards,
-            'rankingQuiz': ranking_quiz,
-            'lastDistribution': last_dist
-        })
+            value = int(request.query_params.get(name, default))
+        except ValueError:
+            raise ValidationError(f'{name} muss eine Zahl sein.')
+        if value < 1:
+            raise ValidationError(f'{name} muss grösser als 0 sein.')
+        return min(value, maximum)
+
+    @action(detail=False, methods=['get'], url_path=r'(?P<board>cards|quiz)',
+            description='Returns a page of the ranking. Pass the returned "next" cursor to get the following page.')
+    @query_budget(5)
+    def page(self, request, board):
+        try:
+            limit = self.get_int_param(request, 'limit', 20, self.max_limit)
+            return Response(get_leaderboard_page(board, request.query_params.get('cursor'), limit))
+        except ValidationError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'status': e.message})
+        except InvalidCursor:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'status': 'Ungültiger Cursor.'})
+
+    @action(detail=False, methods=['get'], url_path=r'(?P<board>cards|quiz)/around-me',
+            description='Returns the ranking rows around the current user.')
+    @query_budget(5)
+    def around_me(self, request, board):
+        try:
+            radius = self.get_int_param(request, 'radius', 5, self.max_radius)
+        except ValidationError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'status': e.message})
+        return Response(get_leaderboard_around(board, request.user['email'], radius))
 
 
 class DistributeViewSet(APIView):
@@ -229,68 +306,104 @@ class DistributeViewSet(APIView):
     authentication_classes = [JWTAccessTokenAuthentication]
 
     @action(methods=['post'], detail=False, description='Distributes cards to a list of users or to all users.')
+    @observe_operation('distribute')
+    @query_budget(10)
     def post(self, request):
-        current_user = User.objects.get(email=request.user['email'])
+        current_user = get_current_user(request)
         if not current_user.is_admin:
             return Response(status=status.HTTP_403_FORBIDDEN,
                             data={'status': f'Du bist kein Admin.'})
         qty = int(request.data['quantity'])
         receivers = request.data['receivers']
-        distribution = Distribution(quantity=qty, user=current_user, receiver=receivers)
-        distribution.save()
-
-        receiver_users = []
         if receivers == 'all':
-            receiver_users = User.objects.all()
+            receiver_users = list(User.objects.only('id'))
         else:
-            for r in receivers:
-                receiver_users.append(User.objects.get(email=r))
-        for receiver_user in receiver_users:
-            Ownership.objects.distribute_random_cards(receiver_user, qty)
-
-        return Response(
-            {'status': f'{len(receiver_users)} * {qty} = {len(receiver_users) * qty} Karten erfolgreich verteilt.'})
-
-
-class PictureViewSet(APIView):
+            users_by_email = User.objects.only('id', 'email').in_bulk(receivers, field_name='email')
+            unknown_receivers = set(receivers) - users_by_email.keys()
+            if unknown_receivers:
+                return Response(status=status.HTTP_404_NOT_FOUND,
+                                data={'status': f'Unbekannte Empfänger: {", ".join(sorted(unknown_receivers))}'})
+            # Receivers listed several times get cards for every time
+            receiver_users = [users_by_email[r] for r in receivers]
+        with transaction.atomic():
+            job, created = enqueue_job('distribute', {'quantity': qty, 'user_ids': [u.id for u in receiver_users]},
+                                       idempotency_key=request.headers.get('Idempotency-Key'), created_by=current_user)
+            if created:
+                distribution = Distribution(quantity=qty, user=current_user, receiver=receivers)
+                distribution.save()
+
+        return Response(status=status.HTTP_202_ACCEPTED, data={
+            'status': f'{len(receiver_users)} * {qty} = {len(receiver_users) * qty} Karten werden verteilt.',
+            'job_id': job.id})
+
+
+class PictureView(View):
     """
     API endpoint that uploads a picture for the current user.
+    Async, so that waiting for the blob storage does not occupy a worker when served with ASGI (see asgi.py).
     """
-    authentication_classes = [JWTAccessTokenAuthentication]
 
-    @action(methods=['get'], detail=False, description='Gets the URL to the picture in original quality.')
-    def get(self, request):
-        email = request.user['email']
-        image_url = get_blob_sas_url('card-originals', email)
-        return Response(image_url)
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Authenticated by token like the DRF views, which are exempt from CSRF as well
+        view.csrf_exempt = True
+        return view
+
+    @staticmethod
+    async def authenticate(request):
+        """
+        Returns the current user, or the error response if the request is not authenticated.
+        """
+        try:
+            current_user, _ = await JWTAccessTokenAuthentication().aauthenticate(request)
+            return current_user, None
+        except AuthenticationFailed as e:
+            return None, JsonResponse({'detail': e.detail}, status=status.HTTP_403_FORBIDDEN)
+
+    @query_budget(2)
+    async def get(self, request):
+        """
+        Gets the URL to the picture in original quality.
+        """
+        current_user, error_response = await self.authenticate(request)
+        if error_response is not None:
+            return error_response
+
+        email = current_user['email']
+        image_version = await Card.objects.filter(email=email).values_list('image_version', flat=True).afirst()
+        image_url = await sync_to_async(get_blob_sas_url)('card-originals', email, image_version)
+        return JsonResponse(image_url, safe=False)
+
+    @observe_operation('picture_upload')
+    @query_budget(3)
+    async def post(self, request):
+        """
+        Uploads a picture for the current user to the Azure Blob Container.
+        """
+        current_user, error_response = await self.authenticate(request)
+        if error_response is not None:
+            return error_response
 
-    @action(methods=['post'], detail=False,
-            description='Uploads a picture for the current user to the Azure Blob Container.')
-    def post(self, request):
         file = request.FILES['file']
         if file.content_type != 'image/jpeg':
-            return Response({'status': 'Bild muss vom Typ JPEG sein'}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse({'status': 'Bild muss vom Typ JPEG sein'}, status=status.HTTP_400_BAD_REQUEST)
 
         if file.size > 10 * 1024 * 1024:  # 10MB in bytes
-            return Response({'status': 'Bild darf maximal 10MB gross sein.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Authenticate with managed identity
-        credential = DefaultAzureCredential()
+            return JsonResponse({'status': 'Bild darf maximal 10MB gross sein.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Connect to Azure Blob Storage
-        blob_service_client = BlobServiceClient(account_url="https://gcollection.blob.core.windows.net",
-                                                credential=credential)
-        container_client = blob_service_client.get_container_client("card-originals")
+        data = file.read()
+        image_version = get_image_version(data)
 
-        # Upload file to Azure Blob Storage
-        email = request.user['email']
-        blob_client = container_client.get_blob_client(f'{email}.jpg')
-        blob_client.upload_blob(file, overwrite=True)
+        email = current_user['email']
+        await get_blob_storage().aupload('card-originals', f'{email}.jpg', data, content_type='image/jpeg',
+                                         cache_control=ORIGINAL_IMAGE_CACHE_CONTROL)
+        # The thumbnail and detail view are rendered by the worker, which also sets the new image version
+        await sync_to_async(enqueue_job)('render_picture', {'email': email})
 
         # URL of the uploaded image
-        image_url = get_blob_sas_url('card-originals', email)
-
-        return Response(image_url)
+        image_url = await sync_to_async(get_blob_sas_url)('card-originals', email, image_version)
+        return JsonResponse(image_url, safe=False)
 
 
 class QuizQuestionViewSet(viewsets.GenericViewSet):
@@ -299,13 +412,91 @@ class QuizQuestionViewSet(viewsets.GenericViewSet):
     """
     authentication_classes = [JWTAccessTokenAuthentication]
 
+    max_round_questions = 50
+
     @action(detail=False, methods=['post'], url_path='answer',
             description='Checks if the answer is correct.')
+    @observe_operation('quiz_answer')
+    @query_budget(8)
     def answer(self, request, pk=None):
-        current_user = User.objects.get(email=request.user['email'])
-        question = Quiz.objects.get(id=request.data['question_id'])
+        current_user = get_current_user(request)
+        question = Quiz.objects.select_related('question_true_card').get(id=request.data['question_id'])
         given_answer = request.data['answer']
+        answer_is_correct, correct_answer = self.evaluate_answer(question, given_answer)
+
+        # Only the first answer counts, even if the same question is answered concurrently
+        with transaction.atomic():
+            answered = Quiz.objects.filter(id=question.id, answer_correct__isnull=True).update(
+                answer_correct=answer_is_correct, answer_timestamp=timezone.now())
+            if not answered:
+                return Response(status=status.HTTP_400_BAD_REQUEST, data={
+                    'status': 'Du hast diese Frage bereits beantwortet.'
+                })
+            score_change, new_score = self.update_player_score(answer_is_correct, current_user,
+                                                               question.question_type, question.answer_type,
+                                                               question.answer_options)
+
+        return Response(status=status.HTTP_200_OK, data={
+            'is_correct': answer_is_correct,
+            'given_answer': given_answer,
+            'correct_answer': correct_answer,
+            'score_change': score_change,
+            'new_score': new_score
+        })
+
+    @action(detail=False, methods=['post'], url_path='round/answer',
+            description='Checks the answers to several questions and updates the score once.')
+    @observe_operation('quiz_round_answer')
+    @query_budget(9)
+    def round_answer(self, request, pk=None):
+        current_user = get_current_user(request)
+        given_answers = {int(a['question_id']): a['answer'] for a in request.data['answers']}
+
+        results = []
+        total_score_change = 0
+        with transaction.atomic():
+            questions = Quiz.objects.select_for_update().select_related('question_true_card').filter(
+                id__in=given_answers.keys(), user=current_user, answer_correct__isnull=True)
+            questions = {q.id: q for q in questions}
+            correct_ids = []
+            wrong_ids = []
+            for question_id, given_answer in given_answers.items():
+                question = questions.get(question_id)
+                if question is None:
+                    results.append({'question_id': question_id,
+                                    'status': 'Du hast diese Frage bereits beantwortet.'})
+                    continue
+                answer_is_correct, correct_answer = self.evaluate_answer(question, given_answer)
+                score_change = self.get_score_change(answer_is_correct, question.question_type,
+                                                     question.answer_type, question.answer_options)
+                (correct_ids if answer_is_correct else wrong_ids).append(question_id)
+                total_score_change += score_change
+                results.append({
+                    'question_id': question_id,
+                    'is_correct': answer_is_correct,
+                    'given_answer': given_answer,
+                    'correct_answer': correct_answer,
+                    'score_change': score_change
+                })
+
+            now = timezone.now()
+            if correct_ids:
+                Quiz.objects.filter(id__in=correct_ids).update(answer_correct=True, answer_timestamp=now)
+            if wrong_ids:
+                Quiz.objects.filter(id__in=wrong_ids).update(answer_correct=False, answer_timestamp=now)
+            new_score = self.add_to_player_score(current_user, total_score_change)
 
+        return Response(status=status.HTTP_200_OK, data={
+            'answers': results,
+            'score_change': total_score_change,
+            'new_score': new_score
+        })
+
+    @staticmethod
+    def evaluate_answer(question, given_answer):
+        """
+        Compare the given answer with the true card of the question. Returns whether it is correct and the correct answer.
+        """
         # Card object has no attribute 'image', since the image URL is not saved in the DB.
         # As a workaround, the front-end sends the email instead to validate the answer.
         answer_type = 'email' if question.answer_type == 'image' else question.answer_type
@@ -314,44 +505,42 @@ class QuizQuestionViewSet(viewsets.GenericViewSet):
         if question.answer_type == 'start_at_ipt':
             correct_answer = correct_answer.strftime("%d.%m.%Y")
 
-        answer_is_correct = (given_answer == correct_answer)
-
-        if question.answer_correct is not None:
-            return Response(status=status.HTTP_400_BAD_REQUEST, data={
-                'status': 'Du hast diese Frage bereits beantwortet.'
-            })
-
-        question.answer_correct = answer_is_correct
-        question.answer_timestamp = timezone.now()
-        question.save()
-
-        score_change, new_score = self.update_player_score(answer_is_correct, current_user, question.question_type,
-                                                           question.answer_type, question.answer_options)
-
-        return Response(status=status.HTTP_200_OK, data={
-            'is_correct': answer_is_correct,
-            'given_answer': given_answer,
-            'correct_answer': correct_answer,
-            'score_change': score_change,
-            'new_score': new_score
-        })
+        return given_answer == correct_answer, correct_answer
 
     @staticmethod
-    def update_player_score(answer_is_correct, user, question_type, answer_type, answer_options):
+    def get_score_change(answer_is_correct, question_type, answer_type, answer_options):
         """
-        Depending on the question/answer tuple and the number of points award points to the user.
+        Depending on the question/answer tuple and the number of points return the points awarded to the user.
         """
         question_type = str.upper(question_type)
         answer_type = str.upper(answer_type)
         question_value = QuizQuestionViewSet.get_question_mapping(question_type, answer_type)
         if answer_is_correct:
-            score_change = question_value
-        else:
-            # The expected value for "guessing" should be 0, so there is a penalty for wrong answers
-            score_change = -round(question_value / (answer_options - 1))
-        user.quiz_score += score_change
-        user.save()
-        return score_change, user.quiz_score
+            return question_value
+        # The expected value for "guessing" should be 0, so there is a penalty for wrong answers
+        return -round(question_value / (answer_options - 1))
+
+    @staticmethod
+    def update_player_score(answer_is_correct, user, question_type, answer_type, answer_options):
+        """
+        Depending on the question/answer tuple and the number of points award points to the user.
+        """
+        score_change = QuizQuestionViewSet.get_score_change(answer_is_correct, question_type, answer_type,
+                                                            answer_options)
+        return score_change, QuizQuestionViewSet.add_to_player_score(user, score_change)
+
+    @staticmethod
+    def add_to_player_score(user, score_change):
+        """
+        Atomically add the points to the score of the user and return the new score.
+        The leaderboard is only rebuilt if the score changes.
+        """
+        if score_change == 0:
+            return user.quiz_score
+        User.objects.filter(pk=user.pk).update(quiz_score=F('quiz_score') + score_change)
+        user.refresh_from_db(fields=['quiz_score'])
+        invalidate_leaderboard()
+        return user.quiz_score
 
     @staticmethod
     def get_random_question_type(answer_type):
@@ -385,88 +574,108 @@ class QuizQuestionViewSet(viewsets.GenericViewSet):
 
     @action(detail=False, methods=['post'], url_path='question',
             description='Returns n random cards for the quiz with the defined question and answer type.')
+    @observe_operation('quiz_question')
+    @query_budget(4)
     def question(self, request, pk=None):
-        """
-        Get a set of possible cards that can answer the question. Then select one as the correct card.
-        """
         answer_options = int(request.data.get('answer_options', 4))
         question_type = request.data.get('question_type', 'image')
         answer_type = request.data.get('answer_type', 'name')
+
+        try:
+            quiz, question_answer_tuple = self.build_question(question_type, answer_type, answer_options,
+                                                              get_current_user_id(request), {})
+        except KeyError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data=str(e))
+        quiz.save()
+        question_answer_tuple['question_id'] = quiz.id
+        return Response(status=status.HTTP_201_CREATED, data=question_answer_tuple)
+
+    @action(detail=False, methods=['post'], url_path='round',
+            description='Returns a round of n questions for the quiz with the defined question and answer type.')
+    @observe_operation('quiz_round')
+    @query_budget(4)
+    def round(self, request, pk=None):
+        num_questions = min(int(request.data.get('questions', 10)), self.max_round_questions)
+        answer_options = int(request.data.get('answer_options', 4))
+        question_type = request.data.get('question_type', 'image')
+        answer_type = request.data.get('answer_type', 'name')
+
+        user_id = get_current_user_id(request)
+        # The SAS tokens are resolved once for the whole round
+        url_builders = {}
+        try:
+            questions = [self.build_question(question_type, answer_type, answer_options, user_id, url_builders)
+                         for _ in range(num_questions)]
+        except KeyError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data=str(e))
+
+        quizzes = Quiz.objects.bulk_create([quiz for quiz, _ in questions])
+        for quiz, (_, question_answer_tuple) in zip(quizzes, questions):
+            question_answer_tuple['question_id'] = quiz.id
+        return Response(status=status.HTTP_201_CREATED,
+                        data={'questions': [question_answer_tuple for _, question_answer_tuple in questions]})
+
+    def build_question(self, question_type, answer_type, answer_options, user_id, url_builders):
+        """
+        Get a set of possible cards that can answer the question. Then select one as the correct card.
+        Returns the unsaved Quiz and the question without its id.
+        """
         if question_type == 'random':
             question_type = self.get_random_question_type(answer_type)
         if answer_type == 'random':
             answer_type = self.get_random_answer_type(question_type)
 
-        possible_cards = self.get_possible_cards(question_type, answer_type)
+        def blob_sas_url(container_name, card):
+            if container_name not in url_builders:
+                url_builders[container_name] = blob_sas_url_builder(container_name)
+            return url_builders[container_name](card.email, card.image_version)
 
         # take n cards and choose one to be the correct answer
-        random.shuffle(possible_cards)
-        answer_possible_cards = possible_cards[:answer_options]
+        answer_possible_cards = self.get_possible_cards(question_type, answer_type, answer_options)
         correct_card = random.choice(answer_possible_cards)
 
         if question_type == 'image':
-            question_value = get_blob_sas_url('card-detail-views', correct_card.email)
+            question_value = blob_sas_url('card-detail-views', correct_card)
         elif question_type == 'start_at_ipt':
             question_value = getattr(correct_card, question_type).strftime("%d.%m.%Y")
         else:
             question_value = getattr(correct_card, question_type)
         if answer_type == 'image':
-            answer_possible_values = [get_blob_sas_url('card-thumbnails', c.email) for c in answer_possible_cards]
+            answer_possible_values = [blob_sas_url('card-thumbnails', c) for c in answer_possible_cards]
         elif answer_type == 'start_at_ipt':
             answer_possible_values = [getattr(c, answer_type).strftime("%d.%m.%Y") for c in answer_possible_cards]
         else:
             answer_possible_values = [getattr(c, answer_type) for c in answer_possible_cards]
 
-        quiz = Quiz.objects.create(
-            user=User.objects.get(email=request.user['email']),
+        quiz = Quiz(
+            user_id=user_id,
             question_type=question_type,
             answer_type=answer_type,
             question_true_card=correct_card,
             answer_options=answer_options
         )
-
-        quiz.save()
-
-        try:
-            question_answer_tuple = {
-                'question_id': quiz.id,
-                'question_type': question_type,
-                'answer_type': answer_type,
-                'question_value': question_value,
-                'answer_possible_values': answer_possible_values,
-                'answer_options': answer_options,
-                'question_string': self.get_question_string(question_type, answer_type, question_value)
-            }
-            return Response(status=status.HTTP_201_CREATED, data=question_answer_tuple)
-        except KeyError as e:
-            return Response(status=status.HTTP_400_BAD_REQUEST, data=str(e))
+        question_answer_tuple = {
+            'question_id': None,
+            'question_type': question_type,
+            'answer_type': answer_type,
+            'question_value': question_value,
+            'answer_possible_values': answer_possible_values,
+            'answer_options': answer_options,
+            'question_string': self.get_question_string(question_type, answer_type, question_value)
+        }
+        return quiz, question_answer_tuple
 
     @staticmethod
-    def get_possible_cards(question_type, answer_type):
+    def get_possible_cards(question_type, answer_type, answer_options):
         """
-        Get a set of cards that can answer the question (no null values) and don't contain duplicate answers
+        Get up to [answer_options] cards that can answer the question (no null values) and don't contain duplicate
+        answers, e.g. twice "Senior Consultant".
         """
         if question_type == 'image':
             question_type = 'email'
         if answer_type == 'image':
             answer_type = 'email'
-        filter_query = Q(**{f"{question_type}__isnull": False, f"{answer_type}__isnull": False})
-
-        # Query cards where the question/answer is not null
-        # and group by answers, to prevent twice e.g. "Senior Consultant" as answer possibility.
-        grouped_cards = Card.objects.filter(filter_query).values(answer_type).annotate(count=Count('name'))
-
-        selected_cards = {}
-        for group in grouped_cards:
-            group_cards = Card.objects.filter(**{answer_type: group[answer_type]})
-
-            # If there's more than one card in the group, randomly select one
-            if group['count'] > 1:
-                random_card = random.choice(group_cards)
-                selected_cards[group[answer_type]] = random_card
-            else:
-                selected_cards[group[answer_type]] = group_cards.first()
-        return list(selected_cards.values())
+        return get_quiz_candidate_index().sample(question_type, answer_type, answer_options)
 
     @staticmethod
     def get_question_string(question_type, answer_type, input_value):
@@ -545,39 +754,60 @@ class DeleteUserAndCard(APIView):
     @action(methods=['delete'], detail=False,
             description='Deletes a user, its connected card and all ownerships related to the card or user')
     def delete(self, request):
-        current_user = User.objects.get(email=request.user['email'])
+        current_user = get_current_user(request)
         if not current_user.is_admin:
             return Response(status=status.HTTP_403_FORBIDDEN,
                             data={'status': f'Du bist kein Admin.'})
         user_to_delete_email = request.data['user_to_delete']
+        job, _ = enqueue_job('delete_user_and_card', {'email': user_to_delete_email},
+                             idempotency_key=request.headers.get('Idempotency-Key'), created_by=current_user)
 
-        try:
-            user_to_delete = User.objects.get(email=user_to_delete_email)
-            Ownership.objects.filter(user=user_to_delete).delete()
-            user_to_delete.delete()
-            user_answer = 'User Objekt wurde in der Datenbank gefunden und gelöscht.'
-        except ObjectDoesNotExist:
-            user_answer = 'User Objekt wurde nicht gelöscht, da es in der Datenbank nicht gefunden wurde.'
-        try:
-            card_to_delete = Card.objects.get(email=user_to_delete_email)
-            Ownership.objects.filter(card=card_to_delete).delete()
-            card_to_delete.delete()
-            card_answer = 'Card Objekt wurde in der Datenbank gefunden und gelöscht.'
-        except ObjectDoesNotExist:
-            card_answer = 'Card Objekt wurde nicht gelöscht, da es in der Datenbank nicht gefunden wurde.'
+        return Response(status=status.HTTP_202_ACCEPTED, data={
+            'status': f'User-Email: [{user_to_delete_email}]. User, Card und Card Image werden gelöscht.',
+            'job_id': job.id})
 
-        try:
-            # Authenticate with managed identity
-            credential = DefaultAzureCredential()
-            # Connect to Azure Blob Storage
-            blob_service_client = BlobServiceClient(account_url="https://gcollection.blob.core.windows.net",
-                                                    credential=credential)
-            container_client = blob_service_client.get_container_client("card-originals")
-            # Upload file to Azure Blob Storage
-            container_client.delete_blob(f'{user_to_delete_email}.jpg')
-            image_answer = 'Card Image wurde im Storage Container gefunden und gelöscht.'
-        except ResourceNotFoundError:
-            image_answer = 'Card Image wurde nicht gelöscht, da es im Storage Container nicht gefunden wurde.'
 
-        return Response(
-            {'status': f'User-Email: [{user_to_delete_email}]. {user_answer} {card_answer} {image_answer}'})
+class JobViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    API endpoint that allows admins to follow the progress of background jobs.
+    """
+    authentication_classes = [JWTAccessTokenAuthentication]
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+
+    @query_budget(3)
+    def retrieve(self, request, *args, **kwargs):
+        if not get_current_user(request).is_admin:
+            return Response(status=status.HTTP_403_FORBIDDEN,
+                            data={'status': f'Du bist kein Admin.'})
+        return super().retrieve(request, *args, **kwargs)
+
+
+class InstrumentationViewSet(APIView):
+    """
+    API endpoint that allows admins to see the latency, queries and cache hits per endpoint of this process.
+    """
+    authentication_classes = [JWTAccessTokenAuthentication]
+
+    @action(methods=['get'], detail=False, description='Returns the stats per endpoint since the process started.')
+    def get(self, request):
+        if not get_current_user(request).is_admin:
+            return Response(status=status.HTTP_403_FORBIDDEN,
+                            data={'status': f'Du bist kein Admin.'})
+        return Response(get_endpoint_stats())
+
+
+class MetricsView(View):
+    """
+    Prometheus metrics of all worker processes, see metrics.py.
+    Protected by the bearer token in the setting METRICS_TOKEN if it is set, as the scraper has no Azure AD token.
+    In production (METRICS_REQUIRE_TOKEN), the metrics are not found without it.
+    """
+
+    def get(self, request):
+        if not settings.METRICS_TOKEN and settings.METRICS_REQUIRE_TOKEN:
+            raise Http404
+        if settings.METRICS_TOKEN and not hmac.compare_digest(request.headers.get('Authorization', ''),
+                                                              f'Bearer {settings.METRICS_TOKEN}'):
+            return JsonResponse({'status': 'Ungültiges Token.'}, status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(get_metrics(), content_type=METRICS_CONTENT_TYPE)
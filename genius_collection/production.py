@@ -13,6 +13,7 @@ DEBUG = False
 
 # WhiteNoise configuration
 MIDDLEWARE = [
+    'genius_collection.core.instrumentation.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     # Add whitenoise middleware after the security middleware
@@ -27,6 +28,9 @@ MIDDLEWARE = [
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedStaticFilesStorage'
 
+# /metrics/ is only served with a METRICS_TOKEN
+METRICS_REQUIRE_TOKEN = True
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -35,6 +35,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'genius_collection.core.instrumentation.InstrumentationMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -128,8 +129,34 @@ CORS_ALLOWED_ORIGINS = [
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by all worker processes and instances, see core/tiered_cache.py
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SHARED_CACHE_DIR', BASE_DIR / 'cache'),
     }
 }
+if 'REDIS_URL' in os.environ:
+    # Requires the redis package
+    CACHES['shared'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+
+# Bearer token required to scrape /metrics/, see core/metrics.py
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Without a METRICS_TOKEN, /metrics/ is not found if this is set
+METRICS_REQUIRE_TOKEN = False
+
+# Where the pictures are stored, see core/storage.py
+BLOB_STORAGE_BACKEND = 'genius_collection.core.storage.AzureBlobStorage'
+# Only used by the FileSystemBlobStorage backend
+BLOB_STORAGE_ROOT = BASE_DIR / 'blobs'
+
+# Fail requests exceeding the query budget of their view instead of logging it, see core/instrumentation.py
+QUERY_BUDGETS_ENFORCED = False
+# Enforces the query budgets
+TEST_RUNNER = 'genius_collection.core.testing.TestRunner'
 
 LOGGING = {
     'version': 1,
@@ -144,4 +171,10 @@ LOGGING = {
         'handlers': ['console'],
         'level': 'DEBUG',
     },
+    'loggers': {
+        # Pillow logs every plugin and chunk it reads
+        'PIL': {
+            'level': 'INFO',
+        },
+    },
 }
\ No newline at end of file
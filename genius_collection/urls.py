@@ -10,6 +10,8 @@ router = routers.DefaultRouter()
 router.register(r'users', views.UserViewSet)
 router.register(r'cards', views.CardViewSet)
 router.register(r'quiz', views.QuizQuestionViewSet, basename='quiz')
+router.register(r'leaderboard', views.LeaderboardViewSet, basename='leaderboard')
+router.register(r'jobs', views.JobViewSet)
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -34,5 +36,7 @@ urlpatterns = [
     path('overview/', views.OverviewViewSet.as_view()),
     path('distribute/', views.DistributeViewSet.as_view()),
     path('delete-user-and-card/', views.DeleteUserAndCard.as_view()),
-    path('picture/', views.PictureViewSet.as_view())
+    path('picture/', views.PictureView.as_view()),
+    path('instrumentation/', views.InstrumentationViewSet.as_view()),
+    path('metrics/', views.MetricsView.as_view())
 ]
@@ -0,0 +1,19 @@
+#!/bin/sh
+# Startup command of the App Service: runs the job worker next to the web app, see README.md
+
+# The uvicorn workers and the job worker write their metrics to this directory, which /metrics/ sums up.
+# It is local to the instance and emptied on every start, see the section Metrics in README.md
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-metrics}"
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# The worker is restarted whenever it exits, e.g. after a crash or a lost database connection
+(
+  while true; do
+    python manage.py worker
+    echo "Worker exited with status $?, restarting in 5 seconds."
+    sleep 5
+  done
+) &
+
+exec python -m uvicorn genius_collection.asgi:application --host 0.0.0.0 --port 8000 --workers 4